@@ -0,0 +1,38 @@
+# config/gunicorn.conf.py
+# gunicorn -c config/gunicorn.conf.py config.wsgi
+#
+# Every worker keeps its own Prometheus metrics; with PROMETHEUS_MULTIPROC_DIR
+# set they are written to mmap'd files in that directory and /metrics on any
+# worker reports the sum over all of them (see core/metrics.py).
+#
+# Ingestion commands (embed_docs, run_ingestion_worker) are separate processes:
+# export the same PROMETHEUS_MULTIPROC_DIR for them (default below:
+# $TMPDIR/gpt_draa_metrics) or their ingestion throughput never shows on
+# /metrics. Restarting gunicorn empties the directory, which Prometheus sees
+# as a counter reset.
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'gpt_draa_metrics'))
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 180))
+
+def on_starting(server):
+    # Files left by a previous run would be added to this run's counters
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def post_worker_init(worker):
+    # Load the embedding model and vector index before this worker takes
+    # traffic. Done here, not in config/wsgi.py, so tools and tests that
+    # import the application don't pay for it (see core/warmup.py)
+    from core.warmup import warm_up_on_start
+    warm_up_on_start()
+
+def child_exit(server, worker):
+    from core.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,167 @@
+# core/answer_cache.py
+import os
+import threading
+import time
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+# Minimum cosine similarity between query embeddings for a cached answer to be reused
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1000))
+
+def chunk_fingerprints(ids, metadatas):
+    """
+    Identify retrieved chunks by id plus content hash, so a chunk that was
+    re-embedded with new text no longer matches answers built on the old text
+    (even when the re-embed happened in another process).
+    """
+    metadatas = metadatas or [{}] * len(ids)
+    return tuple(
+        f"{chunk_id}:{(metadata or {}).get('content_hash', '')}"
+        for chunk_id, metadata in zip(ids, metadatas)
+    )
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class CachedAnswer:
+    def __init__(self, query_text, embedding, answer, created_at):
+        self.query_text = query_text
+        self.embedding = embedding
+        self.answer = answer
+        self.created_at = created_at
+        self.similarity = None
+
+
+class SemanticAnswerCache:
+    """
+    In-process cache of LLM answers. A cached answer is reused when the new
+    query has the same language and retrieved chunks and its embedding is
+    within the cosine threshold of the cached query.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_SIZE, enabled=ANSWER_CACHE_ENABLED):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._buckets = {}       # (language, chunk fingerprints) -> [CachedAnswer]
+        self._chunk_index = {}   # chunk id -> set of bucket keys using it
+        self._count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _expired(self, entry, now):
+        return now - entry.created_at > self.ttl
+
+    def lookup(self, query_embedding, language, fingerprints):
+        """Return the closest fresh CachedAnswer above the threshold, or None"""
+        if not self.enabled or not fingerprints:
+            return None
+
+        query = _unit(query_embedding)
+        key = (language, tuple(fingerprints))
+        now = time.time()
+        best = None
+        best_similarity = self.threshold
+
+        with self._lock:
+            entries = self._buckets.get(key, [])
+            fresh = [entry for entry in entries if not self._expired(entry, now)]
+            if len(fresh) != len(entries):
+                self._count -= len(entries) - len(fresh)
+                if fresh:
+                    self._buckets[key] = fresh
+                else:
+                    self._drop_bucket(key)
+
+            for entry in fresh:
+                similarity = float(np.dot(query, entry.embedding))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        hit = CachedAnswer(best.query_text, best.embedding, best.answer, best.created_at)
+        hit.similarity = best_similarity
+        return hit
+
+    def store(self, query_text, query_embedding, language, fingerprints, answer):
+        if not self.enabled or not fingerprints:
+            return
+
+        key = (language, tuple(fingerprints))
+        entry = CachedAnswer(query_text, _unit(query_embedding), answer, time.time())
+
+        with self._lock:
+            self._buckets.setdefault(key, []).append(entry)
+            self._count += 1
+            for fingerprint in fingerprints:
+                chunk_id = fingerprint.rsplit(':', 1)[0]
+                self._chunk_index.setdefault(chunk_id, set()).add(key)
+            if self._count > self.max_entries:
+                self._evict_oldest()
+
+    def _drop_bucket(self, key):
+        entries = self._buckets.pop(key, [])
+        for fingerprint in key[1]:
+            chunk_id = fingerprint.rsplit(':', 1)[0]
+            keys = self._chunk_index.get(chunk_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._chunk_index[chunk_id]
+        return entries
+
+    def _evict_oldest(self):
+        while self._count > self.max_entries and self._buckets:
+            key = min(self._buckets, key=lambda k: self._buckets[k][0].created_at)
+            entries = self._buckets[key]
+            entries.pop(0)
+            self._count -= 1
+            if not entries:
+                self._drop_bucket(key)
+
+    def invalidate_chunks(self, chunk_ids):
+        """Drop every cached answer built on any of chunk_ids (re-embedded or deleted chunks)"""
+        with self._lock:
+            keys = set()
+            for chunk_id in chunk_ids:
+                keys |= self._chunk_index.get(chunk_id, set())
+            for key in keys:
+                self._count -= len(self._drop_bucket(key))
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._chunk_index.clear()
+            self._count = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': self._count,
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,78 @@
+# core/bulk_ingestion.py
+# Helpers for `manage.py embed_docs --workers N`. Worker processes only
+# extract, chunk and encode; the parent process is the single writer to
+# ChromaDB, since a PersistentClient must not be written from several
+# processes at once. Encoded batches travel to the parent one at a time
+# through a bounded queue, so memory stays at about one batch per worker
+# whatever the size of the documents.
+import json
+import os
+
+# Set in each worker by init_worker
+_batch_queue = None
+
+def init_worker(torch_threads, batch_queue):
+    """Pool initializer: split CPU threads between workers and load the model once (unless served)"""
+    global _batch_queue
+    _batch_queue = batch_queue
+
+    import torch
+    torch.set_num_threads(max(1, torch_threads))
+
+    from core import pdf_extraction
+    # Files are already processed in parallel; a nested extraction pool per worker would oversubscribe
+    pdf_extraction.PDF_EXTRACT_WORKERS = 1
+
+    from core.embedding_utils import embedding_client, get_embedding_model
+    if not embedding_client.remote:
+        get_embedding_model()
+
+def encode_document(file_name, language_code, document_metadata, existing_metadata, batch_size):
+    """
+    Run in a worker: extract, chunk and encode one document, handing each
+    batch to the parent as soon as it is encoded.
+
+    Puts ('batch', file_name, changed, metadata_only) per batch (see
+    iter_encoded_batches), then ('done', file_name, stats) or ('error',
+    file_name, message). The queue is bounded, so a worker that gets ahead
+    of the parent's writes blocks instead of buffering the document.
+    """
+    from core.embedding_utils import iter_encoded_batches, new_ingest_stats
+
+    stats = new_ingest_stats()
+    try:
+        for changed, metadata_only in iter_encoded_batches(
+                file_name, language_code, existing_metadata,
+                batch_size=batch_size, document_metadata=document_metadata, stats=stats):
+            _batch_queue.put(('batch', file_name, changed, metadata_only))
+    except Exception as e:
+        _batch_queue.put(('error', file_name, str(e)))
+        return
+    _batch_queue.put(('done', file_name, stats))
+
+def file_signature(file_path, language_code, document_metadata):
+    """What a checkpoint entry must match for a file to count as already embedded"""
+    stat = os.stat(file_path)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'language': language_code,
+        'metadata': document_metadata,
+    }
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return {}
+
+def save_checkpoint(path, checkpoint):
+    """Write atomically, so a crash mid-write cannot lose the finished files"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
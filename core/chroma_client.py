@@ -1,4 +1,52 @@
-from chromadb import PersistentClient
+# core/chroma_client.py
+# The client is opened on first use rather than at import, so commands that
+# never touch the vector store (migrate, check, shell...) don't pay for it.
+import os
+import threading
 
-chroma_client = PersistentClient(path="chroma_data")
-collection = chroma_client.get_or_create_collection("legal_docs")
+CHROMA_PATH = "chroma_data"
+COLLECTION_NAME = "legal_docs"
+# '' keeps every chunk in COLLECTION_NAME; 'language' uses one collection per
+# language (run manage.py shard_collection first to split an existing store)
+CHROMA_SHARD_BY = os.getenv('CHROMA_SHARD_BY', '').lower()
+
+_client = None
+_collection = None
+_lock = threading.Lock()
+
+def get_chroma_client():
+    global _client
+    with _lock:
+        if _client is None:
+            from chromadb import PersistentClient
+            _client = PersistentClient(path=CHROMA_PATH)
+        return _client
+
+def get_collection():
+    global _collection
+    client = get_chroma_client()
+    with _lock:
+        if _collection is None:
+            if CHROMA_SHARD_BY == 'language':
+                from core.sharding import ShardedCollection
+                _collection = ShardedCollection(client, COLLECTION_NAME)
+            else:
+                _collection = client.get_or_create_collection(COLLECTION_NAME)
+        return _collection
+
+def is_loaded():
+    return _client is not None
+
+
+class _Lazy:
+    """Stands in for an object that is created on first attribute access"""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+chroma_client = _Lazy(get_chroma_client)
+collection = _Lazy(get_collection)
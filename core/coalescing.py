@@ -0,0 +1,118 @@
+# core/coalescing.py
+import asyncio
+import threading
+
+from core.embedding_cache import normalize_prompt
+from core.search_filters import filters_key
+
+def ask_flight_key(prompt, language, filters=None, mode=None):
+    return (language, normalize_prompt(prompt), filters_key(filters), mode)
+
+
+class _Call:
+    def __init__(self, future=None):
+        self.done = threading.Event()
+        self.future = future
+        self.result = None
+        self.error = None
+        self.followers = 0
+        # Callers (leader included) still awaiting an async flight
+        self.waiters = 1
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent executions of the same work. The first caller
+    for a key (the leader) runs the function; callers arriving while it is
+    in flight wait for and share its result (or exception).
+
+    do() and ado() return (result, coalesced, followers), where coalesced is
+    True for callers that did not execute the function themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def _join(self, calls, key, make_call):
+        with self._lock:
+            call = calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.coalesced += 1
+                return call, False
+            call = calls[key] = make_call()
+            self.executions += 1
+            return call, True
+
+    def _finish(self, calls, key, call):
+        with self._lock:
+            if calls.get(key) is call:
+                del calls[key]
+            return call.followers
+
+    def do(self, key, fn):
+        call, leader = self._join(self._calls, key, _Call)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True, call.followers
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            followers = self._finish(self._calls, key, call)
+            call.done.set()
+        return call.result, False, followers
+
+    async def ado(self, key, coro_fn):
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        # The work runs as its own task, so cancelling the leader (its client
+        # disconnected) does not cancel it for the followers still waiting.
+        # Tasks belong to one event loop, so flights are not shared across loops
+        call, leader = self._join(self._async_calls, flight_key, _Call)
+
+        if leader:
+            async def run():
+                try:
+                    return await coro_fn()
+                finally:
+                    self._finish(self._async_calls, flight_key, call)
+
+            call.future = loop.create_task(run())
+            # Retrieve the outcome so an unawaited failure does not log "exception never retrieved"
+            call.future.add_done_callback(lambda task: task.cancelled() or task.exception())
+        else:
+            call.waiters += 1
+
+        try:
+            result = await asyncio.shield(call.future)
+        except asyncio.CancelledError:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.future.done():
+                # Nobody is waiting for the answer any more: stop computing it
+                self._finish(self._async_calls, flight_key, call)
+                call.future.cancel()
+            raise
+        return result, not leader, call.followers
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls) + len(self._async_calls)
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+        }
+
+
+ask_flights = SingleFlight()
@@ -0,0 +1,127 @@
+# core/context_packing.py
+import math
+import os
+import re
+import threading
+
+# Tokens of retrieved context allowed into one prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+# Cut a chunk that does not fit at its last whole sentence instead of dropping it
+CONTEXT_TRIM_SENTENCES = os.getenv('CONTEXT_TRIM_SENTENCES', 'true').lower() in ('1', 'true', 'yes')
+# Trimmed pieces shorter than this are not worth the tokens
+CONTEXT_MIN_TRIM_TOKENS = int(os.getenv('CONTEXT_MIN_TRIM_TOKENS', 24))
+# Hugging Face tokenizer matching the LLM (e.g. meta-llama/Llama-3.2-3B-Instruct);
+# when unset, tokens are estimated at ~4 characters each
+LLM_TOKENIZER = os.getenv('LLM_TOKENIZER', '')
+
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_END_RE = re.compile(r'[.!?።](?=\s|$)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer():
+    """The LLM's tokenizer if LLM_TOKENIZER is set and loads, else None (approximate counts)"""
+    global _tokenizer
+    if _tokenizer is None and LLM_TOKENIZER:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+                except Exception as e:
+                    print(f"Could not load tokenizer {LLM_TOKENIZER}, estimating token counts: {e}")
+                    _tokenizer = False
+    return _tokenizer or None
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def tokenizer_name():
+    return LLM_TOKENIZER if get_tokenizer() is not None else f'approx_{CHARS_PER_TOKEN}_chars'
+
+def trim_to_sentences(text, max_tokens):
+    """Longest prefix of text ending at a sentence boundary that fits max_tokens, or ''"""
+    best = ''
+    for match in _SENTENCE_END_RE.finditer(text):
+        candidate = text[:match.end()].strip()
+        if count_tokens(candidate) > max_tokens:
+            break
+        best = candidate
+    return best
+
+def _dedup_key(chunk):
+    return _WHITESPACE_RE.sub(' ', chunk).strip().casefold()
+
+def pack_context(chunks, budget=None, trim_sentences=None):
+    """
+    Pick chunks, best-ranked first, until the token budget is spent.
+
+    Duplicate chunks (same text up to whitespace and case, e.g. the same
+    document uploaded twice) are skipped. A chunk that does not fit is cut
+    at its last sentence boundary when trim_sentences is on; packing stops
+    at the first chunk that cannot be used at all, so lower-ranked chunks
+    never displace better ones.
+
+    Returns (packed chunk texts, stats).
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    trim_sentences = CONTEXT_TRIM_SENTENCES if trim_sentences is None else trim_sentences
+
+    packed = []
+    seen = set()
+    used = 0
+    duplicates = 0
+    trimmed = 0
+
+    for chunk in chunks:
+        chunk = chunk.strip()
+        key = _dedup_key(chunk)
+        if not key or key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+
+        tokens = count_tokens(chunk)
+        if used + tokens > budget:
+            if not trim_sentences or budget - used < CONTEXT_MIN_TRIM_TOKENS:
+                break
+            chunk = trim_to_sentences(chunk, budget - used)
+            tokens = count_tokens(chunk) if chunk else 0
+            if tokens >= CONTEXT_MIN_TRIM_TOKENS:
+                packed.append(chunk)
+                used += tokens
+                trimmed += 1
+            # The budget is spent either way
+            break
+
+        packed.append(chunk)
+        used += tokens
+
+    return packed, {
+        'context_token_budget': budget,
+        'context_tokens': used,
+        'chunks_packed': len(packed),
+        'chunks_trimmed': trimmed,
+        'duplicate_chunks_skipped': duplicates,
+    }
+
+def build_prompt(user_prompt, chunks, budget=None):
+    """
+    Build the LLM prompt from the retrieved chunks (best first) within the
+    token budget. Returns (prompt, stats); stats includes prompt_tokens.
+    """
+    packed, stats = pack_context(chunks, budget)
+    if packed:
+        context = "\n\n".join(f"[{i}] {chunk}" for i, chunk in enumerate(packed, start=1))
+        prompt = f"Context:\n{context}\n\nQuestion: {user_prompt}\n\nBrief answer:"
+    else:
+        prompt = f"Question: {user_prompt}\n\nBrief answer about digital rights in Africa:"
+    stats['prompt_tokens'] = count_tokens(prompt)
+    stats['tokenizer'] = tokenizer_name()
+    return prompt, stats
@@ -0,0 +1,113 @@
+# core/embedding_backends.py
+# Ways of running the same SentenceTransformer on CPU. Chunks stored in
+# ChromaDB were encoded by whichever backend was active at ingest, so check
+# the drift (manage.py compare_embedding_backends) before switching a
+# deployment to a backend other than the one its corpus was built with.
+import os
+import time
+
+import numpy as np
+
+# torch (full precision), int8 (dynamic quantization of the Linear layers) or onnx (ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+# Optional ONNX file inside the model repo, e.g. onnx/model_qint8_avx512_vnni.onnx
+EMBEDDING_ONNX_FILE = os.getenv('EMBEDDING_ONNX_FILE', '')
+
+BACKENDS = ('torch', 'int8', 'onnx')
+# SentenceTransformer(..., backend='onnx') first appeared in 3.2
+ONNX_MIN_SENTENCE_TRANSFORMERS = (3, 2)
+
+def _version_tuple(version):
+    """(major, minor) of a version string such as '3.2.1' or '3.3.0.dev0'"""
+    parts = []
+    for part in version.split('.')[:2]:
+        digits = ''.join(ch for ch in part if ch.isdigit())
+        parts.append(int(digits or 0))
+    return tuple(parts)
+
+def load_backend(name, model_name):
+    """Return a SentenceTransformer-compatible model (anything with .encode) for backend name"""
+    from sentence_transformers import SentenceTransformer
+
+    if name == 'torch':
+        return SentenceTransformer(model_name)
+
+    if name == 'int8':
+        import torch
+        model = SentenceTransformer(model_name, device='cpu')
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if name == 'onnx':
+        import sentence_transformers
+        if _version_tuple(sentence_transformers.__version__) < ONNX_MIN_SENTENCE_TRANSFORMERS:
+            raise RuntimeError(
+                f"The onnx embedding backend needs sentence-transformers>=3.2 "
+                f"(installed: {sentence_transformers.__version__})"
+            )
+        model_kwargs = {'file_name': EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+        try:
+            return SentenceTransformer(model_name, backend='onnx', model_kwargs=model_kwargs)
+        except (ImportError, TypeError) as e:
+            raise RuntimeError(
+                "The onnx embedding backend needs sentence-transformers>=3.2 "
+                "and optimum[onnxruntime] installed"
+            ) from e
+
+    raise ValueError(f"Unknown embedding backend '{name}', expected one of {', '.join(BACKENDS)}")
+
+def cosine_drift(reference, candidate):
+    """Row-wise cosine similarity between two embedding matrices of the same texts"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = np.sum(reference * candidate, axis=1)
+    return {
+        'mean_cosine': float(cosines.mean()),
+        'min_cosine': float(cosines.min()),
+        'mean_drift': float(1 - cosines.mean()),
+        'max_drift': float(1 - cosines.min()),
+    }
+
+def neighbour_agreement(reference, candidate, k=3):
+    """
+    Fraction of texts whose k nearest neighbours (within the sample) are
+    the same under both backends: what drift does to retrieval.
+    """
+    def top_k(matrix):
+        matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        similarity = matrix @ matrix.T
+        np.fill_diagonal(similarity, -np.inf)
+        return np.argsort(-similarity, axis=1)[:, :k]
+
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+    matches = [
+        set(a) == set(b)
+        for a, b in zip(top_k(reference), top_k(candidate))
+    ]
+    return sum(matches) / len(matches)
+
+def benchmark(model, texts, batch_size=32, single_queries=20):
+    """Batch encode throughput and single-query latency for one loaded backend"""
+    model.encode(texts[:1])  # First call allocates buffers; keep it out of the numbers
+
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size)
+    batch_s = time.perf_counter() - start
+
+    latencies = []
+    for text in texts[:single_queries]:
+        start = time.perf_counter()
+        model.encode(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return embeddings, {
+        'texts': len(texts),
+        'texts_per_sec': len(texts) / batch_s if batch_s > 0 else 0.0,
+        'single_p50_ms': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'single_p95_ms': float(np.percentile(latencies, 95)) if latencies else 0.0,
+    }
@@ -0,0 +1,131 @@
+# core/embedding_batcher.py
+import os
+import threading
+import time
+from collections import deque
+
+from core.histogram import Histogram
+
+EMBED_MICROBATCH_ENABLED = os.getenv('EMBED_MICROBATCH_ENABLED', '1') == '1'
+# Most encode calls folded into one forward pass
+EMBED_MICROBATCH_MAX_SIZE = int(os.getenv('EMBED_MICROBATCH_MAX_SIZE', 32))
+# Longest a call waits for others to join its batch
+EMBED_MICROBATCH_MAX_WAIT_MS = float(os.getenv('EMBED_MICROBATCH_MAX_WAIT_MS', 5))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class _Request:
+    __slots__ = ('text', 'encode_fn', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, text, encode_fn):
+        self.text = text
+        self.encode_fn = encode_fn
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Folds concurrent single-text encode calls into batched forward passes.
+
+    Callers block in encode() while a background thread collects requests
+    until max_batch_size are queued or the oldest has waited max_wait_ms,
+    then runs one encode_fn(list_of_texts) and hands each caller its row.
+    Time a request spends queued behind a running batch counts towards its
+    wait, so under load batches are dispatched back to back.
+    """
+
+    def __init__(self, max_batch_size=EMBED_MICROBATCH_MAX_SIZE,
+                 max_wait_ms=EMBED_MICROBATCH_MAX_WAIT_MS, enabled=EMBED_MICROBATCH_ENABLED):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self.enabled = enabled
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_MS_BUCKETS)
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+
+    def encode(self, text, encode_fn):
+        """Embed one text with encode_fn, batched with whatever else is in flight"""
+        if not self.enabled or self.max_batch_size == 1:
+            return encode_fn(text)
+
+        request = _Request(text, encode_fn)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._thread.start()
+            self._queue.append(request)
+            self.requests += 1
+            self._cond.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        max_wait = self.max_wait_ms / 1000
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = self._queue[0].enqueued + max_wait
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch_size))]
+            self._process(batch)
+
+    def _process(self, batch):
+        started = time.monotonic()
+        for request in batch:
+            self.queue_wait_ms.observe((started - request.enqueued) * 1000)
+        self.batch_sizes.observe(len(batch))
+        self.batches += 1
+
+        # Every caller normally passes the same model; group anyway so a batch never mixes models
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.encode_fn, []).append(request)
+
+        for encode_fn, requests in groups.items():
+            try:
+                vectors = encode_fn([request.text for request in requests])
+                for request, vector in zip(requests, vectors):
+                    request.result = vector
+            except Exception as e:
+                self.errors += 1
+                for request in requests:
+                    request.error = e
+            finally:
+                for request in requests:
+                    request.done.set()
+
+    def stats(self):
+        batch_sizes = self.batch_sizes.snapshot()
+        return {
+            'enabled': self.enabled,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'requests': self.requests,
+            'batches': self.batches,
+            'errors': self.errors,
+            'pending': len(self._queue),
+            'avg_batch_size': batch_sizes['mean'],
+            'batch_size_histogram': batch_sizes,
+            'queue_wait_ms_histogram': self.queue_wait_ms.snapshot(),
+        }
+
+
+query_batcher = MicroBatcher()
@@ -0,0 +1,206 @@
+# core/embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from core import metrics
+
+# In-process LRU size (entries per worker process)
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 2048))
+# Optional tier shared by all workers: '' (disabled), 'django' or 'sqlite'
+EMBEDDING_CACHE_SHARED = os.getenv('EMBEDDING_CACHE_SHARED', '').lower()
+EMBEDDING_CACHE_SHARED_SIZE = int(os.getenv('EMBEDDING_CACHE_SHARED_SIZE', 50000))
+EMBEDDING_CACHE_SQLITE_PATH = os.getenv('EMBEDDING_CACHE_SQLITE_PATH', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_DJANGO_ALIAS = os.getenv('EMBEDDING_CACHE_DJANGO_ALIAS', 'default')
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 7 * 24 * 3600))
+
+def normalize_prompt(text):
+    """Collapse case, unicode forms and whitespace so trivially different prompts share a key"""
+    return " ".join(unicodedata.normalize('NFKC', text).casefold().split())
+
+def cache_key(text, model_name):
+    normalized = normalize_prompt(text)
+    return hashlib.sha256(f"{model_name}\x00{normalized}".encode('utf-8')).hexdigest()
+
+def _to_bytes(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def _from_bytes(data):
+    return np.frombuffer(data, dtype=np.float32).copy()
+
+
+class DjangoCacheStore:
+    """Shared tier backed by a configured Django cache (e.g. Redis or Memcached)"""
+
+    def __init__(self, alias=EMBEDDING_CACHE_DJANGO_ALIAS, timeout=EMBEDDING_CACHE_TTL):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        data = self.cache.get(f"query_embedding:{key}")
+        return _from_bytes(data) if data is not None else None
+
+    def set(self, key, vector):
+        self.cache.set(f"query_embedding:{key}", _to_bytes(vector), timeout=self.timeout)
+
+
+class SQLiteStore:
+    """Shared tier in a local SQLite file, bounded to max_entries by least-recent use"""
+
+    def __init__(self, path=EMBEDDING_CACHE_SQLITE_PATH, max_entries=EMBEDDING_CACHE_SHARED_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+        return _from_bytes(row[0])
+
+    def set(self, key, vector):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                (key, _to_bytes(vector), time.time())
+            )
+        self._writes += 1
+        # Evicting on every write would cost a COUNT(*) per miss; check periodically instead
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        conn = self._connection()
+        (count,) = conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            with conn:
+                conn.execute(
+                    "DELETE FROM query_embeddings WHERE key IN "
+                    "(SELECT key FROM query_embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                )
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings: an in-process LRU in front of an optional shared store"""
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, shared_store=None):
+        self.max_entries = max_entries
+        self.shared_store = shared_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_errors = 0
+
+    @classmethod
+    def from_env(cls):
+        shared_store = None
+        if EMBEDDING_CACHE_SHARED == 'django':
+            shared_store = DjangoCacheStore()
+        elif EMBEDDING_CACHE_SHARED == 'sqlite':
+            shared_store = SQLiteStore()
+        return cls(shared_store=shared_store)
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_encode(self, text, model_name, encode_fn):
+        """Return the cached embedding for text, computing it with encode_fn on a miss"""
+        key = cache_key(text, model_name)
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.record_embedding_cache('hit')
+                return vector
+
+        if self.shared_store is not None:
+            try:
+                vector = self.shared_store.get(key)
+            except Exception as e:
+                self.shared_errors += 1
+                print(f"Embedding cache shared tier read failed: {e}")
+                vector = None
+            if vector is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                metrics.record_embedding_cache('shared_hit')
+                self._remember(key, vector)
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        metrics.record_embedding_cache('miss')
+        vector = np.asarray(encode_fn(text), dtype=np.float32)
+        self._remember(key, vector)
+
+        if self.shared_store is not None:
+            try:
+                self.shared_store.set(key, vector)
+            except Exception as e:
+                self.shared_errors += 1
+                print(f"Embedding cache shared tier write failed: {e}")
+
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for this process, for the monitoring endpoints"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'shared_tier': type(self.shared_store).__name__ if self.shared_store else None,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'shared_errors': self.shared_errors,
+            'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+        }
+
+
+query_embedding_cache = QueryEmbeddingCache.from_env()
@@ -0,0 +1,232 @@
+# core/embedding_server.py
+# One process (manage.py run_embedding_server) owns the SentenceTransformer
+# and serves encode requests to every web/ingestion worker on the box, so
+# the model is loaded once instead of once per worker.
+import base64
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+from core.embedding_batcher import query_batcher
+
+# unix:///path/to/embed.sock or http://127.0.0.1:8765; empty means encode in-process
+EMBEDDING_SERVER_URL = os.getenv('EMBEDDING_SERVER_URL', '')
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv('EMBEDDING_SERVER_TIMEOUT', 10))
+# After a failed call, encode in-process for this long before trying the server again
+EMBEDDING_SERVER_RETRY_SECONDS = float(os.getenv('EMBEDDING_SERVER_RETRY_SECONDS', 30))
+EMBEDDING_SERVER_FALLBACK = os.getenv('EMBEDDING_SERVER_FALLBACK', '1') == '1'
+
+DEFAULT_SERVER_URL = 'http://127.0.0.1:8765'
+# Every web worker thread may connect at once; the socketserver default of 5 resets them
+SERVER_LISTEN_BACKLOG = 256
+
+def pack_embeddings(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return {
+        'shape': list(vectors.shape),
+        'data': base64.b64encode(vectors.tobytes()).decode('ascii'),
+    }
+
+def unpack_embeddings(payload):
+    data = base64.b64decode(payload['data'])
+    return np.frombuffer(data, dtype=np.float32).reshape(payload['shape']).copy()
+
+def parse_server_url(url):
+    """Return ('unix', path) or ('http', host, port)"""
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix':
+        return 'unix', parsed.path
+    if parsed.scheme == 'http':
+        return 'http', parsed.hostname or '127.0.0.1', parsed.port or 80
+    raise ValueError(f"Unsupported embedding server URL: {url}")
+
+
+class _EncodeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        self._send_json(200, {
+            'status': 'ok',
+            'model': self.server.model_name,
+            'batcher': query_batcher.stats(),
+        })
+
+    def do_POST(self):
+        if self.path != '/encode':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            texts = json.loads(self.rfile.read(length))['texts']
+            if len(texts) == 1:
+                # Single queries from different workers are batched together here
+                vectors = np.asarray([query_batcher.encode(texts[0], self.server.encode_fn)])
+            else:
+                vectors = self.server.encode_fn(texts)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'model': self.server.model_name, 'embeddings': pack_embeddings(vectors)})
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = SERVER_LISTEN_BACKLOG
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class _ThreadingTCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = SERVER_LISTEN_BACKLOG
+
+
+def make_server(url, encode_fn, model_name):
+    """Build (but do not start) an embedding server listening on url"""
+    kind, *address = parse_server_url(url)
+    if kind == 'unix':
+        path = address[0]
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by a previous run
+        server = _ThreadingUnixHTTPServer(path, _EncodeHandler)
+    else:
+        server = _ThreadingTCPHTTPServer(tuple(address), _EncodeHandler)
+    server.encode_fn = encode_fn
+    server.model_name = model_name
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def local_encode(texts):
+    """In-process fallback: encode with this process's own copy of the model"""
+    from core.embedding_utils import get_embedding_model
+    return get_embedding_model().encode(texts)
+
+
+class EmbeddingClient:
+    """
+    Thin client for the embedding server with the same call shape as
+    SentenceTransformer.encode (a str gives one vector, a list gives a
+    matrix). Without a server URL, or while the server is unreachable,
+    texts are encoded in-process by the fallback.
+    """
+
+    def __init__(self, url=EMBEDDING_SERVER_URL, fallback=local_encode,
+                 timeout=EMBEDDING_SERVER_TIMEOUT, retry_seconds=EMBEDDING_SERVER_RETRY_SECONDS,
+                 allow_fallback=EMBEDDING_SERVER_FALLBACK):
+        self.url = url
+        self.fallback = fallback
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self.allow_fallback = allow_fallback
+        self._local = threading.local()
+        self._down_until = 0.0
+        self.remote_calls = 0
+        self.remote_errors = 0
+        self.local_calls = 0
+
+    @property
+    def remote(self):
+        return bool(self.url)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            kind, *address = parse_server_url(self.url)
+            if kind == 'unix':
+                conn = _UnixHTTPConnection(address[0], self.timeout)
+            else:
+                conn = http.client.HTTPConnection(*address, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _post(self, texts):
+        conn = self._connection()
+        body = json.dumps({'texts': texts}).encode('utf-8')
+        try:
+            conn.request('POST', '/encode', body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            data = json.loads(response.read())
+        except Exception:
+            # Drop the kept-alive connection; the next call reconnects
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status}: {data.get('error', '')}")
+        return unpack_embeddings(data['embeddings'])
+
+    def encode(self, texts):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+
+        if self.url and time.monotonic() >= self._down_until:
+            try:
+                try:
+                    vectors = self._post(batch)
+                except (OSError, http.client.HTTPException):
+                    # Usually a kept-alive connection the server has closed; retry once on a fresh one
+                    vectors = self._post(batch)
+                self.remote_calls += 1
+                return vectors[0] if single else vectors
+            except (OSError, ValueError, KeyError, http.client.HTTPException) as e:
+                self.remote_errors += 1
+                if not self.allow_fallback:
+                    raise
+                self._down_until = time.monotonic() + self.retry_seconds
+                print(f"Embedding server at {self.url} unavailable ({e}); "
+                      f"encoding in-process for {self.retry_seconds:.0f}s")
+
+        self.local_calls += 1
+        return self.fallback(texts)
+
+    def stats(self):
+        return {
+            'url': self.url or None,
+            'remote_calls': self.remote_calls,
+            'remote_errors': self.remote_errors,
+            'local_calls': self.local_calls,
+            'fallback_active': bool(self.url) and time.monotonic() < self._down_until,
+        }
+
+
+embedding_client = EmbeddingClient()
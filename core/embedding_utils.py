@@ -1,57 +1,290 @@
+import hashlib
 import os
-import fitz  # PyMuPDF
-import docx
-from sentence_transformers import SentenceTransformer
+import threading
+import time
 from core.chroma_client import chroma_client, collection
+from core.embedding_cache import query_embedding_cache
+from core.answer_cache import answer_cache
+from core.embedding_batcher import query_batcher
+from core.embedding_server import embedding_client
+from core.embedding_backends import load_backend, EMBEDDING_BACKEND
+from core.pdf_extraction import iter_document_segments
+from core.lexical_index import lexical_index
+from core import metrics
 
 DOCUMENTS_PATH = 'media/documents/'
-EMBEDDING_MODEL = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+EMBEDDING_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+# Number of chunks encoded and written to ChromaDB per write call
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 256))
+
+def get_embedding_model():
+    """
+    This process's own copy of the model on the EMBEDDING_BACKEND backend,
+    loaded on first use. Only the embedding server and the in-process
+    fallback need it; everything else encodes through embedding_client.
+    """
+    global _embedding_model
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            _embedding_model = load_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME)
+        return _embedding_model
+
+def encode_query(text):
+    """
+    Embed a user query, served from the query embedding cache when possible.
+    Cache misses from concurrent requests share forward passes through the
+    micro-batcher.
+    """
+    # Backends differ slightly, so their vectors are cached under separate keys
+    return query_embedding_cache.get_or_encode(
+        text, f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}",
+        lambda query: query_batcher.encode(query, embedding_client.encode)
+    )
 
 def extract_text(file_path):
-    if file_path.endswith('.pdf'):
-        doc = fitz.open(file_path)
-        return "\n".join([page.get_text() for page in doc])
-    elif file_path.endswith('.docx'):
-        doc = docx.Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
-    return ""
-
-def embed_and_store(file_name, language_code):
-    file_path = os.path.join(DOCUMENTS_PATH, file_name)
-    text = extract_text(file_path)
+    return "\n".join(iter_document_segments(file_path))
 
-    if not text.strip():
-        return f"❌ No text found in: {file_name}"
+def chunk_text(text, chunk_size=500):
+    return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+
+def iter_chunks(segments, chunk_size=500):
+    """
+    Chunk a stream of text segments without joining them up front. Yields
+    exactly what chunk_text("\\n".join(segments)) would return.
+    """
+    buffer = ""
+    first = True
+    for segment in segments:
+        buffer += segment if first else "\n" + segment
+        first = False
+        # Slice by offset and cut the leftover once; re-slicing the buffer per
+        # chunk copies the rest of a long segment every time
+        pos = 0
+        while len(buffer) - pos >= chunk_size:
+            yield buffer[pos:pos + chunk_size]
+            pos += chunk_size
+        buffer = buffer[pos:]
+    if buffer:
+        yield buffer
+
+def content_hash(chunk):
+    """Stable fingerprint of a chunk's text, stored in its ChromaDB metadata"""
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
 
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
-    embeddings = EMBEDDING_MODEL.encode(chunks)
+def existing_chunk_metadata(file_name):
+    """Metadata of the chunks already stored for a document, by chunk id"""
+    existing = collection.get(where={"source_document": file_name}, include=["metadatas"])
+    return dict(zip(existing.get("ids", []), existing.get("metadatas", [])))
 
-    embedded_ids = []
+def new_ingest_stats():
+    return {
+        'pages_done': 0,
+        'total_pages': 0,
+        'chunks_done': 0,
+        'changed': 0,
+        'has_text': False,
+        'extract_s': 0.0,
+        'encode_s': 0.0,
+        'store_s': 0.0,
+    }
 
-    for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
-        doc_id = f"{file_name}_{i}"
-        collection.add(
-            documents=[chunk],
-            embeddings=[emb.tolist()],
-            ids=[doc_id],
-            metadatas=[{
+def iter_encoded_batches(file_name, language_code, existing_metadata, batch_size=None,
+                         document_metadata=None, stats=None):
+    """
+    Extract, chunk and encode a document one batch at a time, without
+    touching ChromaDB.
+
+    Yields (changed, metadata_only) per batch of chunks: changed holds
+    (id, chunk, metadata, embedding) for chunks whose content hash differs
+    from existing_metadata, metadata_only holds (id, metadata) for unchanged
+    chunks whose metadata did. document_metadata (e.g. category) is copied
+    onto every chunk. stats, from new_ingest_stats(), is updated in place.
+    Nothing is yielded for a document without text.
+    """
+    if batch_size is None:
+        batch_size = EMBED_BATCH_SIZE
+    batch_size = max(1, int(batch_size))
+    if stats is None:
+        stats = new_ingest_stats()
+    document_metadata = {key: value for key, value in (document_metadata or {}).items() if value}
+
+    file_path = os.path.join(DOCUMENTS_PATH, file_name)
+    chunks = iter_chunks(iter_document_segments(file_path, stats))
+
+    def encode(batch):
+        changed = []
+        metadata_only = []
+        for i, chunk in batch:
+            doc_id = f"{file_name}_{i}"
+            metadata = {
                 "language": language_code,
                 "source_document": file_name,
                 "chunk_index": i,
-                "chunk_size": len(chunk)
-            }]
+                "chunk_size": len(chunk),
+                "content_hash": content_hash(chunk),
+                **document_metadata
+            }
+            stored = existing_metadata.get(doc_id)
+            if not stored or stored.get("content_hash") != metadata["content_hash"]:
+                changed.append((doc_id, chunk, metadata))
+            elif stored != metadata:
+                metadata_only.append((doc_id, metadata))
+
+        embeddings = []
+        if changed:
+            encode_start = time.perf_counter()
+            embeddings = embedding_client.encode([chunk for _, chunk, _ in changed])
+            stats['encode_s'] += time.perf_counter() - encode_start
+
+        stats['chunks_done'] += len(batch)
+        stats['changed'] += len(changed)
+        return [(doc_id, chunk, metadata, embedding)
+                for (doc_id, chunk, metadata), embedding in zip(changed, embeddings)], metadata_only
+
+    batch = []
+    index = 0
+    while True:
+        extract_start = time.perf_counter()
+        chunk = next(chunks, None)
+        stats['extract_s'] += time.perf_counter() - extract_start
+        if chunk is None:
+            break
+
+        batch.append((index, chunk))
+        index += 1
+        stats['has_text'] = stats['has_text'] or bool(chunk.strip())
+        # Nothing is handed out until the document is known to contain text
+        if stats['has_text'] and len(batch) >= batch_size:
+            yield encode(batch)
+            batch = []
+
+    if stats['has_text'] and batch:
+        yield encode(batch)
+
+def store_batch(changed, metadata_only, stats):
+    """Write one batch from iter_encoded_batches to ChromaDB"""
+    store_start = time.perf_counter()
+    if changed:
+        # Cached answers built on rewritten chunks are no longer valid
+        answer_cache.invalidate_chunks([doc_id for doc_id, _, _, _ in changed])
+    if metadata_only:
+        collection.update(ids=[doc_id for doc_id, _ in metadata_only],
+                          metadatas=[metadata for _, metadata in metadata_only])
+    if changed:
+        collection.upsert(
+            documents=[chunk for _, chunk, _, _ in changed],
+            embeddings=[embedding.tolist() for _, _, _, embedding in changed],
+            ids=[doc_id for doc_id, _, _, _ in changed],
+            metadatas=[metadata for _, _, metadata, _ in changed]
         )
-        print(f"✅ Added chunk ID: {doc_id} (first 100 chars): {chunk[:100]}...")
+    # Keep the BM25 index in step with the vector store
+    if metadata_only:
+        lexical_index.update_metadata(metadata_only)
+    if changed:
+        lexical_index.upsert_chunks([(doc_id, chunk, metadata) for doc_id, chunk, metadata, _ in changed])
+    stats['store_s'] += time.perf_counter() - store_start
+
+def remove_stale_chunks(file_name, existing_metadata, stats):
+    """Delete stored chunks beyond the document's current length; returns how many"""
+    current_ids = {f"{file_name}_{i}" for i in range(stats['chunks_done'])}
+    stale_ids = [doc_id for doc_id in existing_metadata if doc_id not in current_ids]
+    if stale_ids:
+        store_start = time.perf_counter()
+        answer_cache.invalidate_chunks(stale_ids)
+        collection.delete(ids=stale_ids)
+        lexical_index.delete_chunks(stale_ids)
+        stats['store_s'] += time.perf_counter() - store_start
+    return len(stale_ids)
+
+def refresh_document_metadata(file_name, document_metadata):
+    """Rewrite document-level metadata (category, type...) on a document's stored chunks"""
+    existing = collection.get(where={"source_document": file_name}, include=["metadatas"])
+    ids = existing.get("ids", [])
+    if not ids:
+        return 0
+    # ChromaDB merges metadata on update; a None value removes the key
+    changes = {key: value or None for key, value in document_metadata.items()}
+    metadatas = [{**(metadata or {}), **changes} for metadata in existing["metadatas"]]
+    collection.update(ids=ids, metadatas=metadatas)
+    lexical_index.update_metadata(list(zip(ids, metadatas)))
+    return len(ids)
+
+def embed_result_message(file_name, stats, removed, elapsed):
+    chunks_per_sec = stats['changed'] / elapsed if elapsed > 0 else 0.0
+    pages_per_sec = stats['pages_done'] / elapsed if elapsed > 0 else 0.0
+    skipped = stats['chunks_done'] - stats['changed']
+    return (f"✅ Embedded {stats['changed']} of {stats['chunks_done']} chunks from: {file_name} "
+            f"({skipped} unchanged, {removed} removed, {chunks_per_sec:.1f} chunks/sec, "
+            f"{stats['pages_done']} pages at {pages_per_sec:.1f} pages/sec)")
+
+def embed_and_store(file_name, language_code, batch_size=None, progress_callback=None,
+                    document_metadata=None):
+    """
+    Chunk, encode and store a document in ChromaDB, one write per batch.
+
+    Text is extracted page by page (large PDFs in parallel, see
+    core/pdf_extraction.py) and chunked, encoded and written as it arrives,
+    so memory stays bounded by the extraction window and one batch of chunks
+    instead of growing with the size of the document.
+
+    Each chunk carries a content_hash in its metadata. Chunks whose hash
+    matches what is already stored are not re-encoded (only their metadata
+    is refreshed if it changed), and chunks that no longer exist in the
+    document are deleted, so re-embedding an unchanged file is cheap.
 
-        embedded_ids.append(doc_id)
+    progress_callback, if given, is called after every batch with a dict of
+    chunks_done, total_chunks, chunks_encoded, pages_done, total_pages,
+    elapsed_s, chunks_per_sec, pages_per_sec and the cumulative extract_s /
+    encode_s / store_s stage timings. Until the last page is read total_chunks is an
+    estimate extrapolated from the pages done so far.
+    """
+    existing_metadata = existing_chunk_metadata(file_name)
+    stats = new_ingest_stats()
+    start_time = time.perf_counter()
+
+    def report(final=False):
+        if progress_callback:
+            elapsed = time.perf_counter() - start_time
+            chunks_done = stats['chunks_done']
+            total_chunks = chunks_done
+            if not final and 0 < stats['pages_done'] < stats['total_pages']:
+                total_chunks = int(chunks_done * stats['total_pages'] / stats['pages_done'])
+            progress_callback({
+                'file_name': file_name,
+                'chunks_done': chunks_done,
+                'total_chunks': total_chunks,
+                'pages_done': stats['pages_done'],
+                'total_pages': stats['total_pages'],
+                'elapsed_s': elapsed,
+                'chunks_encoded': stats['changed'],
+                'chunks_per_sec': chunks_done / elapsed if elapsed > 0 else 0.0,
+                'pages_per_sec': stats['pages_done'] / elapsed if elapsed > 0 else 0.0,
+                'extract_s': stats['extract_s'],
+                'encode_s': stats['encode_s'],
+                'store_s': stats['store_s'],
+            })
+
+    batches = iter_encoded_batches(file_name, language_code, existing_metadata,
+                                   batch_size=batch_size, document_metadata=document_metadata,
+                                   stats=stats)
+    for changed, metadata_only in batches:
+        store_batch(changed, metadata_only, stats)
+        report()
+
+    if not stats['has_text']:
+        return f"❌ No text found in: {file_name}"
+
+    removed = remove_stale_chunks(file_name, existing_metadata, stats)
+    report(final=True)
+    metrics.record_ingestion(stats)
+    metrics.set_chroma_chunks(collection.count())
 
-    print("\n✅ Finished embedding. Summary:")
-    print(f"📄 File: {file_name}")
-    print(f"🧩 Total Chunks Embedded: {len(chunks)}")
-    print(f"🗂️ Stored in Collection: legal_docs")
-    print(f"📁 ChromaDB Path: {os.path.abspath('chroma_data')}")
     # PersistentClient auto-persists, no need to call persist()
-    return f"✅ Embedded {len(chunks)} chunks from: {file_name}"
+    return embed_result_message(file_name, stats, removed, time.perf_counter() - start_time)
 
 # Optional: debug what's already in the DB
 def show_current_chunks():
@@ -63,5 +296,3 @@ def show_current_chunks():
         preview = results["documents"][i][:100]
         lang = results["metadatas"][i].get("language", "unknown")
         print(f"🆔 {doc_id} | 🌍 {lang} | 📄 Preview: {preview}...")
-
-
@@ -1,9 +1,29 @@
 # core/gpt_client.py
 import requests
+import asyncio
+import json
 import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from core import metrics
+
+try:
+    import httpx  # Only needed by the async ask path
+except ImportError:
+    httpx = None
 
 # Get timeout from environment variable or use default
 DEFAULT_TIMEOUT = int(os.getenv('LLM_TIMEOUT', 120))
+# Pooled connections the async client keeps to the LLM server
+LLM_ASYNC_MAX_CONNECTIONS = int(os.getenv('LLM_ASYNC_MAX_CONNECTIONS', 200))
+# Requests allowed to run against each model server at once (per process)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+# Requests allowed to wait for a free slot; beyond this new requests are rejected
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 32))
+# Seconds a queued request waits for a slot before it is rejected
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 30))
 
 def is_garbled_response(text):
     """
@@ -42,18 +62,19 @@ def is_garbled_response(text):
         
     return False
 
-def ask_mistral(prompt, language='en', timeout=None):
-    """
-    Send prompt to local Llama 3.2 3B Instruct model via LM Studio
-    """
-    if timeout is None:
-        timeout = DEFAULT_TIMEOUT
-        
-    headers = {
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "llama-3.2-3b-instruct",  # Llama 3.2 3B Instruct model
+LLM_URL = "http://localhost:1234/v1/chat/completions"
+LLM_MODEL = os.getenv('LLM_MODEL', "llama-3.2-3b-instruct")  # Llama 3.2 3B Instruct model
+# Comma-separated OpenAI-compatible endpoints, each optionally "url|model";
+# defaults to the single local LM Studio server
+LLM_BACKENDS = os.getenv('LLM_BACKENDS', LLM_URL)
+# Consecutive timeouts/connection errors before a backend is taken out of rotation
+LLM_EJECT_AFTER_FAILURES = int(os.getenv('LLM_EJECT_AFTER_FAILURES', 2))
+# Seconds an ejected backend stays out of rotation before it is tried again
+LLM_EJECT_SECONDS = float(os.getenv('LLM_EJECT_SECONDS', 30))
+
+def build_payload(prompt, stream=False, model=LLM_MODEL):
+    return {
+        "model": model,
         "messages": [
             {"role": "user", "content": prompt}
         ],
@@ -62,30 +83,555 @@ def ask_mistral(prompt, language='en', timeout=None):
         "top_p": 0.9,        
         "frequency_penalty": 0.3,  # Less aggressive with better models
         "presence_penalty": 0.2,   
-        "stream": False
+        "stream": stream
     }
 
+def garbled_fallback(prompt):
+    """Answer to show instead of a garbled model response"""
+    # Try to extract a simple answer from the context if available
+    if "digital rights" in prompt.lower() or "africa" in prompt.lower():
+        return "Digital rights in Africa encompass access to technology, internet connectivity, data privacy, and digital literacy. Key challenges include bridging the digital divide and ensuring equitable access to digital services across the continent."
+    return "⚠️ The AI model produced an unclear response. This may be due to context overload or model limitations. Please try rephrasing your question or asking something more specific."
+
+def _is_timeout(error):
+    return isinstance(error, requests.exceptions.Timeout) or (
+        httpx is not None and isinstance(error, httpx.TimeoutException))
+
+def _is_connection_error(error):
+    return isinstance(error, requests.exceptions.ConnectionError) or (
+        httpx is not None and isinstance(error, httpx.ConnectError))
+
+def _is_http_error(error):
+    return isinstance(error, requests.exceptions.HTTPError) or (
+        httpx is not None and isinstance(error, httpx.HTTPStatusError))
+
+def llm_error_type(error):
+    """Error type label for the rag_llm_errors metric (overloads are counted where they are raised)"""
+    if _is_timeout(error):
+        return 'timeout'
+    if _is_connection_error(error):
+        return 'connection'
+    if _is_http_error(error):
+        return 'http'
+    return 'other'
+
+def _failed_backend(error):
+    """URL of the backend a request failed on (set by LLMRouter.track), else every configured one"""
+    url = getattr(error, 'llm_backend', None)
+    if url:
+        return url
+    return ', '.join(backend.url for backend in llm_client.router.backends)
+
+def describe_llm_error(error, prompt, timeout):
+    """User-facing message for a failed LLM request"""
+    backend = _failed_backend(error)
+    if _is_timeout(error):
+        return f"⚠️ Timeout: the model at {backend} took too long to respond (>{timeout}s). The model may be overloaded. Context retrieved successfully: {len(prompt.split())} words."
+    if _is_connection_error(error):
+        return f"⚠️ Connection Error: could not reach the LLM server at {backend}. Make sure it is running with its model loaded (see LLM_BACKENDS)."
+    return f"⚠️ Error communicating with the LLM at {backend}: {error}"
+
+def mark_phase(stats, phase):
+    """
+    Note in stats['phases'] that phase ended now (perf_counter). Phases run
+    back to back: queue_wait, then connect/first_token/generation when
+    streaming, or a single generation for a buffered completion.
+    """
+    if stats is not None:
+        stats.setdefault('phases', []).append((phase, time.perf_counter()))
+
+def note_fallback(stats, reason):
+    """Flag in stats that the returned text is a canned fallback, not the model's answer"""
+    if stats is not None:
+        stats['fallback'] = reason
+
+class LLMOverloadedError(Exception):
+    """Raised when the LLM wait queue is full or a queued request waited too long"""
+
+
+class LLMBackend:
+    """
+    One OpenAI-compatible inference server, its passive health/latency state
+    and its own concurrency slots: at most max_concurrency requests from this
+    process run against it at once, whatever happens to the other backends.
+    """
+
+    def __init__(self, url, model=LLM_MODEL, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.url = url
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.total_latency_ms = 0.0
+        self.ewma_latency_ms = None
+        self.last_error = None
+
+    def is_healthy(self, now=None):
+        return (now or time.time()) >= self.ejected_until
+
+    def stats(self):
+        now = time.time()
+        completed = self.requests - self.failures - self.cancelled - self.outstanding
+        return {
+            'url': self.url,
+            'model': self.model,
+            'healthy': self.is_healthy(now),
+            'ejected_for_s': round(max(0.0, self.ejected_until - now), 1),
+            'max_concurrency': self.max_concurrency,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'avg_latency_ms': round(self.total_latency_ms / completed, 1) if completed > 0 else None,
+            'ewma_latency_ms': round(self.ewma_latency_ms, 1) if self.ewma_latency_ms is not None else None,
+            'last_error': self.last_error,
+        }
+
+
+def parse_backends(spec, max_concurrency=LLM_MAX_CONCURRENCY):
+    backends = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url, _, model = entry.partition('|')
+        backends.append(LLMBackend(url.strip(), model.strip() or LLM_MODEL, max_concurrency))
+    return backends
+
+def _wake_async_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class LLMRouter:
+    """
+    Spreads requests over several backends, sending each to the healthy one
+    with the fewest outstanding requests that has a free slot. When every
+    healthy backend is at its cap, callers wait for a slot rather than
+    spilling onto another backend's share. Backends that time out or refuse
+    connections LLM_EJECT_AFTER_FAILURES times in a row are ejected for
+    LLM_EJECT_SECONDS (passive health checking: no probe traffic is sent).
+    """
+
+    def __init__(self, backends, eject_after=LLM_EJECT_AFTER_FAILURES, eject_seconds=LLM_EJECT_SECONDS):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+        self._async_waiters = []  # (loop, future) of coroutines waiting for a slot
+
+    def _take(self, exclude):
+        """Take a slot on the best available backend, or return None (caller holds the lock)"""
+        now = time.time()
+        candidates = [b for b in self.backends if b not in exclude] or self.backends
+        healthy = [b for b in candidates if b.is_healthy(now)]
+        if healthy:
+            order = sorted(healthy, key=lambda b: (b.outstanding, b.ewma_latency_ms or 0.0))
+        else:
+            # Everything is ejected: try the backend that is due back soonest
+            order = sorted(candidates, key=lambda b: b.ejected_until)
+        for backend in order:
+            if backend.slots.acquire(blocking=False):
+                backend.outstanding += 1
+                backend.requests += 1
+                return backend
+        return None
+
+    def acquire(self, exclude=(), timeout=0):
+        """
+        Pick a backend (other than those in exclude) and take one of its
+        slots, waiting up to timeout seconds for one to free up. Returns
+        None if none did.
+        """
+        deadline = time.monotonic() + timeout
+        with self._freed:
+            backend = self._take(exclude)
+            while backend is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._freed.wait(remaining)
+                backend = self._take(exclude)
+            return backend
+
+    async def aacquire(self, exclude=(), timeout=0):
+        """Async counterpart of acquire(); waits on the event loop instead of blocking it"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._lock:
+                backend = self._take(exclude)
+                if backend is not None:
+                    return backend
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    def release(self, backend, latency_ms, error=None, cancelled=False):
+        """
+        Give a backend's slot back. A cancelled request (the caller went
+        away) says nothing about the backend, so only the slot is returned;
+        latency and failure state are left alone.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            backend.slots.release()
+            self._freed.notify_all()
+            for loop, waiter in self._async_waiters:
+                loop.call_soon_threadsafe(_wake_async_waiter, waiter)
+
+            if cancelled:
+                backend.cancelled += 1
+                return
+
+            if error is None:
+                backend.consecutive_failures = 0
+                backend.total_latency_ms += latency_ms
+                backend.ewma_latency_ms = latency_ms if backend.ewma_latency_ms is None \
+                    else 0.8 * backend.ewma_latency_ms + 0.2 * latency_ms
+                return
+
+            backend.failures += 1
+            backend.last_error = f"{type(error).__name__}: {error}"[:200]
+            if _is_timeout(error) or _is_connection_error(error):
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_after:
+                    backend.ejected_until = time.time() + self.eject_seconds
+                    backend.consecutive_failures = 0
+
+    @contextmanager
+    def track(self, backend):
+        """Time a request holding one of backend's slots and release it with its outcome"""
+        start = time.perf_counter()
+        try:
+            yield backend
+        except Exception as e:
+            e.llm_backend = backend.url
+            self.release(backend, (time.perf_counter() - start) * 1000, error=e)
+            raise
+        except BaseException:
+            # Cancellation and closed streams (client went away) are not backend failures
+            self.release(backend, (time.perf_counter() - start) * 1000, cancelled=True)
+            raise
+        else:
+            self.release(backend, (time.perf_counter() - start) * 1000)
+
+    def stats(self):
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+
+async def _close_with_loop(client):
+    """Parked until the loop finalizes its async generators at shutdown"""
     try:
-        response = requests.post("http://localhost:1234/v1/chat/completions", json=payload, headers=headers, timeout=timeout)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Get the response text
-        response_text = data['choices'][0]['message']['content']
+        yield
+    finally:
+        await client.aclose()
+
+
+class LLMClient:
+    """
+    Client for one or more OpenAI-compatible chat completions endpoints.
+
+    Keeps a persistent keep-alive connection pool (requests.Session for the
+    sync paths, httpx.AsyncClient for the async path). Each backend takes at
+    most max_concurrency requests at once (see LLMRouter); requests beyond
+    that wait in a bounded queue, and when that queue is full they fail fast
+    with LLMOverloadedError instead of piling up until they all time out.
+    """
+
+    def __init__(self, backends=None, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_queue=LLM_MAX_QUEUE, queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.router = LLMRouter(backends or parse_backends(LLM_BACKENDS, max_concurrency))
+        self.max_concurrency = sum(backend.max_concurrency for backend in self.router.backends)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+
+        # Event loop -> (httpx.AsyncClient, the generator that closes it with the loop)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _enter_queue(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                metrics.record_llm_error('overloaded')
+                raise LLMOverloadedError(
+                    f"LLM queue is full ({self.waiting} waiting, {self.active} running)"
+                )
+            self.waiting += 1
+
+    def _leave_queue(self, acquired):
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+                metrics.record_llm_error('overloaded')
+
+    def _record_wait(self, stats, wait_start, backend):
+        if stats is not None:
+            stats['queue_wait_ms'] = stats.get('queue_wait_ms', 0.0) + (time.perf_counter() - wait_start) * 1000
+        mark_phase(stats, 'queue_wait')
+        if backend is None:
+            raise LLMOverloadedError(f"Timed out after {self.queue_timeout}s waiting for an LLM slot")
+
+    @contextmanager
+    def _hold(self, backend):
+        with self._lock:
+            self.active += 1
+        try:
+            with self.router.track(backend):
+                yield backend
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    @contextmanager
+    def slot(self, stats=None, exclude=()):
+        """
+        Hold a slot on the least loaded healthy backend (not in exclude) and
+        yield that backend; records queue_wait_ms into stats
+        """
+        wait_start = time.perf_counter()
+        backend = self.router.acquire(exclude)
+        if backend is None:
+            self._enter_queue()
+            backend = self.router.acquire(exclude, timeout=self.queue_timeout)
+            self._leave_queue(backend is not None)
+        self._record_wait(stats, wait_start, backend)
+        with self._hold(backend):
+            yield backend
+
+    async def _async_client_for_loop(self):
+        """
+        httpx clients are bound to a loop, so keep one per loop and close it
+        when the loop shuts down. asyncio.run, and so asgiref's async_to_sync
+        (the short-lived loops behind sync views), finalizes a loop's async
+        generators before closing it; each client is parked in one whose
+        finally closes the client's connection pool.
+        """
+        if httpx is None:
+            raise RuntimeError("The async ask path requires httpx (pip install httpx)")
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._async_clients.get(loop)
+        if entry is not None and not entry[0].is_closed:
+            return entry[0]
+
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_ASYNC_MAX_CONNECTIONS
+            ),
+            headers={"Content-Type": "application/json"}
+        )
+        closer = _close_with_loop(client)
+        await closer.asend(None)
+        with self._lock:
+            previous = self._async_clients.get(loop)
+            self._async_clients[loop] = (client, closer)
+        if previous is not None:
+            await previous[1].aclose()
+        return client
+
+    @asynccontextmanager
+    async def aslot(self, stats=None, exclude=()):
+        """Async counterpart of slot(); shares the backends' slots with the sync paths"""
+        wait_start = time.perf_counter()
+        # A free slot is taken without suspending, so it never counts as queued
+        backend = self.router.acquire(exclude)
+        if backend is None:
+            self._enter_queue()
+            backend = await self.router.aacquire(exclude, timeout=self.queue_timeout)
+            self._leave_queue(backend is not None)
+        self._record_wait(stats, wait_start, backend)
+        with self._hold(backend):
+            yield backend
+
+    def _should_retry(self, error, tried):
+        # A refused connection never reached the model, so another backend can safely take it
+        return _is_connection_error(error) and len(tried) < len(self.router.backends)
+
+    def complete(self, prompt, timeout, stats=None):
+        tried = []
+        while True:
+            try:
+                with self.slot(stats, exclude=tried) as backend:
+                    tried.append(backend)
+                    response = self.session.post(backend.url, json=build_payload(prompt, model=backend.model), timeout=timeout)
+                    mark_phase(stats, 'generation')
+                    response.raise_for_status()
+                    return response.json()['choices'][0]['message']['content']
+            except Exception as e:
+                if not self._should_retry(e, tried):
+                    raise
+
+    async def acomplete(self, prompt, timeout, stats=None):
+        client = await self._async_client_for_loop()
+        tried = []
+        while True:
+            try:
+                async with self.aslot(stats, exclude=tried) as backend:
+                    tried.append(backend)
+                    response = await client.post(backend.url, json=build_payload(prompt, model=backend.model), timeout=timeout)
+                    mark_phase(stats, 'generation')
+                    response.raise_for_status()
+                    return response.json()['choices'][0]['message']['content']
+            except Exception as e:
+                if not self._should_retry(e, tried):
+                    raise
+
+    def stream(self, prompt, timeout, stats=None):
+        """Yield text deltas parsed from the server-sent events of a streamed completion"""
+        tried = []
+        while True:
+            started = False
+            try:
+                with self.slot(stats, exclude=tried) as backend:
+                    tried.append(backend)
+                    for delta in self._stream_from(backend, prompt, timeout, stats):
+                        started = True
+                        yield delta
+                return
+            except Exception as e:
+                if started or not self._should_retry(e, tried):
+                    raise
+
+    def _stream_from(self, backend, prompt, timeout, stats=None):
+        headers = {"Accept": "text/event-stream"}
+        payload = build_payload(prompt, stream=True, model=backend.model)
+
+        with self.session.post(backend.url, json=payload, headers=headers, timeout=timeout, stream=True) as response:
+            # Headers arrive before the model starts producing tokens
+            mark_phase(stats, 'connect')
+            response.raise_for_status()
+            # text/event-stream has no charset, so requests would default to ISO-8859-1
+            response.encoding = 'utf-8'
+
+            first = True
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+
+                choices = json.loads(data).get('choices') or [{}]
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    if first:
+                        mark_phase(stats, 'first_token')
+                        first = False
+                    yield delta
+            mark_phase(stats, 'generation')
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+        }
+
+
+llm_client = LLMClient()
+
+def ask_mistral(prompt, language='en', timeout=None, stats=None):
+    """
+    Send prompt to the configured LLM backends (LM Studio by default)
+
+    Raises LLMOverloadedError when the request cannot get a concurrency
+    slot; other failures are returned as a user-facing message. If stats is
+    a dict, queue_wait_ms and the phase marks (see mark_phase) are recorded
+    into it, and stats['fallback'] is set ('garbled' or 'error') when the
+    text returned is not the model's answer.
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+
+    try:
+        response_text = llm_client.complete(prompt, timeout, stats)
         
         # Validate response quality
         if is_garbled_response(response_text):
-            # Try to extract a simple answer from the context if available
-            if "digital rights" in prompt.lower() or "africa" in prompt.lower():
-                return "Digital rights in Africa encompass access to technology, internet connectivity, data privacy, and digital literacy. Key challenges include bridging the digital divide and ensuring equitable access to digital services across the continent."
-            else:
-                return "⚠️ The AI model produced an unclear response. This may be due to context overload or model limitations. Please try rephrasing your question or asking something more specific."
+            metrics.record_llm_error('garbled')
+            note_fallback(stats, 'garbled')
+            return garbled_fallback(prompt)
         
         return response_text
-    except requests.exceptions.Timeout:
-        return f"⚠️ Timeout: Llama 3.2 model took too long to respond (>{timeout}s). The model may be overloaded. Context retrieved successfully: {len(payload.get('messages', [{}])[0].get('content', '').split())} words."
-    except requests.exceptions.ConnectionError:
-        return f"⚠️ Connection Error: Make sure LM Studio is running on localhost:1234 with Llama 3.2 3B Instruct loaded."
+    except LLMOverloadedError:
+        raise
     except Exception as e:
-        return f"⚠️ Error communicating with Llama 3.2: {e}"
+        metrics.record_llm_error(llm_error_type(e))
+        note_fallback(stats, 'error')
+        return describe_llm_error(e, prompt, timeout)
 
+def stream_mistral(prompt, language='en', timeout=None, stats=None):
+    """
+    Stream the model's answer as it is generated, yielding text deltas.
+    Request errors (including LLMOverloadedError) are raised to the caller
+    (see describe_llm_error).
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+
+    try:
+        yield from llm_client.stream(prompt, timeout, stats)
+    except LLMOverloadedError:
+        raise
+    except Exception as e:
+        metrics.record_llm_error(llm_error_type(e))
+        raise
+
+async def aask_mistral(prompt, language='en', timeout=None, stats=None):
+    """
+    Async counterpart of ask_mistral; awaits the model without holding a thread
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+
+    try:
+        response_text = await llm_client.acomplete(prompt, timeout, stats)
+
+        if is_garbled_response(response_text):
+            metrics.record_llm_error('garbled')
+            note_fallback(stats, 'garbled')
+            return garbled_fallback(prompt)
+
+        return response_text
+    except LLMOverloadedError:
+        raise
+    except Exception as e:
+        metrics.record_llm_error(llm_error_type(e))
+        note_fallback(stats, 'error')
+        return describe_llm_error(e, prompt, timeout)
@@ -0,0 +1,78 @@
+# core/histogram.py
+import threading
+from bisect import bisect_left
+
+# Upper bounds in milliseconds, for latency-style histograms
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Each bucket counts observations <= its upper
+    bound (and above the previous one); an implicit last bucket holds
+    everything larger. Percentiles are estimated by interpolating inside
+    the bucket, so their precision is bounded by the bucket layout.
+    """
+
+    def __init__(self, buckets=LATENCY_MS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, q):
+        """Estimated value below which a fraction q (0-1) of observations fall"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        return percentile_from_counts(self.buckets, counts, total, q)
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            value_sum = self.sum
+        return {
+            'buckets': [
+                {'le': bound, 'count': n}
+                for bound, n in zip(list(self.buckets) + ['+Inf'], counts)
+            ],
+            'count': total,
+            'sum': value_sum,
+            'mean': value_sum / total if total else 0.0,
+            'p50': percentile_from_counts(self.buckets, counts, total, 0.50),
+            'p95': percentile_from_counts(self.buckets, counts, total, 0.95),
+            'p99': percentile_from_counts(self.buckets, counts, total, 0.99),
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+
+def percentile_from_counts(buckets, counts, total, q):
+    """Estimate a percentile from per-bucket counts laid out as in Histogram"""
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for index, n in enumerate(counts):
+        if n and seen + n >= rank:
+            lower = buckets[index - 1] if index > 0 else 0.0
+            if index == len(buckets):
+                # Overflow bucket has no upper bound; report its lower edge
+                return float(lower)
+            upper = buckets[index]
+            return lower + (upper - lower) * (rank - seen) / n
+        seen += n
+    return float(buckets[-1])
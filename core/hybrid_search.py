@@ -0,0 +1,28 @@
+# core/hybrid_search.py
+import os
+
+import numpy as np
+
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid')
+# Default for requests that don't pick a mode; hybrid adds a BM25 search to every question
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector').lower()
+# Chunks retrieved per question; the prompt takes as many as fit CONTEXT_TOKEN_BUDGET
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 8))
+# Candidates taken from each retriever before fusion
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 10))
+# Standard RRF damping constant; larger values flatten the rank weights
+RRF_K = int(os.getenv('RRF_K', 60))
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked id lists into one, scoring each id by sum(1 / (k + rank))"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+
+def squared_l2(query_embedding, embeddings):
+    """Distances on the same scale ChromaDB's default l2 space reports"""
+    query = np.asarray(query_embedding, dtype=np.float32)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    return np.sum((matrix - query) ** 2, axis=1).tolist()
@@ -0,0 +1,114 @@
+# core/ingestion.py
+import os
+import socket
+import time
+import traceback
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from . import metrics
+from .models import IngestionJob
+from .search_filters import document_chunk_metadata
+
+def enqueue_ingestion(document, job_type='embed'):
+    """Queue a document for embedding and return the created job"""
+    return IngestionJob.objects.create(document=document, job_type=job_type)
+
+def default_worker_name(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+def claim_next_job(worker_name):
+    """
+    Atomically move the oldest queued job to running and return it.
+    SKIP LOCKED lets several workers poll the same table without blocking.
+    """
+    with transaction.atomic():
+        job = (IngestionJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(status='queued')
+               .order_by('created_at')
+               .first())
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.worker = worker_name
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'worker', 'started_at'])
+    return job
+
+def requeue_running_jobs():
+    """Put jobs left running by a crashed worker back on the queue"""
+    return IngestionJob.objects.filter(status='running').update(
+        status='queued', worker='', started_at=None, chunks_done=0
+    )
+
+def _stage_timings_ms(progress):
+    return {
+        'extract_ms': int(progress.get('extract_s', 0) * 1000),
+        'encode_ms': int(progress.get('encode_s', 0) * 1000),
+        'store_ms': int(progress.get('store_s', 0) * 1000),
+        'chunks_per_sec': round(progress.get('chunks_per_sec', 0.0), 1),
+        'pages_done': progress.get('pages_done', 0),
+        'total_pages': progress.get('total_pages', 0),
+        'pages_per_sec': round(progress.get('pages_per_sec', 0.0), 1),
+    }
+
+def run_job(job):
+    """Run a claimed job to completion and record the outcome on the job and its document"""
+    from .embedding_utils import embed_and_store
+
+    document = job.document
+    file_name = os.path.basename(document.file.name)
+    job_start = time.perf_counter()
+    stage_timings = {}
+
+    def on_progress(progress):
+        stage_timings.update(_stage_timings_ms(progress))
+        IngestionJob.objects.filter(id=job.id).update(
+            chunks_done=progress['chunks_done'],
+            total_chunks=progress['total_chunks'],
+            stage_timings=stage_timings
+        )
+
+    try:
+        result = embed_and_store(file_name, document.language, progress_callback=on_progress,
+                                 document_metadata=document_chunk_metadata(document))
+        failed = result.startswith('❌')
+        error = result if failed else ''
+    except Exception as e:
+        result = ''
+        failed = True
+        error = f"{e}\n{traceback.format_exc()}"
+
+    stage_timings['total_ms'] = int((time.perf_counter() - job_start) * 1000)
+
+    job.refresh_from_db(fields=['chunks_done', 'total_chunks'])
+    job.status = 'failed' if failed else 'completed'
+    metrics.record_ingested_document(job.status)
+    job.result_message = result
+    job.error = error
+    job.stage_timings = stage_timings
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result_message', 'error', 'stage_timings', 'finished_at'])
+
+    if failed:
+        document.processing_notes = f"Embedding failed (job #{job.id}): {error.splitlines()[0] if error else 'unknown error'}"
+    else:
+        document.is_processed = True
+        document.processing_notes = result
+    document.save(update_fields=['is_processed', 'processing_notes'])
+
+    return job
+
+def worker_loop(worker_name, stop_event, poll_interval=2.0, exit_when_idle=False):
+    """Claim and run jobs until stop_event is set (or the queue is empty, with exit_when_idle)"""
+    while not stop_event.is_set():
+        close_old_connections()
+        job = claim_next_job(worker_name)
+        if job is None:
+            if exit_when_idle:
+                break
+            stop_event.wait(poll_interval)
+            continue
+        run_job(job)
+    close_old_connections()
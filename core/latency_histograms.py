@@ -0,0 +1,111 @@
+# core/latency_histograms.py
+# Daily per-stage latency histograms, kept beside SystemPerformanceMetrics so
+# percentiles can be served without scanning QueryLog.
+from bisect import bisect_left
+from collections import Counter
+from datetime import timedelta
+
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from core.histogram import LATENCY_MS_BUCKETS, percentile_from_counts
+from core.models import LatencyHistogramBucket, QueryLog
+
+# Histogram stage -> QueryLog column it is built from
+STAGE_FIELDS = {
+    'response': 'response_time_ms',
+    'embedding': 'embedding_time_ms',
+    'search': 'search_time_ms',
+    'llm': 'llm_time_ms',
+    'llm_queue_wait': 'llm_queue_wait_ms',
+    'first_token': 'time_to_first_token_ms',
+}
+
+PERCENTILES = {'p50': 0.50, 'p90': 0.90, 'p95': 0.95, 'p99': 0.99}
+
+def bucket_index(value_ms):
+    """Position of value_ms in LATENCY_MS_BUCKETS; len(LATENCY_MS_BUCKETS) is the overflow bucket"""
+    return bisect_left(LATENCY_MS_BUCKETS, value_ms)
+
+def _bucket_counts(query_logs):
+    counts = Counter()
+    for query_log in query_logs:
+        day = timezone.localdate(query_log.timestamp)
+        for stage, field in STAGE_FIELDS.items():
+            value = getattr(query_log, field)
+            if value is not None:
+                counts[(day, stage, bucket_index(value))] += 1
+    return counts
+
+def record_latency_histograms(query_logs):
+    """
+    Add queries' stage latencies to their days' histograms. Missing bucket
+    rows are created in one INSERT, then each touched bucket is incremented
+    with an F() update, so concurrent writers never lose counts.
+    """
+    counts = _bucket_counts(query_logs)
+    if not counts:
+        return
+
+    LatencyHistogramBucket.objects.bulk_create(
+        [LatencyHistogramBucket(date=day, stage=stage, bucket=bucket) for day, stage, bucket in counts],
+        ignore_conflicts=True
+    )
+    for (day, stage, bucket), n in counts.items():
+        LatencyHistogramBucket.objects.filter(date=day, stage=stage, bucket=bucket).update(
+            count=F('count') + n
+        )
+
+def rebuild_latency_histograms(day):
+    """Replace a day's histograms with counts recomputed from its QueryLog rows"""
+    queries = QueryLog.objects.filter(timestamp__date=day).only('timestamp', *STAGE_FIELDS.values())
+    counts = _bucket_counts(queries.iterator())
+    LatencyHistogramBucket.objects.filter(date=day).delete()
+    LatencyHistogramBucket.objects.bulk_create([
+        LatencyHistogramBucket(date=bucket_day, stage=stage, bucket=bucket, count=n)
+        for (bucket_day, stage, bucket), n in counts.items()
+        if bucket_day == day
+    ])
+
+def _summary(counts):
+    total = sum(counts)
+    summary = {'count': total}
+    for name, q in PERCENTILES.items():
+        summary[name] = round(percentile_from_counts(LATENCY_MS_BUCKETS, counts, total, q), 1) if total else None
+    return summary
+
+def _empty_counts():
+    return [0] * (len(LATENCY_MS_BUCKETS) + 1)
+
+def _date_range(days):
+    end = timezone.localdate()
+    return end - timedelta(days=days - 1), end
+
+def stage_percentiles(days=1):
+    """{stage: {count, p50, p90, p95, p99}} in ms over the last `days` days (today included)"""
+    rows = (
+        LatencyHistogramBucket.objects.filter(date__range=_date_range(days))
+        .order_by().values('stage', 'bucket').annotate(total=Sum('count'))
+    )
+    counts = {stage: _empty_counts() for stage in STAGE_FIELDS}
+    for row in rows:
+        if row['stage'] in counts and row['bucket'] < len(LATENCY_MS_BUCKETS) + 1:
+            counts[row['stage']][row['bucket']] += row['total']
+    return {stage: _summary(stage_counts) for stage, stage_counts in counts.items()}
+
+def percentile_trend(stage='response', days=7, start=None):
+    """
+    Per-day {date, count, p50, p90, p95, p99} (ms) for one stage, oldest
+    first, one entry per day from start (default: the last `days` days)
+    """
+    if start is None:
+        start, end = _date_range(days)
+    else:
+        end = start + timedelta(days=days - 1)
+    counts = {start + timedelta(days=offset): _empty_counts() for offset in range(days)}
+    rows = LatencyHistogramBucket.objects.filter(date__range=(start, end), stage=stage) \
+        .values_list('date', 'bucket', 'count')
+    for day, bucket, n in rows:
+        if bucket < len(LATENCY_MS_BUCKETS) + 1:
+            counts[day][bucket] += n
+    return [{'date': day.strftime('%Y-%m-%d'), **_summary(day_counts)} for day, day_counts in sorted(counts.items())]
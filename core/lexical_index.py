@@ -0,0 +1,196 @@
+# core/lexical_index.py
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+from core.search_filters import FILTER_FIELDS
+
+LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', 'lexical_index.sqlite3')
+BM25_K1 = float(os.getenv('BM25_K1', 1.2))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+# Postings read per query term; a term in more chunks than this is scored over
+# the chunks where it occurs most often, not the whole postings list
+BM25_MAX_POSTINGS = int(os.getenv('BM25_MAX_POSTINGS', 5000))
+
+# Function words of the corpus languages, dropped from queries (the index keeps them)
+STOPWORDS = frozenset('''
+a about an and are as at be but by can do does for from has have how i if in is it its
+me my no not of on or our shall should so that the their them there these they this to
+was we what when where which who why will with would you your
+au aux avec ce ces dans de des du elle en est et il ils je la le les leur mais ne nous
+ou par pas pour qu que qui sa se ses son sont sur un une vous
+ambao kama katika kwa la na ni ya wa za
+'''.split())
+
+_TOKEN_RE = re.compile(r'\w+')
+
+def tokenize(text):
+    """Lowercased word tokens; keeps numbers and acronyms (article 19, CIPESA) intact"""
+    return _TOKEN_RE.findall(unicodedata.normalize('NFKC', text).casefold())
+
+
+class BM25Index:
+    """
+    Inverted index over chunk text in a local SQLite file, scored with
+    Okapi BM25. Chunks are keyed by the same ids as in ChromaDB and carry
+    the filterable metadata, so lexical search honours the same filters.
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_PATH, k1=BM25_K1, b=BM25_B, max_postings=BM25_MAX_POSTINGS):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "chunk_id TEXT PRIMARY KEY, source_document TEXT, length INTEGER NOT NULL, "
+                + ", ".join(f"{field} TEXT" for field in FILTER_FIELDS) + ")"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+                "PRIMARY KEY (term, chunk_id)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_term_tf ON postings (term, tf DESC)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_document)")
+            # Chunk count and total length for BM25, kept up to date by every write
+            # so a search never scans the chunks table
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS corpus ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), chunks INTEGER NOT NULL, total_length INTEGER NOT NULL)"
+            )
+            with conn:
+                # Indexes built before the corpus table get it filled once
+                conn.execute(
+                    "INSERT OR IGNORE INTO corpus (id, chunks, total_length) "
+                    "SELECT 1, COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+                )
+            self._local.conn = conn
+        return conn
+
+    def _delete(self, conn, chunk_ids):
+        for chunk_id in chunk_ids:
+            row = conn.execute("SELECT length FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+            conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+            conn.execute("UPDATE corpus SET chunks = chunks - 1, total_length = total_length - ?", row)
+
+    def upsert_chunks(self, items):
+        """Index (chunk_id, text, metadata) items, replacing earlier versions"""
+        conn = self._connection()
+        with conn:
+            self._delete(conn, [chunk_id for chunk_id, _, _ in items])
+            for chunk_id, text, metadata in items:
+                terms = Counter(tokenize(text))
+                conn.execute(
+                    f"INSERT INTO chunks (chunk_id, source_document, length, {', '.join(FILTER_FIELDS)}) "
+                    f"VALUES (?, ?, ?, {', '.join('?' for _ in FILTER_FIELDS)})",
+                    (chunk_id, metadata.get('source_document'), sum(terms.values()),
+                     *(metadata.get(field) for field in FILTER_FIELDS))
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in terms.items()]
+                )
+                conn.execute("UPDATE corpus SET chunks = chunks + 1, total_length = total_length + ?",
+                             (sum(terms.values()),))
+
+    def update_metadata(self, items):
+        """Refresh the filterable metadata of (chunk_id, metadata) items"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                f"UPDATE chunks SET {', '.join(f'{field} = ?' for field in FILTER_FIELDS)} WHERE chunk_id = ?",
+                [(*(metadata.get(field) for field in FILTER_FIELDS), chunk_id) for chunk_id, metadata in items]
+            )
+
+    def delete_chunks(self, chunk_ids):
+        conn = self._connection()
+        with conn:
+            self._delete(conn, chunk_ids)
+
+    def delete_document(self, source_document):
+        conn = self._connection()
+        with conn:
+            ids = [row[0] for row in conn.execute(
+                "SELECT chunk_id FROM chunks WHERE source_document = ?", (source_document,)
+            )]
+            self._delete(conn, ids)
+        return len(ids)
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM chunks")
+            conn.execute("UPDATE corpus SET chunks = 0, total_length = 0")
+
+    def count(self):
+        return self._connection().execute("SELECT chunks FROM corpus").fetchone()[0]
+
+    def search(self, query, limit=10, filters=None):
+        """Return up to limit (chunk_id, score) pairs, best first"""
+        terms = sorted(set(tokenize(query)) - STOPWORDS)
+        if not terms:
+            return []
+
+        conn = self._connection()
+        total, total_length = conn.execute("SELECT chunks, total_length FROM corpus").fetchone()
+        if not total:
+            return []
+        avg_length = total_length / total
+
+        placeholders = ', '.join('?' for _ in terms)
+        document_frequency = dict(conn.execute(
+            f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+        ))
+
+        conditions = ''.join(
+            f" AND c.{field} = ?" for field in FILTER_FIELDS if filters and filters.get(field)
+        )
+        values = [filters[field] for field in FILTER_FIELDS if filters and filters.get(field)]
+        select = "SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.chunk_id = p.chunk_id"
+
+        rare = [term for term in terms if 0 < document_frequency.get(term, 0) <= self.max_postings]
+        frequent = [term for term in terms if document_frequency.get(term, 0) > self.max_postings]
+        row_sets = []
+        if rare:
+            row_sets.append(conn.execute(
+                f"{select} WHERE p.term IN ({', '.join('?' for _ in rare)}){conditions}", rare + values
+            ))
+        for term in frequent:
+            # Only the chunks where the term is densest; the rest would add little
+            row_sets.append(conn.execute(
+                f"{select} WHERE p.term = ?{conditions} ORDER BY p.tf DESC LIMIT ?",
+                [term, *values, self.max_postings]
+            ))
+
+        scores = {}
+        for rows in row_sets:
+            for term, chunk_id, tf, length in rows:
+                df = document_frequency[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def stats(self):
+        return {'path': self.path, 'chunks': self.count()}
+
+
+lexical_index = BM25Index()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from core.embedding_utils import collection
+from core.lexical_index import lexical_index
+import time
+
+class Command(BaseCommand):
+    help = 'Build the BM25 lexical index from the chunks already stored in ChromaDB'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Chunks read from ChromaDB per batch')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Empty the lexical index before indexing')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            lexical_index.clear()
+
+        total = collection.count()
+        self.stdout.write(f"Indexing {total} chunks into {lexical_index.path}")
+        start_time = time.perf_counter()
+
+        indexed = 0
+        while indexed < total:
+            batch = collection.get(
+                limit=options['batch_size'], offset=indexed,
+                include=["documents", "metadatas"]
+            )
+            if not batch['ids']:
+                break
+            lexical_index.upsert_chunks(list(zip(batch['ids'], batch['documents'], batch['metadatas'])))
+            indexed += len(batch['ids'])
+            elapsed = time.perf_counter() - start_time
+            self.stdout.write(f"  {indexed}/{total} chunks ({indexed / elapsed:.0f} chunks/sec)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} chunks in {time.perf_counter() - start_time:.1f}s "
+            f"({lexical_index.count()} in the lexical index)"
+        ))
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.embedding_backends import BACKENDS, load_backend, cosine_drift, neighbour_agreement, benchmark
+import time
+
+# Used when the collection is empty; mixes the languages the app serves
+FALLBACK_SAMPLE = [
+    "What are the data protection rights of internet users in Kenya?",
+    "Quels sont les droits des utilisateurs en matière de protection des données ?",
+    "Je, sheria inalinda vipi uhuru wa kujieleza mtandaoni?",
+    "Accessibility guidelines require public websites to support screen readers.",
+    "Technology facilitated gender-based violence includes online harassment and stalking.",
+    "The cybersecurity act establishes a national computer incident response team.",
+    "Digital inclusion policies aim to close the connectivity gap in rural areas.",
+    "Les opérateurs doivent notifier toute violation de données dans les 72 heures.",
+]
+
+class Command(BaseCommand):
+    help = 'Compare embedding backends: cosine drift against a reference and encode throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=','.join(BACKENDS),
+                            help='Comma-separated backends to compare')
+        parser.add_argument('--reference', default='torch',
+                            help='Backend the others are compared against')
+        parser.add_argument('--sample', type=int, default=500,
+                            help='Chunks sampled from ChromaDB as the test corpus')
+        parser.add_argument('--batch-size', type=int, default=32)
+
+    def load_sample(self, size):
+        from core.chroma_client import collection
+        documents = collection.get(limit=size, include=['documents']).get('documents') or []
+        documents = [doc for doc in documents if doc and doc.strip()]
+        if documents:
+            return documents
+        self.stdout.write(self.style.WARNING("Collection is empty, using the built-in sample sentences"))
+        return FALLBACK_SAMPLE
+
+    def handle(self, *args, **options):
+        from core.embedding_utils import EMBEDDING_MODEL_NAME
+
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        reference_name = options['reference']
+        if reference_name not in backends:
+            backends.insert(0, reference_name)
+        # Run the reference first so every other backend can be compared as it finishes
+        backends.sort(key=lambda name: name != reference_name)
+
+        texts = self.load_sample(options['sample'])
+        self.stdout.write(f"Comparing {', '.join(backends)} on {len(texts)} texts ({EMBEDDING_MODEL_NAME})")
+
+        reference = None
+        for name in backends:
+            load_start = time.perf_counter()
+            try:
+                model = load_backend(name, EMBEDDING_MODEL_NAME)
+            except Exception as e:
+                if name == reference_name:
+                    raise CommandError(f"Could not load reference backend {name}: {e}")
+                self.stdout.write(self.style.ERROR(f"{name}: could not load ({e})"))
+                continue
+            load_s = time.perf_counter() - load_start
+
+            embeddings, results = benchmark(model, texts, batch_size=options['batch_size'])
+            line = (f"{name:>6}: load {load_s:.1f}s, {results['texts_per_sec']:.1f} texts/sec batched, "
+                    f"single query p50 {results['single_p50_ms']:.1f}ms / p95 {results['single_p95_ms']:.1f}ms")
+
+            if reference is None:
+                reference = embeddings
+                self.stdout.write(f"{line} (reference)")
+            else:
+                drift = cosine_drift(reference, embeddings)
+                agreement = neighbour_agreement(reference, embeddings)
+                self.stdout.write(
+                    f"{line}\n        cosine vs {reference_name}: mean {drift['mean_cosine']:.5f}, "
+                    f"min {drift['min_cosine']:.5f} (max drift {drift['max_drift']:.5f}); "
+                    f"top-3 neighbours unchanged for {agreement:.1%} of texts"
+                )
+            del model
@@ -1,28 +1,293 @@
 from django.core.management.base import BaseCommand
-from core.embedding_utils import embed_and_store, collection
+from core.embedding_utils import (
+    embed_and_store, collection, existing_chunk_metadata, store_batch,
+    remove_stale_chunks, embed_result_message, new_ingest_stats, DOCUMENTS_PATH
+)
+from core.bulk_ingestion import (
+    init_worker, encode_document, file_signature, load_checkpoint, save_checkpoint
+)
+from core.models import UploadedDocument
+from core.search_filters import document_chunk_metadata
+from core import metrics
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Empty
+import multiprocessing
 import os
+import time
 
 class Command(BaseCommand):
-    help = 'Embed documents into ChromaDB'
+    help = (
+        'Embed documents into ChromaDB. Set PROMETHEUS_MULTIPROC_DIR to the web workers\' '
+        'directory to export ingestion metrics on /metrics.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Chunks encoded and written to ChromaDB per batch')
+        parser.add_argument('--workers', type=int, default=int(os.getenv('EMBED_DOCS_WORKERS', 1)),
+                            help='Worker processes that extract and encode files in parallel')
+        parser.add_argument('--checkpoint', default=os.path.join('media', 'embed_docs_checkpoint.json'),
+                            help='File recording finished documents, so a restart skips them')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and embed every document again')
+        parser.add_argument('--language', choices=['en', 'fr', 'sw', 'am'],
+                            help='Only embed documents in this language (rebuild one shard)')
+
+    def report_progress(self, progress):
+        self.last_progress = progress
+        self.stdout.write(
+            f"  {progress['file_name']}: {progress['chunks_done']}/{progress['total_chunks']} chunks, "
+            f"{progress['pages_done']}/{progress['total_pages']} pages "
+            f"({progress['chunks_per_sec']:.1f} chunks/sec, {progress['pages_per_sec']:.1f} pages/sec)"
+        )
 
     def handle(self, *args, **options):
+        warning = metrics.ingestion_export_warning()
+        if warning:
+            self.stdout.write(self.style.WARNING(warning))
         self.stdout.write(f"Current collection count: {collection.count()}")
-        
-        documents_path = 'media/documents/'
-        
+
         # List available documents
-        if os.path.exists(documents_path):
-            files = os.listdir(documents_path)
-            self.stdout.write(f"Found files: {files}")
-            
-            for file in files:
-                if file.endswith(('.pdf', '.docx')):
-                    self.stdout.write(f"Embedding: {file}")
-                    try:
-                        result = embed_and_store(file, 'en')
-                        self.stdout.write(f"Result: {result}")
-                    except Exception as e:
-                        self.stdout.write(f"Error embedding {file}: {e}")
-        
+        if not os.path.exists(DOCUMENTS_PATH):
+            self.stdout.write(f"No documents directory at {DOCUMENTS_PATH}")
+            return
+
+        files = sorted(f for f in os.listdir(DOCUMENTS_PATH) if f.endswith(('.pdf', '.docx')))
+        self.stdout.write(f"Found files: {files}")
+
+        # Language, category, type and scope come from the upload records
+        documents = {
+            os.path.basename(document.file.name): document
+            for document in UploadedDocument.objects.all()
+        }
+
+        checkpoint_path = options['checkpoint']
+        self.checkpoint = {} if options['restart'] else load_checkpoint(checkpoint_path)
+        self.checkpoint_path = checkpoint_path
+
+        self.totals = {
+            'embedded': 0, 'skipped': 0, 'failed': 0,
+            'pages': 0, 'chunks': 0, 'encoded': 0,
+            'extract_s': 0.0, 'encode_s': 0.0, 'store_s': 0.0,
+        }
+
+        pending = []
+        for file_name in files:
+            document = documents.get(file_name)
+            if document is None:
+                self.stdout.write(f"  {file_name}: no UploadedDocument record, embedding as 'en'")
+                language, document_metadata = 'en', {}
+            else:
+                language, document_metadata = document.language, document_chunk_metadata(document)
+
+            if options['language'] and language != options['language']:
+                continue
+
+            signature = file_signature(os.path.join(DOCUMENTS_PATH, file_name), language, document_metadata)
+            entry = self.checkpoint.get(file_name)
+            if entry and entry.get('signature') == signature:
+                self.totals['skipped'] += 1
+                continue
+            pending.append((file_name, document, language, document_metadata, signature))
+
+        self.stdout.write(f"{len(pending)} to embed, {self.totals['skipped']} already done per checkpoint")
+
+        start_time = time.perf_counter()
+        if options['workers'] > 1 and len(pending) > 1:
+            self.embed_parallel(pending, options['workers'], options['batch_size'])
+        else:
+            self.embed_serial(pending, options['batch_size'])
+        self.print_summary(time.perf_counter() - start_time)
+
         self.stdout.write(f"Final collection count: {collection.count()}")
         self.stdout.write(self.style.SUCCESS('Document embedding completed!'))
+
+    def embed_serial(self, pending, batch_size):
+        for file_name, document, language, document_metadata, signature in pending:
+            self.stdout.write(f"Embedding: {file_name}")
+            self.last_progress = None
+            try:
+                result = embed_and_store(
+                    file_name, language,
+                    batch_size=batch_size,
+                    progress_callback=self.report_progress,
+                    document_metadata=document_metadata
+                )
+            except Exception as e:
+                self.finish_file(file_name, document, signature, None, error=str(e))
+                continue
+
+            progress = self.last_progress or {}
+            stats = {
+                'pages_done': progress.get('pages_done', 0),
+                'chunks_done': progress.get('chunks_done', 0),
+                'changed': progress.get('chunks_encoded', 0),
+                'extract_s': progress.get('extract_s', 0.0),
+                'encode_s': progress.get('encode_s', 0.0),
+                'store_s': progress.get('store_s', 0.0),
+            }
+            if result.startswith('❌'):
+                self.finish_file(file_name, document, signature, None, error=result)
+            else:
+                self.finish_file(file_name, document, signature, stats, result=result)
+
+    def embed_parallel(self, pending, workers, batch_size):
+        """
+        Workers extract and encode files; this process writes each batch
+        to ChromaDB as it arrives. Workers block once `workers` encoded
+        batches are waiting, so memory is bounded by about one batch per
+        worker rather than by the size of the documents.
+
+        A worker that dies (OOM, segfault) breaks the whole pool: the files
+        in flight are recorded as failed and a fresh pool takes the rest.
+        """
+        torch_threads = (os.cpu_count() or 1) // workers
+        self.stdout.write(f"Starting {workers} workers ({max(1, torch_threads)} torch threads each)")
+
+        context = multiprocessing.get_context('spawn')
+        queue = iter(pending)
+        while True:
+            batch_queue = context.Queue(maxsize=workers)
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=context,
+                                     initializer=init_worker,
+                                     initargs=(torch_threads, batch_queue)) as pool:
+                finished = self.run_pool(pool, batch_queue, queue, workers, batch_size)
+            if finished:
+                return
+            # Whatever the dead worker left in the old queue is discarded with it
+            batch_queue.cancel_join_thread()
+            batch_queue.close()
+            self.stdout.write(self.style.WARNING("A worker process died; restarting the pool"))
+
+    def run_pool(self, pool, batch_queue, queue, workers, batch_size):
+        """Feed files from queue to pool until both are drained (True) or the pool breaks (False)"""
+        in_flight = {}  # file name -> (document, signature, store stats, future)
+
+        def submit_next():
+            item = next(queue, None)
+            if item is None:
+                return
+            file_name, document, language, document_metadata, signature = item
+            existing_metadata = existing_chunk_metadata(file_name)
+            # Registered before submitting, so a broken pool's refusal still fails this file
+            in_flight[file_name] = (document, signature, new_ingest_stats(), None)
+            future = pool.submit(encode_document, file_name, language, document_metadata,
+                                 existing_metadata, batch_size)
+            in_flight[file_name] = (document, signature, in_flight[file_name][2], future)
+
+        def fail_in_flight(error):
+            for file_name, (document, signature, _, _) in list(in_flight.items()):
+                del in_flight[file_name]
+                self.finish_file(file_name, document, signature, None,
+                                 error=f"worker process died while encoding ({error or 'no details'})")
+
+        try:
+            for _ in range(workers):
+                submit_next()
+
+            while in_flight:
+                try:
+                    message = batch_queue.get(timeout=1)
+                except Empty:
+                    # A worker that crashed never sends its 'done'
+                    for file_name, (document, signature, _, future) in list(in_flight.items()):
+                        if future.done() and future.exception() is not None:
+                            if isinstance(future.exception(), BrokenProcessPool):
+                                raise future.exception()
+                            del in_flight[file_name]
+                            self.finish_file(file_name, document, signature, None, error=str(future.exception()))
+                            submit_next()
+                    continue
+
+                kind, file_name = message[0], message[1]
+                if file_name not in in_flight:
+                    continue
+                document, signature, stats, _ = in_flight[file_name]
+                if kind == 'batch':
+                    store_batch(message[2], message[3], stats)
+                    continue
+
+                del in_flight[file_name]
+                if kind == 'error':
+                    self.finish_file(file_name, document, signature, None, error=message[2])
+                else:
+                    # Extraction and encoding stats come from the worker, store time from here
+                    self.store_file(file_name, document, signature, {**message[2], 'store_s': stats['store_s']})
+                submit_next()
+        except BrokenProcessPool as e:
+            fail_in_flight(str(e))
+            return False
+        return True
+
+    def store_file(self, file_name, document, signature, stats):
+        """Finish a document whose batches are all stored: drop stale chunks and record it"""
+        if not stats['has_text']:
+            self.finish_file(file_name, document, signature, None, error=f"❌ No text found in: {file_name}")
+            return
+
+        # Re-read after storing: anything past the new chunk count is left over from an older version
+        removed = remove_stale_chunks(file_name, existing_chunk_metadata(file_name), stats)
+        elapsed = stats['extract_s'] + stats['encode_s'] + stats['store_s']
+        metrics.record_ingestion(stats)
+        metrics.set_chroma_chunks(collection.count())
+        self.finish_file(file_name, document, signature, stats,
+                         result=embed_result_message(file_name, stats, removed, elapsed))
+
+    def finish_file(self, file_name, document, signature, stats, result='', error=''):
+        """Record one file's outcome on its document, the checkpoint and the run totals"""
+        metrics.record_ingested_document('failed' if error else 'completed')
+        if error:
+            self.totals['failed'] += 1
+            self.stdout.write(self.style.ERROR(f"Error embedding {file_name}: {error}"))
+            if document is not None:
+                document.processing_notes = f"Embedding failed: {error.splitlines()[0]}"
+                document.save(update_fields=['processing_notes'])
+            return
+
+        self.stdout.write(f"Result: {result}")
+        self.totals['embedded'] += 1
+        self.totals['pages'] += stats['pages_done']
+        self.totals['chunks'] += stats['chunks_done']
+        self.totals['encoded'] += stats['changed']
+        for stage in ('extract_s', 'encode_s', 'store_s'):
+            self.totals[stage] += stats[stage]
+
+        if document is not None:
+            document.is_processed = True
+            document.processing_notes = result
+            document.save(update_fields=['is_processed', 'processing_notes'])
+
+        self.checkpoint[file_name] = {
+            'signature': signature,
+            'pages': stats['pages_done'],
+            'chunks': stats['chunks_done'],
+            'finished_at': time.time(),
+        }
+        save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+    def print_summary(self, elapsed):
+        totals = self.totals
+
+        def rate(count, seconds):
+            return f"{count / seconds:.1f}" if seconds > 0 else "-"
+
+        self.stdout.write("\nIngestion summary")
+        self.stdout.write(
+            f"  Files:  {totals['embedded']} embedded, {totals['skipped']} skipped (checkpoint), "
+            f"{totals['failed']} failed"
+        )
+        self.stdout.write(
+            f"  Pages:  {totals['pages']}   Chunks: {totals['chunks']} ({totals['encoded']} encoded)"
+        )
+        # Stage times are summed across workers, so these are per-worker rates
+        self.stdout.write(
+            f"  Stages: extract {rate(totals['chunks'], totals['extract_s'])} chunks/sec, "
+            f"encode {rate(totals['encoded'], totals['encode_s'])} chunks/sec, "
+            f"store {rate(totals['chunks'], totals['store_s'])} chunks/sec"
+        )
+        self.stdout.write(
+            f"  Total:  {elapsed:.1f}s wall clock, {rate(totals['chunks'], elapsed)} chunks/sec, "
+            f"{rate(totals['pages'], elapsed)} pages/sec"
+        )
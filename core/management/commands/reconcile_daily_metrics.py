@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from core.models import QueryLog, SystemPerformanceMetrics
+from core.monitoring import PerformanceMonitor
+from datetime import date, timedelta
+
+class Command(BaseCommand):
+    help = 'Rebuild SystemPerformanceMetrics rows from QueryLog (fixes drifted running totals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', action='append', default=[],
+                            help='Day to rebuild (YYYY-MM-DD); repeatable. Defaults to today')
+        parser.add_argument('--days', type=int,
+                            help='Rebuild the last N days, today included')
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild every day that has queries or a metrics row')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            days = set(
+                QueryLog.objects.annotate(day=TruncDate('timestamp'))
+                .order_by().values_list('day', flat=True).distinct()
+            )
+            days.update(SystemPerformanceMetrics.objects.values_list('date', flat=True))
+        elif options['days']:
+            today = timezone.localdate()
+            days = {today - timedelta(days=offset) for offset in range(options['days'])}
+        elif options['date']:
+            try:
+                days = {date.fromisoformat(value) for value in options['date']}
+            except ValueError as e:
+                raise CommandError(f"Invalid --date: {e}")
+        else:
+            days = {timezone.localdate()}
+
+        for day in sorted(days):
+            before = SystemPerformanceMetrics.objects.filter(date=day).first()
+            metrics = PerformanceMonitor.rebuild_daily_metrics(day)
+            if metrics is None:
+                self.stdout.write(f"{day}: no queries")
+                continue
+            drift = ''
+            if before and before.total_queries != metrics.total_queries:
+                drift = f" (was {before.total_queries})"
+            self.stdout.write(
+                f"{day}: {metrics.total_queries} queries{drift}, "
+                f"{metrics.failed_queries} failed, "
+                f"avg response {metrics.avg_response_time_ms or 0:.0f}ms"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(days)} day(s)"))
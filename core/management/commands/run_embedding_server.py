@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from core.embedding_server import make_server, parse_server_url, EMBEDDING_SERVER_URL, DEFAULT_SERVER_URL
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Serve query and chunk embeddings to the other processes on this machine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=EMBEDDING_SERVER_URL or DEFAULT_SERVER_URL,
+                            help='unix:///path/to/socket or http://127.0.0.1:PORT '
+                                 '(clients read the same value from EMBEDDING_SERVER_URL)')
+
+    def handle(self, *args, **options):
+        from core.embedding_utils import get_embedding_model, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+
+        url = options['url']
+        load_start = time.perf_counter()
+        model = get_embedding_model()
+        model.encode(["warm-up"])  # First forward pass is much slower than the rest
+        model_label = f"{EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND})"
+        self.stdout.write(f"Loaded {model_label} in {time.perf_counter() - load_start:.1f}s")
+
+        server = make_server(url, model.encode, model_label)
+        self.stdout.write(self.style.SUCCESS(f"Embedding server listening on {url}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Shutting down embedding server")
+        finally:
+            server.server_close()
+            kind, *address = parse_server_url(url)
+            if kind == 'unix' and os.path.exists(address[0]):
+                os.unlink(address[0])
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from core.ingestion import default_worker_name, requeue_running_jobs, worker_loop
+from core import metrics
+import os
+import threading
+
+class Command(BaseCommand):
+    help = (
+        'Process queued document ingestion jobs with a local pool of worker threads. '
+        'Set PROMETHEUS_MULTIPROC_DIR to the web workers\' directory to export ingestion metrics on /metrics.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=int(os.getenv('INGESTION_WORKERS', 2)),
+                            help='Number of jobs processed concurrently')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained instead of polling forever')
+        parser.add_argument('--requeue-running', action='store_true',
+                            help='Reset jobs left running by a crashed worker before starting')
+
+    def handle(self, *args, **options):
+        warning = metrics.ingestion_export_warning()
+        if warning:
+            self.stdout.write(self.style.WARNING(warning))
+
+        if options['requeue_running']:
+            requeued = requeue_running_jobs()
+            self.stdout.write(f"Requeued {requeued} running job(s)")
+
+        # Load the embedding model once, before the worker threads start claiming jobs
+        from core.embedding_utils import embedding_client, get_embedding_model
+        if not embedding_client.remote:
+            get_embedding_model()
+
+        stop_event = threading.Event()
+        threads = [
+            threading.Thread(
+                target=worker_loop,
+                args=(default_worker_name(i), stop_event, options['poll_interval'], options['once']),
+                daemon=True
+            )
+            for i in range(max(1, options['workers']))
+        ]
+
+        self.stdout.write(f"Starting {len(threads)} ingestion worker(s)")
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1.0)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after current jobs finish...")
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS('Ingestion worker stopped'))
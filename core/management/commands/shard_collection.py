@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.chroma_client import get_chroma_client, COLLECTION_NAME
+from core.sharding import ShardedCollection
+import time
+
+class Command(BaseCommand):
+    help = 'Split the legal_docs collection into one collection per language (for CHROMA_SHARD_BY=language)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Chunks copied per read/write')
+        parser.add_argument('--delete-source', action='store_true',
+                            help=f'Delete {COLLECTION_NAME} once every chunk is in its shard')
+
+    def handle(self, *args, **options):
+        client = get_chroma_client()
+        source = client.get_or_create_collection(COLLECTION_NAME)
+        sharded = ShardedCollection(client, COLLECTION_NAME)
+
+        total = source.count()
+        self.stdout.write(f"Splitting {total} chunks from {COLLECTION_NAME}")
+        start_time = time.perf_counter()
+
+        copied = 0
+        while copied < total:
+            batch = source.get(
+                limit=options['batch_size'], offset=copied,
+                include=["embeddings", "documents", "metadatas"]
+            )
+            if not batch['ids']:
+                break
+            sharded.upsert(
+                ids=batch['ids'],
+                embeddings=batch['embeddings'],
+                documents=batch['documents'],
+                metadatas=batch['metadatas']
+            )
+            copied += len(batch['ids'])
+            elapsed = time.perf_counter() - start_time
+            self.stdout.write(f"  {copied}/{total} chunks ({copied / elapsed:.0f} chunks/sec)")
+
+        for shard, shard_collection in sharded.shards.items():
+            self.stdout.write(f"  {shard_collection.name}: {shard_collection.count()} chunks")
+
+        sharded_total = sharded.count()
+        if sharded_total < total:
+            raise CommandError(f"Only {sharded_total} of {total} chunks reached the shards; source kept")
+
+        if options['delete_source']:
+            client.delete_collection(COLLECTION_NAME)
+            self.stdout.write(f"Deleted {COLLECTION_NAME}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Split {copied} chunks in {time.perf_counter() - start_time:.1f}s. "
+            f"Set CHROMA_SHARD_BY=language to serve from the shards."
+        ))
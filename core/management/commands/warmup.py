@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from core.warmup import warm_up, measure_cold_import
+
+class Command(BaseCommand):
+    help = 'Measure cold startup, then warm up the embedding model and ChromaDB and time each step'
+
+    def handle(self, *args, **options):
+        cold = measure_cold_import()
+        self.stdout.write(
+            f"Cold start (django.setup + URLconf): {cold['import_ms']}ms, "
+            f"torch loaded: {'yes' if cold['torch_loaded'] else 'no'}, "
+            f"chromadb loaded: {'yes' if cold['chromadb_loaded'] else 'no'}"
+        )
+
+        timings = warm_up()
+        self.stdout.write(f"Model load:         {timings['model_load_ms']}ms")
+        self.stdout.write(f"First encode:       {timings['first_encode_ms']}ms")
+        self.stdout.write(f"Chroma open:        {timings['chroma_open_ms']}ms")
+        self.stdout.write(f"Chroma first query: {timings['chroma_query_ms']}ms")
+        self.stdout.write(self.style.SUCCESS(f"Warm-up total: {timings['total_ms']}ms"))
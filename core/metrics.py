@@ -0,0 +1,140 @@
+# core/metrics.py
+# Prometheus metrics for the RAG pipeline, served at /metrics. Everything is
+# counted in process as it happens, so a scrape reads memory (or, under
+# gunicorn, the shared multiprocess files) and never touches the database.
+#
+# Ingestion runs in its own processes (manage.py embed_docs and
+# run_ingestion_worker). Their rag_ingest* counters only reach /metrics when
+# those commands run with PROMETHEUS_MULTIPROC_DIR set to the web workers'
+# directory (see config/gunicorn.conf.py); otherwise they stay in the command's
+# memory and are lost when it exits. Both commands warn at start when unset.
+import os
+
+try:
+    import prometheus_client  # Only needed for the /metrics endpoint
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+from core.histogram import LATENCY_MS_BUCKETS
+
+# Directory shared by all worker processes (gunicorn); each process writes
+# its metrics to mmap'd files there and a scrape of any worker sums them.
+# Must be set before the app starts and emptied on every restart (see
+# config/gunicorn.conf.py).
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+
+LATENCY_SECONDS_BUCKETS = tuple(bound / 1000 for bound in LATENCY_MS_BUCKETS)
+
+LLM_ERROR_TYPES = ('timeout', 'connection', 'http', 'garbled', 'overloaded', 'other')
+
+if prometheus_client is not None:
+    REQUESTS = prometheus_client.Counter(
+        'rag_requests', 'Answered questions by language and outcome', ['language', 'outcome']
+    )
+    STAGE_DURATION = prometheus_client.Histogram(
+        'rag_stage_duration_seconds', 'Pipeline stage latency', ['stage'], buckets=LATENCY_SECONDS_BUCKETS
+    )
+    LLM_ERRORS = prometheus_client.Counter(
+        'rag_llm_errors', 'Failed LLM requests by error type', ['type']
+    )
+    CHROMA_CHUNKS = prometheus_client.Gauge(
+        'rag_chroma_chunks', 'Chunks in the Chroma collection, as of the last ingest or delete',
+        multiprocess_mode='mostrecent'
+    )
+    EMBEDDING_CACHE = prometheus_client.Counter(
+        'rag_embedding_cache_requests', 'Query embedding cache lookups by result', ['result']
+    )
+    INGESTED_DOCUMENTS = prometheus_client.Counter(
+        'rag_ingested_documents', 'Documents run through ingestion by outcome', ['status']
+    )
+    INGESTED_PAGES = prometheus_client.Counter('rag_ingested_pages', 'Pages read by ingestion')
+    INGESTED_CHUNKS = prometheus_client.Counter(
+        'rag_ingested_chunks', 'Chunks processed by ingestion (encoded: re-embedded, unchanged: skipped)',
+        ['result']
+    )
+    INGEST_STAGE_SECONDS = prometheus_client.Counter(
+        'rag_ingest_stage_seconds', 'Time spent in each ingestion stage', ['stage']
+    )
+
+def enabled():
+    return prometheus_client is not None
+
+def request_outcome(response_text, metadata):
+    """Outcome label for a logged query, from the flags the views put in its metadata"""
+    metadata = metadata or {}
+    if metadata.get('aborted'):
+        return 'aborted'
+    if metadata.get('overloaded'):
+        return 'overloaded'
+    if metadata.get('failed'):
+        return 'error'
+    if metadata.get('cache_hit'):
+        return 'cache_hit'
+    if metadata.get('coalesced'):
+        return 'coalesced'
+    if (response_text or '').startswith('⚠️'):
+        return 'llm_error'
+    return 'success'
+
+def record_query(fields):
+    """Count a logged query and observe its stage latencies (fields: QueryLog column values)"""
+    if prometheus_client is None:
+        return
+    from core.latency_histograms import STAGE_FIELDS
+
+    REQUESTS.labels(fields['language'], request_outcome(fields['response_text'], fields['metadata'])).inc()
+    for stage, field in STAGE_FIELDS.items():
+        value = fields.get(field)
+        if value is not None:
+            STAGE_DURATION.labels(stage).observe(value / 1000)
+
+def record_llm_error(error_type):
+    if prometheus_client is not None:
+        LLM_ERRORS.labels(error_type).inc()
+
+def record_embedding_cache(result):
+    """result: hit (in-process), shared_hit or miss"""
+    if prometheus_client is not None:
+        EMBEDDING_CACHE.labels(result).inc()
+
+def set_chroma_chunks(count):
+    if prometheus_client is not None:
+        CHROMA_CHUNKS.set(count)
+
+def record_ingestion(stats):
+    """Add one embed_and_store run's page/chunk counts and stage timings"""
+    if prometheus_client is None:
+        return
+    INGESTED_PAGES.inc(stats['pages_done'])
+    INGESTED_CHUNKS.labels('encoded').inc(stats['changed'])
+    INGESTED_CHUNKS.labels('unchanged').inc(stats['chunks_done'] - stats['changed'])
+    for stage in ('extract', 'encode', 'store'):
+        INGEST_STAGE_SECONDS.labels(stage).inc(stats[f'{stage}_s'])
+
+def record_ingested_document(status):
+    if prometheus_client is not None:
+        INGESTED_DOCUMENTS.labels(status).inc()
+
+def ingestion_export_warning():
+    """Why ingestion counted in this process won't reach /metrics, or None if it will"""
+    if prometheus_client is None or PROMETHEUS_MULTIPROC_DIR:
+        return None
+    return (
+        "PROMETHEUS_MULTIPROC_DIR is not set, so this run's ingestion metrics will not appear on "
+        "/metrics; set it to the web workers' directory (see config/gunicorn.conf.py) to export them"
+    )
+
+def exposition():
+    """(body, content type) of the current metrics in Prometheus text format"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Drop a dead worker's live gauge files (called from gunicorn's child_exit hook)"""
+    if prometheus_client is not None and PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_querylog_time_to_first_token_ms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querylog',
+            name='llm_queue_wait_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
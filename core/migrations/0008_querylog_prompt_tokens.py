@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_querylog_llm_queue_wait_ms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querylog',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_querylog_prompt_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='context_chunks_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='relevance_score_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='relevance_score_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='response_relevance_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='response_relevance_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='response_time_sum_ms',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='user_rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='systemperformancemetrics',
+            name='user_rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:02
+
+import uuid
+
+from django.db import migrations, models
+
+
+def gen_uuid(apps, schema_editor):
+    QueryLog = apps.get_model('core', 'QueryLog')
+    for row in QueryLog.objects.filter(query_uuid__isnull=True).only('id').iterator():
+        row.query_uuid = uuid.uuid4()
+        row.save(update_fields=['query_uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_systemperformancemetrics_running_totals'),
+    ]
+
+    operations = [
+        # Unique fields with a callable default need adding in three steps
+        # so existing rows get distinct values
+        migrations.AddField(
+            model_name='querylog',
+            name='query_uuid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(gen_uuid, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='querylog',
+            name='query_uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_querylog_query_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatencyHistogramBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('stage', models.CharField(choices=[('response', 'Total Response'), ('embedding', 'Embedding'), ('search', 'Search'), ('llm', 'LLM'), ('llm_queue_wait', 'LLM Queue Wait'), ('first_token', 'Time to First Token')], max_length=20)),
+                ('bucket', models.SmallIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date', 'stage', 'bucket'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'stage', 'bucket'), name='unique_latency_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:14
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+
+
+def backfill_running_totals(apps, schema_editor):
+    """
+    Fill the running totals 0009 added (as zeros) for days recorded before
+    it, so new queries and ratings add to the day's real sums instead of
+    replacing its averages. Days with QueryLog rows are recomputed from them
+    as in PerformanceMonitor.rebuild_daily_metrics; days whose logs are gone
+    get the sums implied by their stored averages.
+    """
+    QueryLog = apps.get_model('core', 'QueryLog')
+    SystemPerformanceMetrics = apps.get_model('core', 'SystemPerformanceMetrics')
+
+    def average(total, count):
+        return total / count if count else None
+
+    for metrics in SystemPerformanceMetrics.objects.iterator():
+        queries = QueryLog.objects.filter(timestamp__date=metrics.date)
+        totals = queries.aggregate(
+            total=Count('id'),
+            failed=Count('id', filter=Q(metadata__failed=True)),
+            response_time_sum=Sum('response_time_ms'),
+            context_chunks_sum=Sum('context_chunks_found'),
+            relevance_sum=Sum('avg_relevance_score'),
+            relevance_count=Count('avg_relevance_score'),
+            rating_sum=Sum('user_rating'),
+            rating_count=Count('user_rating'),
+            response_relevance_sum=Sum('response_relevance'),
+            response_relevance_count=Count('response_relevance'),
+        )
+
+        if totals['total']:
+            metrics.total_queries = totals['total']
+            metrics.successful_queries = totals['total'] - totals['failed']
+            metrics.failed_queries = totals['failed']
+            metrics.queries_by_language = dict(
+                queries.order_by().values_list('language').annotate(count=Count('id'))
+            )
+            metrics.response_time_sum_ms = totals['response_time_sum'] or 0
+            metrics.context_chunks_sum = totals['context_chunks_sum'] or 0
+            metrics.relevance_score_sum = totals['relevance_sum'] or 0
+            metrics.relevance_score_count = totals['relevance_count']
+            metrics.user_rating_sum = totals['rating_sum'] or 0
+            metrics.user_rating_count = totals['rating_count']
+            metrics.response_relevance_sum = totals['response_relevance_sum'] or 0
+            metrics.response_relevance_count = totals['response_relevance_count']
+            metrics.avg_response_time_ms = average(totals['response_time_sum'], totals['total'])
+            metrics.avg_context_chunks = average(totals['context_chunks_sum'], totals['total'])
+            metrics.avg_relevance_score = average(totals['relevance_sum'], totals['relevance_count'])
+            metrics.avg_user_rating = average(totals['rating_sum'], totals['rating_count'])
+            metrics.avg_response_relevance = average(totals['response_relevance_sum'],
+                                                     totals['response_relevance_count'])
+        else:
+            # Only the averages survive; per-query counts for ratings were never stored
+            metrics.response_time_sum_ms = round((metrics.avg_response_time_ms or 0) * metrics.total_queries)
+            metrics.context_chunks_sum = round((metrics.avg_context_chunks or 0) * metrics.total_queries)
+            if metrics.avg_relevance_score is not None:
+                metrics.relevance_score_sum = metrics.avg_relevance_score * metrics.total_queries
+                metrics.relevance_score_count = metrics.total_queries
+        metrics.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_latencyhistogrambucket'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_running_totals, reverse_code=migrations.RunPython.noop),
+    ]
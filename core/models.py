@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 import json
+import uuid
 
 class UploadedDocument(models.Model):
     # File Information
@@ -92,6 +93,8 @@ class QueryLog(models.Model):
     """Log all user queries and system responses for performance monitoring"""
     
     # Query Information
+    # Handed to the client as query_id before the row is written (see core/query_log_writer.py)
+    query_uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     query_text = models.TextField()
     language = models.CharField(max_length=5, choices=[
         ('en', 'English'),
@@ -115,6 +118,9 @@ class QueryLog(models.Model):
     embedding_time_ms = models.IntegerField(null=True, blank=True)
     search_time_ms = models.IntegerField(null=True, blank=True)
     llm_time_ms = models.IntegerField(null=True, blank=True)
+    llm_queue_wait_ms = models.IntegerField(null=True, blank=True)  # Time spent waiting for an LLM concurrency slot
+    time_to_first_token_ms = models.IntegerField(null=True, blank=True)  # Streaming requests only
+    prompt_tokens = models.IntegerField(null=True, blank=True)  # Size of the prompt sent to the LLM
     
     # Quality Metrics (can be updated later through evaluation)
     user_rating = models.IntegerField(null=True, blank=True, choices=[
@@ -188,6 +194,16 @@ class SystemPerformanceMetrics(models.Model):
     avg_user_rating = models.FloatField(null=True, blank=True)
     avg_response_relevance = models.FloatField(null=True, blank=True)
     
+    # Running totals behind the averages, updated atomically per query/rating
+    response_time_sum_ms = models.BigIntegerField(default=0)
+    context_chunks_sum = models.BigIntegerField(default=0)
+    relevance_score_sum = models.FloatField(default=0)
+    relevance_score_count = models.IntegerField(default=0)
+    user_rating_sum = models.IntegerField(default=0)
+    user_rating_count = models.IntegerField(default=0)
+    response_relevance_sum = models.IntegerField(default=0)
+    response_relevance_count = models.IntegerField(default=0)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -196,3 +212,74 @@ class SystemPerformanceMetrics(models.Model):
     
     def __str__(self):
         return f"Metrics for {self.date}: {self.total_queries} queries"
+
+class LatencyHistogramBucket(models.Model):
+    """One bucket of a day's latency histogram for one pipeline stage (see core/latency_histograms.py)"""
+    
+    STAGE_CHOICES = [
+        ('response', 'Total Response'),
+        ('embedding', 'Embedding'),
+        ('search', 'Search'),
+        ('llm', 'LLM'),
+        ('llm_queue_wait', 'LLM Queue Wait'),
+        ('first_token', 'Time to First Token'),
+    ]
+    
+    date = models.DateField()
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES)
+    bucket = models.SmallIntegerField()  # Index into core.histogram.LATENCY_MS_BUCKETS; the last index is the overflow bucket
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['date', 'stage', 'bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'stage', 'bucket'], name='unique_latency_bucket'),
+        ]
+    
+    def __str__(self):
+        return f"{self.stage} latency bucket {self.bucket} on {self.date}: {self.count}"
+
+class IngestionJob(models.Model):
+    """Queued document embedding work, processed by the run_ingestion_worker command"""
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    document = models.ForeignKey(UploadedDocument, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    job_type = models.CharField(max_length=20, choices=[
+        ('embed', 'Embed'),
+        ('re_embed', 'Re-embed'),
+    ], default='embed')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    
+    # Progress Information
+    chunks_done = models.IntegerField(default=0)
+    total_chunks = models.IntegerField(null=True, blank=True)
+    stage_timings = models.JSONField(default=dict, blank=True)  # Per-stage durations in ms
+    result_message = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    
+    # Worker Bookkeeping
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.job_type} job #{self.id} for {self.document} ({self.status})"
+    
+    def get_progress_percent(self):
+        """Return completion percentage, or None until the chunk count is known"""
+        if not self.total_chunks:
+            return 100.0 if self.status == 'completed' else None
+        return round(self.chunks_done / self.total_chunks * 100, 1)
@@ -1,48 +1,152 @@
 # core/monitoring.py
 import time
+from contextlib import contextmanager
 from datetime import date, datetime
-from django.db.models import Avg, Count, Max, Min
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, F, FloatField, Max, Min, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, NullIf
 from django.utils import timezone
 from .models import QueryLog, SystemPerformanceMetrics
+from .query_log_writer import query_log_writer
+from .latency_histograms import record_latency_histograms, rebuild_latency_histograms, stage_percentiles
+from . import metrics
 import json
 
+class Span:
+    """A timed section of a request; children are the sections nested inside it"""
+    
+    def __init__(self, name, start=None, **attrs):
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.attrs = attrs
+        self.children = []
+    
+    @property
+    def duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+    
+    def add_child(self, name, start, end=None, **attrs):
+        child = Span(name, start, **attrs)
+        child.end = end
+        self.children.append(child)
+        return child
+    
+    def add_phases(self, phases):
+        """
+        Add back-to-back child spans from (name, perf_counter end) marks, each
+        starting where the previous one ended (the first at this span's start)
+        """
+        previous = self.start
+        for name, end in phases:
+            self.add_child(name, previous, end)
+            previous = end
+    
+    def find(self, name):
+        """Every span called name in this subtree, depth first"""
+        found = [self] if self.name == name else []
+        for child in self.children:
+            found.extend(child.find(name))
+        return found
+    
+    def to_dict(self, origin=None):
+        origin = self.start if origin is None else origin
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 2),
+            'duration_ms': round(self.duration_ms, 2),
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
 class PerformanceMonitor:
-    """Service class for monitoring and logging system performance"""
+    """
+    Service class for monitoring and logging system performance.
+    
+    Stages are timed as nested spans on a per-request trace:
+    
+        with monitor.span('embedding'):
+            ...
+    
+    QueryLog's stage columns are the durations of the matching spans (not
+    time since the request started), and the whole tree is stored in
+    QueryLog.metadata['trace'].
+    """
     
     def __init__(self):
         self.start_time = None
-        self.embedding_time = None
-        self.search_time = None
-        self.llm_time = None
+        self.trace = None
+        self._stack = []
+        self.first_token_time = None
+        self.prompt_tokens = None
     
     def start_monitoring(self):
         """Start timing a request"""
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
+        self.trace = Span('request', self.start_time)
+        self._stack = [self.trace]
         return self
     
-    def record_embedding_time(self):
-        """Record time taken for embedding generation"""
-        if self.start_time:
-            self.embedding_time = (time.time() - self.start_time) * 1000  # Convert to ms
+    @contextmanager
+    def span(self, name, phases=None, **attrs):
+        """
+        Time the enclosed block as a child of the innermost open span. If
+        phases is given (a dict the timed code fills, as the LLM client does
+        with stats['phases']), its marks become child spans on exit.
+        """
+        if self.trace is None:
+            # Not monitoring: still time the block, but record it nowhere
+            current = Span(name, **attrs)
+        else:
+            current = self._stack[-1].add_child(name, time.perf_counter(), **attrs)
+            self._stack.append(current)
+        try:
+            yield current
+        finally:
+            current.end = time.perf_counter()
+            if phases and phases.get('phases'):
+                current.add_phases(phases['phases'])
+            if current in self._stack:
+                self._stack.remove(current)
     
-    def record_search_time(self):
-        """Record time taken for vector search"""
-        if self.start_time:
-            self.search_time = (time.time() - self.start_time) * 1000
+    def stage_ms(self, name):
+        """Total duration of the spans called name, or None if the stage never ran"""
+        if self.trace is None:
+            return None
+        spans = self.trace.find(name)
+        if not spans:
+            return None
+        return sum(span.duration_ms for span in spans)
     
-    def record_llm_time(self):
-        """Record time taken for LLM response"""
-        if self.start_time:
-            self.llm_time = (time.time() - self.start_time) * 1000
+    def record_prompt_tokens(self, prompt_tokens):
+        """Record the token count of the prompt sent to the LLM"""
+        self.prompt_tokens = prompt_tokens
     
-    def log_query(self, query_text, language, response_text, context_chunks, 
-                  relevance_scores, metadata=None):
-        """Log a complete query-response interaction"""
+    def record_first_token_time(self):
+        """Record time until the first streamed LLM token reached the client"""
+        if self.start_time and self.first_token_time is None:
+            self.first_token_time = (time.perf_counter() - self.start_time) * 1000
+    
+    def _query_log_fields(self, query_text, language, response_text, context_chunks,
+                          relevance_scores, metadata=None):
+        """Build QueryLog field values for a completed interaction"""
+        response_time_ms = (time.perf_counter() - self.start_time) * 1000
+        self.trace.end = time.perf_counter()
         
-        if not self.start_time:
-            return None
-            
-        response_time_ms = (time.time() - self.start_time) * 1000
+        # True per-stage durations; the model's time excludes waiting for a slot
+        queue_wait = self.stage_ms('queue_wait')
+        llm_time = self.stage_ms('llm')
+        if llm_time is not None and queue_wait is not None:
+            llm_time -= queue_wait
+        embedding_time = self.stage_ms('embedding')
+        search_time = self.stage_ms('search')
         
         # Calculate relevance metrics
         avg_relevance = None
@@ -54,8 +158,9 @@ class PerformanceMonitor:
             max_relevance = max(relevance_scores)
             min_relevance = min(relevance_scores)
         
-        # Create log entry
-        query_log = QueryLog.objects.create(
+        return dict(
+            # When the question was answered, not when a background writer stores the row
+            timestamp=timezone.now(),
             query_text=query_text,
             language=language,
             response_text=response_text,
@@ -64,60 +169,221 @@ class PerformanceMonitor:
             avg_relevance_score=avg_relevance,
             max_relevance_score=max_relevance,
             min_relevance_score=min_relevance,
-            embedding_time_ms=int(self.embedding_time) if self.embedding_time else None,
-            search_time_ms=int(self.search_time) if self.search_time else None,
-            llm_time_ms=int(self.llm_time) if self.llm_time else None,
+            embedding_time_ms=int(embedding_time) if embedding_time is not None else None,
+            search_time_ms=int(search_time) if search_time is not None else None,
+            llm_time_ms=int(llm_time) if llm_time is not None else None,
+            llm_queue_wait_ms=int(queue_wait) if queue_wait is not None else None,
+            time_to_first_token_ms=int(self.first_token_time) if self.first_token_time is not None else None,
+            prompt_tokens=self.prompt_tokens,
             metadata={
                 'relevance_scores': relevance_scores,
                 'context_chunks_count': len(context_chunks),
+                'trace': self.trace.to_dict(),
                 **(metadata or {})
             }
         )
+    
+    def log_query(self, query_text, language, response_text, context_chunks, 
+                  relevance_scores, metadata=None):
+        """Log a complete query-response interaction"""
+        
+        if not self.start_time:
+            return None
+        
+        fields = self._query_log_fields(
+            query_text, language, response_text, context_chunks, relevance_scores, metadata
+        )
+        metrics.record_query(fields)
+        if query_log_writer.enabled:
+            # Written (and added to the daily metrics) by the background writer
+            return query_log_writer.submit(QueryLog(**fields))
+        
+        # Create log entry
+        query_log = QueryLog.objects.create(**fields)
         
         # Update daily metrics
         self.update_daily_metrics(query_log)
         
         return query_log
     
-    def update_daily_metrics(self, query_log):
-        """Update or create daily performance metrics"""
-        today = date.today()
+    async def alog_query(self, query_text, language, response_text, context_chunks,
+                         relevance_scores, metadata=None):
+        """Async variant of log_query for async views"""
         
-        metrics, created = SystemPerformanceMetrics.objects.get_or_create(
-            date=today,
-            defaults={
-                'total_queries': 0,
-                'successful_queries': 0,
-                'queries_by_language': {}
-            }
+        if not self.start_time:
+            return None
+        
+        fields = self._query_log_fields(
+            query_text, language, response_text, context_chunks, relevance_scores, metadata
         )
+        metrics.record_query(fields)
+        if query_log_writer.enabled:
+            # Queuing never touches the database, so it is safe on the event loop
+            return query_log_writer.submit(QueryLog(**fields))
         
-        # Update metrics
-        metrics.total_queries += 1
-        metrics.successful_queries += 1
+        query_log = await QueryLog.objects.acreate(**fields)
         
-        # Update language distribution
-        lang_dist = metrics.queries_by_language or {}
-        lang_dist[query_log.language] = lang_dist.get(query_log.language, 0) + 1
-        metrics.queries_by_language = lang_dist
+        await sync_to_async(self.update_daily_metrics)(query_log)
         
-        # Recalculate averages for today
-        today_queries = QueryLog.objects.filter(timestamp__date=today)
-        aggregates = today_queries.aggregate(
-            avg_response_time=Avg('response_time_ms'),
-            avg_relevance=Avg('avg_relevance_score'),
-            avg_chunks=Avg('context_chunks_found'),
-            avg_user_rating=Avg('user_rating'),
-            avg_response_relevance=Avg('response_relevance')
+        return query_log
+    
+    def update_daily_metrics(self, query_log):
+        """Add one query to its day's running totals (see record_daily_metrics)"""
+        record_daily_metrics([query_log])
+
+    @staticmethod
+    def record_feedback(query_log, previous_rating, previous_relevance):
+        """Apply a changed user_rating/response_relevance to its day's running totals"""
+        updates = {}
+        for prefix, avg_field, previous, current in (
+            ('user_rating', 'avg_user_rating', previous_rating, query_log.user_rating),
+            ('response_relevance', 'avg_response_relevance', previous_relevance, query_log.response_relevance),
+        ):
+            previous = int(previous) if previous is not None else None
+            current = int(current) if current is not None else None
+            if previous != current:
+                updates.update(_running_avg_updates(
+                    prefix, avg_field,
+                    (current or 0) - (previous or 0),
+                    (current is not None) - (previous is not None)
+                ))
+
+        if updates:
+            SystemPerformanceMetrics.objects.filter(
+                date=timezone.localdate(query_log.timestamp)
+            ).update(**updates)
+
+    @staticmethod
+    def rebuild_daily_metrics(day):
+        """
+        Recompute a day's metrics from its QueryLog rows, replacing the
+        running totals (see the reconcile_daily_metrics command). Returns the
+        SystemPerformanceMetrics row, or None for a day without queries or metrics.
+        """
+        queries = QueryLog.objects.filter(timestamp__date=day)
+        totals = queries.aggregate(
+            total=Count('id'),
+            failed=Count('id', filter=Q(metadata__failed=True)),
+            response_time_sum=Sum('response_time_ms'),
+            context_chunks_sum=Sum('context_chunks_found'),
+            relevance_sum=Sum('avg_relevance_score'),
+            relevance_count=Count('avg_relevance_score'),
+            rating_sum=Sum('user_rating'),
+            rating_count=Count('user_rating'),
+            response_relevance_sum=Sum('response_relevance'),
+            response_relevance_count=Count('response_relevance'),
         )
-        
-        metrics.avg_response_time_ms = aggregates['avg_response_time']
-        metrics.avg_relevance_score = aggregates['avg_relevance']
-        metrics.avg_context_chunks = aggregates['avg_chunks']
-        metrics.avg_user_rating = aggregates['avg_user_rating']
-        metrics.avg_response_relevance = aggregates['avg_response_relevance']
-        
-        metrics.save()
+        if not totals['total'] and not SystemPerformanceMetrics.objects.filter(date=day).exists():
+            return None
+
+        rebuild_latency_histograms(day)
+
+        languages = dict(
+            queries.order_by().values_list('language').annotate(count=Count('id'))
+        )
+
+        def average(total, count):
+            return total / count if count else None
+
+        metrics, _ = SystemPerformanceMetrics.objects.update_or_create(
+            date=day,
+            defaults={
+                'total_queries': totals['total'],
+                'successful_queries': totals['total'] - totals['failed'],
+                'failed_queries': totals['failed'],
+                'queries_by_language': languages,
+                'response_time_sum_ms': totals['response_time_sum'] or 0,
+                'context_chunks_sum': totals['context_chunks_sum'] or 0,
+                'relevance_score_sum': totals['relevance_sum'] or 0,
+                'relevance_score_count': totals['relevance_count'],
+                'user_rating_sum': totals['rating_sum'] or 0,
+                'user_rating_count': totals['rating_count'],
+                'response_relevance_sum': totals['response_relevance_sum'] or 0,
+                'response_relevance_count': totals['response_relevance_count'],
+                'avg_response_time_ms': average(totals['response_time_sum'], totals['total']),
+                'avg_context_chunks': average(totals['context_chunks_sum'], totals['total']),
+                'avg_relevance_score': average(totals['relevance_sum'], totals['relevance_count']),
+                'avg_user_rating': average(totals['rating_sum'], totals['rating_count']),
+                'avg_response_relevance': average(totals['response_relevance_sum'],
+                                                  totals['response_relevance_count']),
+            }
+        )
+        return metrics
+
+
+def record_daily_metrics(query_logs):
+    """
+    Add queries to their days' running totals. Counters, sums and the
+    averages derived from them are changed by one UPDATE per (day,
+    language) using F() expressions, so the cost does not grow with the
+    day's volume and concurrent writers cannot overwrite each other's counts.
+    """
+    groups = {}
+    for query_log in query_logs:
+        key = (timezone.localdate(query_log.timestamp), query_log.language)
+        group = groups.setdefault(key, {
+            'queries': 0, 'failed': 0, 'response_time': 0, 'chunks': 0,
+            'relevance_sum': 0.0, 'relevance_count': 0,
+        })
+        group['queries'] += 1
+        group['failed'] += bool((query_log.metadata or {}).get('failed'))
+        group['response_time'] += query_log.response_time_ms
+        group['chunks'] += query_log.context_chunks_found
+        if query_log.avg_relevance_score is not None:
+            group['relevance_sum'] += query_log.avg_relevance_score
+            group['relevance_count'] += 1
+
+    for (day, language), group in groups.items():
+        queries = group['queries']
+        updates = {
+            'total_queries': F('total_queries') + queries,
+            'successful_queries': F('successful_queries') + (queries - group['failed']),
+            'failed_queries': F('failed_queries') + group['failed'],
+            'response_time_sum_ms': F('response_time_sum_ms') + group['response_time'],
+            'avg_response_time_ms': _running_avg('response_time_sum_ms', 'total_queries',
+                                                 group['response_time'], queries),
+            'context_chunks_sum': F('context_chunks_sum') + group['chunks'],
+            'avg_context_chunks': _running_avg('context_chunks_sum', 'total_queries',
+                                               group['chunks'], queries),
+            'queries_by_language': _increment_language(language, queries),
+        }
+        if group['relevance_count']:
+            updates.update(_running_avg_updates(
+                'relevance_score', 'avg_relevance_score', group['relevance_sum'], group['relevance_count']
+            ))
+        _update_day(day, updates)
+
+    record_latency_histograms(query_logs)
+
+def _running_avg(sum_field, count_field, value_delta, count_delta):
+    """(sum + value_delta) / (count + count_delta), from the row's values before the UPDATE"""
+    return Cast(F(sum_field) + value_delta, FloatField()) / NullIf(F(count_field) + count_delta, 0)
+
+def _running_avg_updates(prefix, avg_field, value_delta, count_delta):
+    return {
+        f'{prefix}_sum': F(f'{prefix}_sum') + value_delta,
+        f'{prefix}_count': F(f'{prefix}_count') + count_delta,
+        avg_field: _running_avg(f'{prefix}_sum', f'{prefix}_count', value_delta, count_delta),
+    }
+
+def _increment_language(language, count=1):
+    """queries_by_language[language] += count inside the UPDATE (PostgreSQL jsonb)"""
+    return RawSQL(
+        "jsonb_set(COALESCE(queries_by_language, '{}'::jsonb), ARRAY[%s::text], "
+        "to_jsonb(COALESCE((queries_by_language ->> %s::text)::integer, 0) + %s))",
+        (language, language, count)
+    )
+
+def _update_day(day, updates):
+    """UPDATE the day's row, creating it first if this is the day's first query"""
+    if SystemPerformanceMetrics.objects.filter(date=day).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            SystemPerformanceMetrics.objects.create(date=day, queries_by_language={})
+    except IntegrityError:
+        pass  # A concurrent request created it first
+    SystemPerformanceMetrics.objects.filter(date=day).update(**updates)
 
 class PerformanceAnalyzer:
     """Service for analyzing system performance over time"""
@@ -181,11 +447,14 @@ class PerformanceAnalyzer:
                 'total_queries': recent_queries.count(),
                 'avg_response_time': recent_queries.aggregate(Avg('response_time_ms'))['response_time_ms__avg'],
                 'avg_relevance': recent_queries.aggregate(Avg('avg_relevance_score'))['avg_relevance_score__avg'],
+                # Per-stage p50/p90/p95/p99 from the daily histograms (today, so calendar- not 24h-aligned)
+                'latency_percentiles': stage_percentiles(days=1),
             },
             'last_7d': {
                 'total_queries': weekly_queries.count(),
                 'avg_response_time': weekly_queries.aggregate(Avg('response_time_ms'))['response_time_ms__avg'],
                 'avg_relevance': weekly_queries.aggregate(Avg('avg_relevance_score'))['avg_relevance_score__avg'],
                 'languages': weekly_queries.values('language').annotate(count=Count('id')),
+                'latency_percentiles': stage_percentiles(days=7),
             }
         }
@@ -0,0 +1,100 @@
+# core/pdf_extraction.py
+# Kept free of Django/model imports: pool workers are spawned processes that
+# import this module on their own, and must not load the embedding model.
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Processes used to extract text from large PDFs in parallel
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', min(4, os.cpu_count() or 1)))
+# Pages handed to a worker per task
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 16))
+# Smaller PDFs are extracted in-process; spawning workers would cost more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 64))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """Shared process pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a process that has torch threads running can deadlock
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+def extract_page_range(file_path, start, end):
+    """Text of pages [start, end) of a PDF (runs in a pool worker)"""
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as doc:
+        return [doc[i].get_text() for i in range(start, end)]
+
+def iter_pdf_page_batches(file_path, pages_per_task=None, workers=None):
+    """
+    Yield (page_texts, total_pages) for consecutive page ranges, in order.
+
+    Large PDFs are extracted by the process pool with at most 2 x workers
+    ranges in flight, so memory is bounded by that window rather than by
+    the size of the document.
+    """
+    import fitz  # PyMuPDF
+    pages_per_task = max(1, pages_per_task or PDF_PAGES_PER_TASK)
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+
+    with fitz.open(file_path) as doc:
+        total_pages = doc.page_count
+        if workers <= 1 or total_pages < PDF_PARALLEL_MIN_PAGES:
+            for start in range(0, total_pages, pages_per_task):
+                end = min(start + pages_per_task, total_pages)
+                yield [doc[i].get_text() for i in range(start, end)], total_pages
+            return
+
+    ranges = iter([
+        (start, min(start + pages_per_task, total_pages))
+        for start in range(0, total_pages, pages_per_task)
+    ])
+    pool = get_extraction_pool()
+    window = deque(
+        pool.submit(extract_page_range, file_path, start, end)
+        for start, end in islice(ranges, workers * 2)
+    )
+    try:
+        while window:
+            page_texts = window.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                window.append(pool.submit(extract_page_range, file_path, *next_range))
+            yield page_texts, total_pages
+    finally:
+        for future in window:
+            future.cancel()
+
+def iter_document_segments(file_path, progress=None):
+    """
+    Yield the text of a document piece by piece (PDF pages, or the whole
+    body of a .docx). Joining the segments with "\\n" gives the full text.
+    If progress is a dict, pages_done and total_pages are kept up to date.
+    """
+    if progress is None:
+        progress = {}
+    progress.setdefault('pages_done', 0)
+    progress.setdefault('total_pages', 0)
+
+    if file_path.endswith('.pdf'):
+        for page_texts, total_pages in iter_pdf_page_batches(file_path):
+            progress['total_pages'] = total_pages
+            for text in page_texts:
+                progress['pages_done'] += 1
+                yield text
+    elif file_path.endswith('.docx'):
+        import docx
+        doc = docx.Document(file_path)
+        progress['total_pages'] = progress['pages_done'] = 1
+        yield "\n".join([para.text for para in doc.paragraphs])
@@ -0,0 +1,257 @@
+# core/query_log_writer.py
+import atexit
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.db import close_old_connections
+
+from core.histogram import Histogram
+
+# Write QueryLog rows from a background thread instead of inside the request
+QUERY_LOG_ASYNC = os.getenv('QUERY_LOG_ASYNC', '1') == '1'
+# Rows written per bulk_create
+QUERY_LOG_BATCH_SIZE = int(os.getenv('QUERY_LOG_BATCH_SIZE', 100))
+# Longest a row waits in memory before it is written
+QUERY_LOG_FLUSH_INTERVAL_MS = float(os.getenv('QUERY_LOG_FLUSH_INTERVAL_MS', 1000))
+# Rows held in memory at most; past this, the request that queues a row writes the batch itself
+QUERY_LOG_MAX_QUEUE = int(os.getenv('QUERY_LOG_MAX_QUEUE', 10000))
+# How long find_query_log keeps looking for a row another worker process has
+# queued but not written yet (one flush interval plus slack by default)
+QUERY_LOG_LOOKUP_WAIT_MS = float(os.getenv('QUERY_LOG_LOOKUP_WAIT_MS', QUERY_LOG_FLUSH_INTERVAL_MS + 1000))
+QUERY_LOG_LOOKUP_POLL_MS = 100
+
+FLUSH_BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class QueryLogWriter:
+    """
+    Buffers unsaved QueryLog rows in memory and writes them with
+    bulk_create from a background thread, once batch_size rows are queued
+    or the oldest has waited flush_interval_ms, then adds them to the daily
+    metrics in one pass. Rows carry a pre-allocated query_uuid, so callers
+    can hand the id to the client before the row exists.
+
+    Rows still queued at interpreter exit are written by an atexit hook.
+    A failed write is retried with the next flush; rows that fail twice are
+    dropped (and counted) so a database outage cannot grow the queue forever.
+    """
+
+    def __init__(self, batch_size=QUERY_LOG_BATCH_SIZE, flush_interval_ms=QUERY_LOG_FLUSH_INTERVAL_MS,
+                 max_queue=QUERY_LOG_MAX_QUEUE, enabled=QUERY_LOG_ASYNC):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self.enabled = enabled
+
+        self._queue = deque()
+        self._retry = []
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._atexit_registered = False
+        self._retry_after = 0.0
+
+        self.submitted = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.inline_flushes = 0
+        self.dropped = 0
+        self.last_error = None
+        self.last_flush_at = None
+        self.flush_latency_ms = Histogram()
+        self.flush_batch_size = Histogram(FLUSH_BATCH_BUCKETS)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='query-log-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+
+    def submit(self, query_log):
+        """Queue an unsaved QueryLog; returns it (query_uuid already set, id still None)"""
+        if query_log.query_uuid is None:
+            query_log.query_uuid = uuid.uuid4()
+
+        with self._cond:
+            if self._closed:
+                inline = True
+            else:
+                self._ensure_thread()
+                self._queue.append((time.monotonic(), query_log))
+                self._pending[str(query_log.query_uuid)] = query_log
+                self.submitted += 1
+                inline = len(self._queue) >= self.max_queue
+                if len(self._queue) >= self.batch_size:
+                    self._cond.notify()
+
+        if inline:
+            # Shutting down, or the writer is falling behind: write now, in this thread
+            with self._cond:
+                self.inline_flushes += 1
+            if self._closed:
+                self._write([query_log])
+            else:
+                self.flush()
+        return query_log
+
+    def is_pending(self, query_uuid):
+        with self._cond:
+            return str(query_uuid) in self._pending
+
+    def _take_batch(self):
+        with self._cond:
+            batch = self._retry[:self.batch_size]
+            self._retry = self._retry[self.batch_size:]
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft()[1])
+            return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    if self._retry or len(self._queue) >= self.batch_size:
+                        due = now
+                    elif self._queue:
+                        due = self._queue[0][0] + self.flush_interval
+                    else:
+                        due = None
+                    if due is not None:
+                        # After a failed write, wait a full interval before trying again
+                        due = max(due, self._retry_after)
+                        if due <= now:
+                            break
+                    self._cond.wait(due - now if due is not None else None)
+                if self._closed:
+                    return
+            self.flush(limit_batches=1)
+
+    def flush(self, limit_batches=None):
+        """Write queued rows (all of them, or limit_batches batches) now"""
+        with self._flush_lock:
+            batches = 0
+            while limit_batches is None or batches < limit_batches:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                self._write(batch)
+                batches += 1
+
+    def _write(self, batch):
+        from core.models import QueryLog
+        from core.monitoring import record_daily_metrics
+
+        start = time.perf_counter()
+        close_old_connections()
+        try:
+            QueryLog.objects.bulk_create(batch)
+        except Exception as e:
+            self._write_failed(batch, e)
+            return
+
+        try:
+            record_daily_metrics(batch)
+        except Exception as e:
+            # The rows are stored; reconcile_daily_metrics can rebuild the day
+            print(f"Daily metrics update for {len(batch)} queries failed: {e}")
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flush_latency_ms.observe(elapsed_ms)
+        self.flush_batch_size.observe(len(batch))
+        with self._cond:
+            self.flushes += 1
+            self.written += len(batch)
+            self.last_flush_at = time.time()
+            for row in batch:
+                self._pending.pop(str(row.query_uuid), None)
+
+    def _write_failed(self, batch, error):
+        print(f"QueryLog flush of {len(batch)} rows failed: {error}")
+        with self._cond:
+            self.failed_flushes += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            self._retry_after = time.monotonic() + self.flush_interval
+            for row in batch:
+                if getattr(row, '_log_write_failed', False) or self._closed:
+                    self._pending.pop(str(row.query_uuid), None)
+                    self.dropped += 1
+                else:
+                    row._log_write_failed = True
+                    self._retry.append(row)
+
+    def close(self):
+        """Stop the background thread and write everything still queued"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                'enabled': self.enabled,
+                'batch_size': self.batch_size,
+                'flush_interval_ms': self.flush_interval * 1000,
+                'max_queue': self.max_queue,
+                'queue_depth': len(self._queue) + len(self._retry),
+                'submitted': self.submitted,
+                'written': self.written,
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'inline_flushes': self.inline_flushes,
+                'dropped': self.dropped,
+                'last_error': self.last_error,
+                'last_flush_at': self.last_flush_at,
+            }
+        stats['flush_latency_ms'] = self.flush_latency_ms.snapshot()
+        stats['flush_batch_size'] = self.flush_batch_size.snapshot()
+        return stats
+
+
+query_log_writer = QueryLogWriter()
+
+def find_query_log(query_id, wait_ms=None):
+    """
+    QueryLog by the query_id a response handed out: a query_uuid, or the
+    integer id older clients still send. A row this process has not written
+    yet is flushed first, so feedback can arrive right after the answer.
+
+    Under several worker processes the answer may have come from another
+    worker whose writer still holds the row; the lookup then polls for up
+    to wait_ms (QUERY_LOG_LOOKUP_WAIT_MS) before giving up.
+    """
+    from core.models import QueryLog
+
+    query_id = str(query_id)
+    if query_id.isdigit():
+        return QueryLog.objects.get(id=int(query_id))
+    try:
+        query_uuid = uuid.UUID(query_id)
+    except ValueError:
+        raise QueryLog.DoesNotExist(f"Invalid query_id {query_id!r}")
+    if query_log_writer.is_pending(query_uuid):
+        query_log_writer.flush()
+        return QueryLog.objects.get(query_uuid=query_uuid)
+
+    wait_ms = QUERY_LOG_LOOKUP_WAIT_MS if wait_ms is None else wait_ms
+    deadline = time.monotonic() + wait_ms / 1000
+    while True:
+        try:
+            return QueryLog.objects.get(query_uuid=query_uuid)
+        except QueryLog.DoesNotExist:
+            if not query_log_writer.enabled or time.monotonic() >= deadline:
+                raise
+        time.sleep(QUERY_LOG_LOOKUP_POLL_MS / 1000)
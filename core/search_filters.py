@@ -0,0 +1,108 @@
+# core/search_filters.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Chunk metadata keys a search can be restricted to
+FILTER_FIELDS = ('language', 'category', 'document_type', 'geographic_scope')
+
+# Counting the chunks a filter matches means listing their ids, so counts are reused for a while
+SELECTIVITY_TTL = int(os.getenv('SEARCH_SELECTIVITY_TTL', 300))
+# Filter combinations whose counts are kept (least recently used dropped first);
+# geographic_scope is free text, so the number of combinations is unbounded
+SELECTIVITY_CACHE_SIZE = int(os.getenv('SEARCH_SELECTIVITY_CACHE_SIZE', 256))
+# Counts waiting for the background thread at most; past this, new combinations go uncounted
+SELECTIVITY_MAX_PENDING = int(os.getenv('SEARCH_SELECTIVITY_MAX_PENDING', 16))
+
+def document_chunk_metadata(document):
+    """UploadedDocument fields copied onto every chunk at ingest, so searches can filter on them"""
+    return {
+        'category': document.category,
+        'document_type': document.document_type,
+        'geographic_scope': document.geographic_scope,
+    }
+
+def filters_from_request(validated_data):
+    """Search filters from PromptSerializer data (document_language filters on chunk language)"""
+    filters = {
+        'language': validated_data.get('document_language'),
+        'category': validated_data.get('category'),
+        'document_type': validated_data.get('document_type'),
+        'geographic_scope': validated_data.get('geographic_scope'),
+    }
+    return {key: value for key, value in filters.items() if value}
+
+def build_where(filters):
+    """ChromaDB where clause matching every filter, or None for an unfiltered search"""
+    conditions = [{key: filters[key]} for key in FILTER_FIELDS if filters and filters.get(key)]
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+def filters_key(filters):
+    return tuple((key, filters[key]) for key in FILTER_FIELDS if filters and filters.get(key))
+
+
+class SelectivityTracker:
+    """
+    Share of the collection each filter combination matches, cached per
+    combination. Counting means listing every matching chunk id, so it is
+    done on a background thread: a request gets the cached count, or None
+    while its combination is first counted (or recounted after ttl).
+    """
+
+    def __init__(self, ttl=SELECTIVITY_TTL, max_entries=SELECTIVITY_CACHE_SIZE,
+                 max_pending=SELECTIVITY_MAX_PENDING):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        self._cache = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='selectivity')
+
+    def selectivity(self, collection, filters):
+        """Return (matching chunks, total chunks, fraction) for filters, or None if not counted yet"""
+        key = filters_key(filters)
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1]
+            if key not in self._pending and len(self._pending) < self.max_pending:
+                self._pending.add(key)
+                self._executor.submit(self._refresh, collection, filters, key)
+        # A stale count is still a better answer than none while it is redone
+        return cached[1] if cached else None
+
+    def _refresh(self, collection, filters, key):
+        try:
+            total = collection.count()
+            where = build_where(filters)
+            matched = total if where is None else len(collection.get(where=where, include=[])['ids'])
+            result = (matched, total, matched / total if total else 0.0)
+        except Exception as e:
+            print(f"Counting chunks for filters {dict(key)} failed: {e}")
+            with self._lock:
+                self._pending.discard(key)
+            return
+
+        with self._lock:
+            self._pending.discard(key)
+            self._cache[key] = (time.time(), result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+filter_selectivity = SelectivityTracker()
@@ -1,11 +1,21 @@
 # core/serializers.py
 from rest_framework import serializers
-from .models import UploadedDocument
+from .models import UploadedDocument, IngestionJob
 
 class PromptSerializer(serializers.Serializer):
     prompt = serializers.CharField()
     language = serializers.ChoiceField(choices=['en', 'fr', 'sw', 'am'], default='en')
 
+    # Optional search filters, matched against chunk metadata
+    document_language = serializers.ChoiceField(choices=['en', 'fr', 'sw', 'am'], required=False)
+    category = serializers.ChoiceField(choices=UploadedDocument.CATEGORY_CHOICES, required=False)
+    document_type = serializers.ChoiceField(
+        choices=UploadedDocument._meta.get_field('document_type').choices, required=False
+    )
+    geographic_scope = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    # vector, lexical or hybrid; RETRIEVAL_MODE when omitted
+    retrieval_mode = serializers.ChoiceField(choices=['vector', 'lexical', 'hybrid'], required=False)
+
 class UploadedDocumentSerializer(serializers.ModelSerializer):
     tags_list = serializers.SerializerMethodField()
     category_display = serializers.SerializerMethodField()
@@ -38,4 +48,19 @@ class UploadedDocumentSerializer(serializers.ModelSerializer):
         try:
             return obj.file.name.split('/')[-1] if obj.file else 'Unknown'
         except:
-            return 'Unknown'
\ No newline at end of file
+            return 'Unknown'
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    progress_percent = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = IngestionJob
+        fields = [
+            'id', 'document', 'job_type', 'status', 'chunks_done', 'total_chunks',
+            'progress_percent', 'stage_timings', 'result_message', 'error', 'worker',
+            'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress_percent(self, obj):
+        return obj.get_progress_percent()
@@ -0,0 +1,169 @@
+# core/sharding.py
+# One ChromaDB collection per document language, behind the same
+# get/query/upsert/update/delete/count calls as a single collection, so the
+# rest of the code does not know whether the store is sharded.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SHARD_LANGUAGES = ('en', 'fr', 'sw', 'am')
+# Chunks whose language is not one of the above
+FALLBACK_SHARD = 'other'
+
+_fan_out_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CHROMA_FAN_OUT_WORKERS', len(SHARD_LANGUAGES) + 1)),
+    thread_name_prefix='chroma-shard'
+)
+
+def shard_for_language(language):
+    return language if language in SHARD_LANGUAGES else FALLBACK_SHARD
+
+def shard_collection_name(base_name, shard):
+    return f"{base_name}_{shard}"
+
+def language_from_where(where):
+    """The language a where clause pins the search to, or None if it can match several"""
+    if not where:
+        return None
+    if isinstance(where.get('language'), str):
+        return where['language']
+    for condition in where.get('$and', []):
+        language = language_from_where(condition)
+        if language:
+            return language
+    return None
+
+
+class ShardedCollection:
+    """
+    Routes chunks to a collection per language by their 'language'
+    metadata. Queries pinned to one language (a language filter) search
+    only that shard; others fan out to every shard in parallel and merge
+    the top n_results by distance.
+    """
+
+    def __init__(self, client, base_name):
+        self.base_name = base_name
+        self.shards = {
+            shard: client.get_or_create_collection(shard_collection_name(base_name, shard))
+            for shard in SHARD_LANGUAGES + (FALLBACK_SHARD,)
+        }
+
+    def _targets(self, where):
+        language = language_from_where(where)
+        if language:
+            return {shard_for_language(language): self.shards[shard_for_language(language)]}
+        return self.shards
+
+    def _fan_out(self, targets, fn):
+        if len(targets) == 1:
+            return [fn(shard) for shard in targets.values()]
+        return list(_fan_out_executor.map(fn, targets.values()))
+
+    def _locate(self, ids):
+        """Which shard currently holds each id"""
+        found = {}
+        for name, shard in self.shards.items():
+            for doc_id in shard.get(ids=list(ids), include=[])['ids']:
+                found[doc_id] = name
+        return found
+
+    def count(self):
+        return sum(shard.count() for shard in self.shards.values())
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        include = list(include)
+        # Each shard returns up to offset + limit rows; the combined list is sliced after merging
+        shard_limit = (offset or 0) + limit if limit is not None else None
+        results = self._fan_out(
+            self._targets(where),
+            lambda shard: shard.get(ids=ids, where=where, limit=shard_limit, include=include)
+        )
+
+        merged = {'ids': []}
+        merged.update({field: [] for field in include})
+        for result in results:
+            merged['ids'].extend(result['ids'])
+            for field in include:
+                merged[field].extend(result.get(field) or [])
+
+        if offset or limit is not None:
+            end = (offset or 0) + limit if limit is not None else None
+            for key in merged:
+                merged[key] = merged[key][offset or 0:end]
+        return merged
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=("metadatas", "documents", "distances")):
+        include = list(include)
+        fields = include if 'distances' in include else include + ['distances']
+        results = self._fan_out(
+            self._targets(where),
+            lambda shard: shard.query(query_embeddings=query_embeddings, n_results=n_results,
+                                      where=where, include=fields)
+        )
+
+        merged = {'ids': []}
+        merged.update({field: [] for field in include})
+        for q in range(len(query_embeddings)):
+            # (distance, shard result, position) for every hit of query q, closest first
+            hits = sorted(
+                (result['distances'][q][i], r, i)
+                for r, result in enumerate(results)
+                for i in range(len(result['ids'][q]))
+            )[:n_results]
+            merged['ids'].append([results[r]['ids'][q][i] for _, r, i in hits])
+            for field in include:
+                merged[field].append([results[r][field][q][i] for _, r, i in hits])
+        return merged
+
+    def upsert(self, ids, embeddings, metadatas, documents=None):
+        # A chunk whose document changed language moves shard; drop the old copy
+        located = self._locate(ids)
+        groups = {}
+        for i, doc_id in enumerate(ids):
+            target = shard_for_language(metadatas[i].get('language'))
+            groups.setdefault(target, []).append(i)
+            previous = located.get(doc_id)
+            if previous and previous != target:
+                self.shards[previous].delete(ids=[doc_id])
+
+        for target, positions in groups.items():
+            self.shards[target].upsert(
+                ids=[ids[i] for i in positions],
+                embeddings=[embeddings[i] for i in positions],
+                metadatas=[metadatas[i] for i in positions],
+                documents=[documents[i] for i in positions] if documents is not None else None
+            )
+
+    def update(self, ids, metadatas):
+        located = self._locate(ids)
+        in_place = {}
+        moves = []
+        for doc_id, metadata in zip(ids, metadatas):
+            current = located.get(doc_id)
+            if current is None:
+                continue
+            target = shard_for_language(metadata.get('language', current))
+            if target == current:
+                in_place.setdefault(current, []).append((doc_id, metadata))
+            else:
+                moves.append((doc_id, metadata, current, target))
+
+        for shard, items in in_place.items():
+            self.shards[shard].update(ids=[doc_id for doc_id, _ in items],
+                                      metadatas=[metadata for _, metadata in items])
+
+        for doc_id, metadata, current, target in moves:
+            stored = self.shards[current].get(ids=[doc_id], include=["embeddings", "documents", "metadatas"])
+            merged_metadata = {**stored['metadatas'][0], **metadata}
+            self.shards[target].upsert(
+                ids=[doc_id],
+                embeddings=[stored['embeddings'][0]],
+                documents=[stored['documents'][0]],
+                metadatas=[{key: value for key, value in merged_metadata.items() if value is not None}]
+            )
+            self.shards[current].delete(ids=[doc_id])
+
+    def delete(self, ids=None, where=None):
+        for shard in self._targets(where).values():
+            shard.delete(ids=ids, where=where)
@@ -1,3 +1,2137 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from core.answer_cache import SemanticAnswerCache, chunk_fingerprints
+from core.coalescing import SingleFlight
+from core.embedding_batcher import MicroBatcher
+from core.embedding_backends import cosine_drift, load_backend, neighbour_agreement
+from core.embedding_cache import QueryEmbeddingCache, SQLiteStore
+from core.embedding_server import EmbeddingClient, make_server
+from core.context_packing import build_prompt, pack_context
+from core.hybrid_search import reciprocal_rank_fusion
+from core.lexical_index import BM25Index
+from core.query_log_writer import QueryLogWriter, find_query_log, query_log_writer
+from core.search_filters import SelectivityTracker
+from core.sharding import ShardedCollection, language_from_where
+from core.gpt_client import LLMBackend, LLMClient, LLMOverloadedError, LLMRouter, describe_llm_error
+
+
+class CountingEncoder:
+    """encode_fn that returns a fixed-size vector per text and counts its calls"""
+
+    def __init__(self, dim=4):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(texts)
+        if isinstance(texts, str):
+            return np.full(self.dim, len(texts), dtype=np.float32)
+        return np.array([np.full(self.dim, len(text), dtype=np.float32) for text in texts])
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.encode = CountingEncoder()
+
+    def test_hit_after_miss_and_normalized_key(self):
+        cache = QueryEmbeddingCache(max_entries=10)
+        first = cache.get_or_encode("What is Article 19?", "model", self.encode)
+        second = cache.get_or_encode("  what is   ARTICLE 19? ", "model", self.encode)
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(len(self.encode.calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_model_name_is_part_of_the_key(self):
+        cache = QueryEmbeddingCache(max_entries=10)
+        cache.get_or_encode("query", "model-a", self.encode)
+        cache.get_or_encode("query", "model-b", self.encode)
+        self.assertEqual(cache.misses, 2)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = QueryEmbeddingCache(max_entries=2)
+        cache.get_or_encode("a", "m", self.encode)
+        cache.get_or_encode("b", "m", self.encode)
+        cache.get_or_encode("a", "m", self.encode)  # a is now the most recent
+        cache.get_or_encode("c", "m", self.encode)  # evicts b
+        self.assertEqual(cache.evictions, 1)
+        cache.get_or_encode("a", "m", self.encode)
+        cache.get_or_encode("b", "m", self.encode)
+        self.assertEqual(cache.misses, 4)
+
+    def test_shared_tier_is_read_by_another_process_cache(self):
+        path = os.path.join(self.tmp.name, 'embeddings.sqlite3')
+        writer = QueryEmbeddingCache(max_entries=10, shared_store=SQLiteStore(path))
+        vector = writer.get_or_encode("shared query", "m", self.encode)
+
+        reader = QueryEmbeddingCache(max_entries=10, shared_store=SQLiteStore(path))
+        np.testing.assert_array_equal(reader.get_or_encode("shared query", "m", self.encode), vector)
+        self.assertEqual(len(self.encode.calls), 1)
+        self.assertEqual((reader.shared_hits, reader.misses), (1, 0))
+
+        # Promoted to the in-process tier on the shared hit
+        reader.get_or_encode("shared query", "m", self.encode)
+        self.assertEqual(reader.hits, 1)
+
+    def test_shared_tier_failure_falls_back_to_encoding(self):
+        class BrokenStore:
+            def get(self, key):
+                raise OSError("store down")
+
+            def set(self, key, vector):
+                raise OSError("store down")
+
+        cache = QueryEmbeddingCache(max_entries=10, shared_store=BrokenStore())
+        vector = cache.get_or_encode("query", "m", self.encode)
+        self.assertEqual(vector.shape, (4,))
+        self.assertEqual(cache.shared_errors, 2)
+
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = SemanticAnswerCache(threshold=0.95, ttl=60, max_entries=10, enabled=True)
+        self.fingerprints = chunk_fingerprints(['c1', 'c2'], [{'content_hash': 'h1'}, {'content_hash': 'h2'}])
+        self.cache.store("original question", [1.0, 0.0, 0.0], 'en', self.fingerprints, "cached answer")
+
+    def test_paraphrase_within_threshold_hits(self):
+        hit = self.cache.lookup([0.99, 0.05, 0.0], 'en', self.fingerprints)
+        self.assertEqual(hit.answer, "cached answer")
+        self.assertGreaterEqual(hit.similarity, 0.95)
+
+    def test_dissimilar_query_misses(self):
+        self.assertIsNone(self.cache.lookup([0.0, 1.0, 0.0], 'en', self.fingerprints))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_language_and_chunks_must_match(self):
+        self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], 'fr', self.fingerprints))
+        changed = chunk_fingerprints(['c1', 'c2'], [{'content_hash': 'h1'}, {'content_hash': 'new'}])
+        self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], 'en', changed))
+
+    def test_expired_entries_are_dropped(self):
+        later = self.cache._buckets[('en', self.fingerprints)][0].created_at + 61
+        with mock.patch('core.answer_cache.time.time', return_value=later):
+            self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], 'en', self.fingerprints))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_invalidate_chunks_drops_answers_built_on_them(self):
+        other = chunk_fingerprints(['c3'], [{'content_hash': 'h3'}])
+        self.cache.store("other question", [0.0, 1.0, 0.0], 'en', other, "other answer")
+
+        self.cache.invalidate_chunks(['c2'])
+        self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], 'en', self.fingerprints))
+        self.assertEqual(self.cache.lookup([0.0, 1.0, 0.0], 'en', other).answer, "other answer")
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+    def test_size_bound_evicts_oldest(self):
+        cache = SemanticAnswerCache(threshold=0.95, ttl=60, max_entries=2, enabled=True)
+        for i, chunk_id in enumerate(['a', 'b', 'c']):
+            vector = [0.0, 0.0, 0.0]
+            vector[i] = 1.0
+            cache.store(chunk_id, vector, 'en', (f"{chunk_id}:h",), chunk_id)
+        self.assertIsNone(cache.lookup([1.0, 0.0, 0.0], 'en', ("a:h",)))
+        self.assertEqual(cache.lookup([0.0, 0.0, 1.0], 'en', ("c:h",)).answer, 'c')
+
+
+def fake_context(chunks=("Article 19 protects freedom of expression.",)):
+    """What views.retrieve_context returns, without ChromaDB"""
+    return {
+        'query_embedding': np.ones(4, dtype=np.float32),
+        'chunks': list(chunks),
+        'metadatas': [{'content_hash': str(i)} for i in range(len(chunks))],
+        'distances': [0.2] * len(chunks),
+        'ids': [f"chunk_{i}" for i in range(len(chunks))],
+        'filters': {},
+        'retrieval_mode': 'vector',
+        'search_ms': 1.0,
+        'lexical_ms': None,
+        'lexical_hits': 0,
+        'selectivity': None,
+    }
+
+
+class AskPipelineCacheTests(SimpleTestCase):
+    """Only the model's own answers go into the answer cache"""
+
+    QUESTION = "What are digital rights in Africa?"
+    GARBLED = "the the the the the the"
+
+    def setUp(self):
+        self.cache = SemanticAnswerCache(threshold=0.95, ttl=60, max_entries=10, enabled=True)
+        patches = [
+            mock.patch('core.views.retrieve_context', side_effect=lambda *args: fake_context()),
+            mock.patch('core.views.answer_cache', self.cache),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_pipeline(self):
+        from core.monitoring import PerformanceMonitor
+        from core.views import run_ask_pipeline
+        return run_ask_pipeline(self.QUESTION, 'en', PerformanceMonitor().start_monitoring())
+
+    def arun_pipeline(self):
+        from core.monitoring import PerformanceMonitor
+        from core.views import arun_ask_pipeline
+        return asyncio.run(arun_ask_pipeline(self.QUESTION, 'en', PerformanceMonitor().start_monitoring()))
+
+    def cached(self):
+        context = fake_context()
+        return self.cache.lookup(context['query_embedding'], 'en',
+                                 chunk_fingerprints(context['ids'], context['metadatas']))
+
+    def test_garbled_fallback_is_not_cached(self):
+        with mock.patch('core.gpt_client.llm_client.complete', return_value=self.GARBLED):
+            result = self.run_pipeline()
+        # The canned digital-rights answer, which has no ⚠️ prefix
+        self.assertTrue(result['answer'].startswith("Digital rights in Africa"))
+        self.assertIsNone(self.cached())
+
+    def test_async_garbled_fallback_is_not_cached(self):
+        with mock.patch('core.gpt_client.llm_client.acomplete', new=mock.AsyncMock(return_value=self.GARBLED)):
+            self.arun_pipeline()
+        self.assertIsNone(self.cached())
+
+    def test_llm_error_is_not_cached(self):
+        with mock.patch('core.gpt_client.llm_client.complete', side_effect=RuntimeError("boom")):
+            result = self.run_pipeline()
+        self.assertTrue(result['answer'].startswith('⚠️'))
+        self.assertIsNone(self.cached())
+
+    def test_model_answer_is_cached(self):
+        answer = "Article 19 guarantees freedom of expression online and offline."
+        with mock.patch('core.gpt_client.llm_client.complete', return_value=answer):
+            self.run_pipeline()
+        self.assertEqual(self.cached().answer, answer)
+
+
+class AskStreamViewTests(SimpleTestCase):
+    def setUp(self):
+        from rest_framework.test import APIRequestFactory
+        self.factory = APIRequestFactory()
+        patches = [
+            mock.patch('core.views.retrieve_context', side_effect=lambda *args: fake_context()),
+            mock.patch('core.views.answer_cache.lookup', return_value=None),
+            mock.patch('core.views.answer_cache.store'),
+            mock.patch('core.views.PerformanceMonitor.log_query', return_value=None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        from core.views import PerformanceMonitor
+        self.log_query = PerformanceMonitor.log_query
+
+    def stream(self, tokens):
+        from core.views import ask_stream_view
+        # The generator runs after the view returns, so keep the LLM patched until cleanup
+        patcher = mock.patch('core.views.stream_mistral', side_effect=lambda *args, **kwargs: iter(tokens))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        request = self.factory.post('/api/ask/stream/', {'prompt': 'What is Article 19?'}, format='json')
+        return ask_stream_view(request)
+
+    def test_completed_stream_is_logged_once(self):
+        events = list(self.stream(["Article 19 ", "guarantees freedom ", "of expression online."]).streaming_content)
+        self.assertTrue(events[-1].startswith(b"event: done"))
+        self.log_query.assert_called_once()
+        kwargs = self.log_query.call_args.kwargs
+        self.assertEqual(kwargs['response_text'], "Article 19 guarantees freedom of expression online.")
+        self.assertNotIn('aborted', kwargs['metadata'])
+
+    def test_client_disconnect_logs_partial_answer(self):
+        response = self.stream(["Free ", "speech", " and more."])
+        content = iter(response.streaming_content)
+        next(content)  # context
+        next(content)  # first token
+        next(content)  # second token
+        response.close()  # what Django does when the client goes away
+
+        self.log_query.assert_called_once()
+        kwargs = self.log_query.call_args.kwargs
+        self.assertEqual(kwargs['response_text'], "Free speech")
+        self.assertTrue(kwargs['metadata']['aborted'])
+
+
+class StubLLMServer:
+    """Local OpenAI-compatible chat completions server that answers after `delay` seconds"""
+
+    def __init__(self, answer="stub answer", delay=0.0):
+        stub = self
+        self.answer = answer
+        self.delay = delay
+        self.hits = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with lock:
+                    stub.hits += 1
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                with lock:
+                    stub.in_flight -= 1
+                body = json.dumps({'choices': [{'message': {'content': stub.answer}}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def free_port():
+    """A local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def refused_url():
+    return f"http://127.0.0.1:{free_port()}/v1/chat/completions"
+
+
+class LLMRouterTests(SimpleTestCase):
+    def stub(self, **kwargs):
+        server = StubLLMServer(**kwargs)
+        self.addCleanup(server.close)
+        return server
+
+    def llm_client(self, urls, max_concurrency=2, eject_after=2, eject_seconds=30, queue_timeout=1):
+        backends = [LLMBackend(url, max_concurrency=max_concurrency) for url in urls]
+        client = LLMClient(backends=backends, queue_timeout=queue_timeout)
+        client.router.eject_after = eject_after
+        client.router.eject_seconds = eject_seconds
+        return client
+
+    def test_least_outstanding_backend_is_chosen(self):
+        slow = self.stub(answer="slow", delay=0.5)
+        fast = self.stub(answer="fast")
+        client = self.llm_client([slow.url, fast.url])
+
+        busy = threading.Thread(target=client.complete, args=("first", 5))
+        busy.start()
+        self.addCleanup(busy.join)
+        deadline = time.monotonic() + 2
+        while client.router.backends[0].outstanding == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # The slow backend is busy, so the next request goes to the idle one
+        self.assertEqual(client.complete("second", 5), "fast")
+        busy.join()
+        self.assertEqual((slow.hits, fast.hits), (1, 1))
+
+    def test_async_requests_share_the_backend_slots(self):
+        server = self.stub(answer="async ok")
+        client = self.llm_client([server.url], max_concurrency=1)
+
+        async def ask_twice():
+            return await asyncio.gather(client.acomplete("a", 5), client.acomplete("b", 5))
+
+        self.assertEqual(asyncio.run(ask_twice()), ["async ok", "async ok"])
+        backend = client.router.backends[0]
+        self.assertEqual((backend.outstanding, backend.requests), (0, 2))
+
+    def test_backend_is_ejected_after_consecutive_connection_errors(self):
+        good = self.stub(answer="ok")
+        client = self.llm_client([refused_url(), good.url], eject_after=2)
+        refusing = client.router.backends[0]
+
+        # Refused connections are retried on the other backend
+        self.assertEqual(client.complete("q1", 5), "ok")
+        self.assertTrue(refusing.is_healthy())
+        self.assertEqual(client.complete("q2", 5), "ok")
+        self.assertFalse(refusing.is_healthy())
+
+        client.complete("q3", 5)
+        self.assertEqual(refusing.requests, 2)
+        self.assertEqual(good.hits, 3)
+
+    def test_ejected_backend_is_readmitted_after_eject_seconds(self):
+        good = self.stub(answer="ok")
+        client = self.llm_client([refused_url(), good.url], eject_after=1, eject_seconds=0.2)
+        refusing = client.router.backends[0]
+
+        client.complete("q1", 5)
+        self.assertFalse(refusing.is_healthy())
+        client.complete("q2", 5)
+        self.assertEqual(refusing.requests, 1)
+
+        time.sleep(0.3)
+        self.assertTrue(refusing.is_healthy())
+        client.complete("q3", 5)
+        self.assertEqual(refusing.requests, 2)
+
+    def test_ejected_backend_slots_do_not_raise_the_cap_of_the_others(self):
+        router = LLMRouter([LLMBackend('http://a', max_concurrency=1), LLMBackend('http://b', max_concurrency=1)])
+        a, b = router.backends
+        b.ejected_until = time.time() + 60
+
+        self.assertIs(router.acquire(), a)
+        # a is at its cap: wait for it rather than overload it with b's share
+        self.assertIsNone(router.acquire(timeout=0.05))
+        router.release(a, 10.0)
+        self.assertIs(router.acquire(), a)
+
+    def test_queued_request_gets_the_freed_slot(self):
+        router = LLMRouter([LLMBackend('http://a', max_concurrency=1)])
+        backend = router.acquire()
+        threading.Timer(0.05, router.release, args=(backend, 10.0)).start()
+        self.assertIs(router.acquire(timeout=2), backend)
+
+        async def waiter():
+            threading.Timer(0.05, router.release, args=(backend, 10.0)).start()
+            return await router.aacquire(timeout=2)
+
+        self.assertIs(asyncio.run(waiter()), backend)
+
+    def test_full_queue_rejects_with_overloaded_error(self):
+        client = LLMClient(backends=[LLMBackend('http://a', max_concurrency=1)], max_queue=0, queue_timeout=0.05)
+        with client.slot():
+            with self.assertRaises(LLMOverloadedError):
+                with client.slot():
+                    pass
+        self.assertEqual(client.rejected, 1)
+
+    def test_cancelled_request_leaves_health_and_latency_alone(self):
+        router = LLMRouter([LLMBackend('http://a')], eject_after=1)
+        backend = router.backends[0]
+        backend.ewma_latency_ms = 100.0
+        backend.consecutive_failures = 0
+
+        with self.assertRaises(asyncio.CancelledError):
+            with router.track(router.acquire()):
+                time.sleep(0.01)
+                raise asyncio.CancelledError()
+
+        self.assertEqual(backend.outstanding, 0)
+        self.assertEqual(backend.ewma_latency_ms, 100.0)
+        self.assertTrue(backend.is_healthy())
+        self.assertEqual((backend.failures, backend.cancelled), (0, 1))
+
+    def test_error_message_names_the_failed_backend(self):
+        url = refused_url()
+        client = self.llm_client([url])
+        try:
+            client.complete("q", 5)
+        except Exception as e:
+            message = describe_llm_error(e, "q", 5)
+        self.assertIn(url, message)
+        self.assertNotIn("localhost:1234", message)
+
+
+class LLMConcurrencyLimitTests(SimpleTestCase):
+    """At most max_concurrency requests reach the model server; the rest queue or are turned away"""
+
+    def test_requests_beyond_the_limit_wait_their_turn(self):
+        server = StubLLMServer(answer="ok", delay=0.2)
+        self.addCleanup(server.close)
+        client = LLMClient(backends=[LLMBackend(server.url, max_concurrency=1)], max_queue=5, queue_timeout=5)
+        stats = [{} for _ in range(3)]
+
+        threads = [threading.Thread(target=client.complete, args=(f"q{i}", 5, stats[i])) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((server.hits, server.peak_in_flight), (3, 1))
+        waits = sorted(entry['queue_wait_ms'] for entry in stats)
+        # Each request waits for the ones ahead of it to finish
+        self.assertLess(waits[0], 150)
+        self.assertGreater(waits[1], 150)
+        self.assertGreater(waits[2], 350)
+        self.assertEqual((client.waiting, client.active, client.rejected), (0, 0, 0))
+
+    def test_queued_request_gives_up_after_queue_timeout(self):
+        client = LLMClient(backends=[LLMBackend('http://a', max_concurrency=1)], max_queue=5, queue_timeout=0.1)
+        stats = {}
+
+        with client.slot():
+            start = time.perf_counter()
+            with self.assertRaises(LLMOverloadedError):
+                with client.slot(stats):
+                    pass
+            elapsed = time.perf_counter() - start
+
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertGreaterEqual(stats['queue_wait_ms'], 100)
+        self.assertEqual((client.waiting, client.rejected), (0, 1))
+
+    def test_queue_length_is_bounded_by_max_queue(self):
+        client = LLMClient(backends=[LLMBackend('http://a', max_concurrency=1)], max_queue=1, queue_timeout=5)
+        entered = threading.Event()
+
+        def queued():
+            with client.slot():
+                entered.set()
+
+        with client.slot():
+            waiter = threading.Thread(target=queued)
+            waiter.start()
+            wait_for(lambda: client.waiting == 1)
+            # The one queue place is taken, so a third request is rejected at once
+            with self.assertRaises(LLMOverloadedError):
+                with client.slot():
+                    pass
+            self.assertFalse(entered.is_set())
+
+        waiter.join(timeout=5)
+        self.assertTrue(entered.is_set())
+        self.assertEqual(client.stats()['waiting'], 0)
+        self.assertEqual(client.stats()['rejected'], 1)
+
+    def test_overloaded_error_reaches_the_caller(self):
+        from core.gpt_client import ask_mistral
+
+        with mock.patch('core.gpt_client.llm_client.complete', side_effect=LLMOverloadedError("full")):
+            with self.assertRaises(LLMOverloadedError):
+                ask_mistral("prompt")
+
+
+class AskAsyncViewTests(SimpleTestCase):
+    """The async ask path end to end against a stub model server"""
+
+    def setUp(self):
+        import httpx
+        from django.test import RequestFactory
+
+        self.factory = RequestFactory()
+        self.server = StubLLMServer(answer="Article 19 guarantees freedom of expression online.")
+        self.addCleanup(self.server.close)
+        self.llm = LLMClient(backends=[LLMBackend(self.server.url)])
+
+        self.created = created = []
+
+        class RecordingAsyncClient(httpx.AsyncClient):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                created.append(self)
+
+        patches = [
+            mock.patch('core.gpt_client.llm_client', self.llm),
+            mock.patch('core.gpt_client.httpx.AsyncClient', RecordingAsyncClient),
+            mock.patch('core.views.retrieve_context', side_effect=lambda *args: fake_context()),
+            mock.patch('core.views.answer_cache.lookup', return_value=None),
+            mock.patch('core.views.answer_cache.store'),
+            mock.patch('core.views.PerformanceMonitor.alog_query', new=mock.AsyncMock(return_value=None)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ask(self, prompt="What is Article 19?"):
+        """Call the view the way a sync (WSGI) caller does, through async_to_sync"""
+        from asgiref.sync import async_to_sync
+        from core.views import ask_async_view
+
+        request = self.factory.post('/api/ask/async/', json.dumps({'prompt': prompt}),
+                                    content_type='application/json')
+        return async_to_sync(ask_async_view)(request)
+
+    def test_answer_comes_from_the_model(self):
+        from core.views import PerformanceMonitor
+
+        response = self.ask()
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['response'], self.server.answer)
+        self.assertFalse(data['cache_hit'])
+        self.assertEqual(self.server.hits, 1)
+        self.assertTrue(PerformanceMonitor.alog_query.call_args.kwargs['metadata']['async'])
+
+    def test_each_short_lived_loop_closes_its_client(self):
+        self.ask()
+        self.ask("Who enforces the data protection act?")
+        self.assertEqual(len(self.created), 2)
+        self.assertTrue(all(client.is_closed for client in self.created))
+
+    def test_one_client_per_loop(self):
+        from core.gpt_client import aask_mistral
+
+        async def ask_twice():
+            return await asyncio.gather(aask_mistral("first question here"), aask_mistral("second question here"))
+
+        answers = asyncio.run(ask_twice())
+        self.assertEqual(answers, [self.server.answer] * 2)
+        self.assertEqual(len(self.created), 1)
+        self.assertTrue(self.created[0].is_closed)
+
+    def test_model_server_down_returns_an_error_answer(self):
+        from core.gpt_client import aask_mistral
+
+        self.llm = LLMClient(backends=[LLMBackend(refused_url())])
+        with mock.patch('core.gpt_client.llm_client', self.llm):
+            stats = {}
+            answer = asyncio.run(aask_mistral("What is Article 19?", stats=stats))
+        self.assertTrue(answer.startswith("⚠️ Connection Error"))
+        self.assertEqual(stats['fallback'], 'error')
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def work():
+            calls.append(1)
+            release.wait(2)
+            return "answer"
+
+        def ask():
+            results.append(flights.do("key", work))
+
+        threads = [threading.Thread(target=ask) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 2
+        while flights.coalesced < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(coalesced for _, coalesced, _ in results), [False, True, True, True])
+        self.assertTrue(all(result == "answer" for result, _, _ in results))
+        self.assertEqual(flights.stats()['in_flight'], 0)
+
+    def test_exception_is_shared_with_followers(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def work():
+            started.set()
+            release.wait(2)
+            raise ValueError("model down")
+
+        def ask():
+            try:
+                flights.do("key", work)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=ask)
+        leader.start()
+        started.wait(2)
+        follower = threading.Thread(target=ask)
+        follower.start()
+        while flights.coalesced < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(errors), 2)
+        # The next call runs again instead of replaying the failure
+        self.assertEqual(flights.do("key", lambda: "ok")[0], "ok")
+
+    def test_async_followers_share_the_leaders_result(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        async def main():
+            return await asyncio.gather(*(flights.ado("key", work) for _ in range(3)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([coalesced for _, coalesced, _ in results], [False, True, True])
+        self.assertEqual(results[0], ("answer", False, 2))
+
+    def test_async_exception_reaches_every_caller(self):
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("model down")
+
+        async def main():
+            return await asyncio.gather(*(flights.ado("key", work) for _ in range(2)), return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_cancelled_leader_does_not_cancel_followers(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        async def main():
+            leader = asyncio.ensure_future(flights.ado("key", work))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flights.ado("key", work))
+            await asyncio.sleep(0.01)
+            leader.cancel()  # the leader's client disconnected
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), ("answer", True, 1))
+        self.assertEqual(len(calls), 1)
+
+    def test_work_is_cancelled_when_every_caller_is_gone(self):
+        flights = SingleFlight()
+        finished = []
+
+        async def work():
+            await asyncio.sleep(0.2)
+            finished.append(1)
+            return "answer"
+
+        async def main():
+            leader = asyncio.ensure_future(flights.ado("key", work))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            await asyncio.sleep(0.3)
+            # A new caller starts a fresh flight
+            return await flights.ado("key", work)
+
+        self.assertEqual(asyncio.run(main()), ("answer", False, 0))
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(flights.stats()['in_flight'], 0)
+
+
+class IterChunksTests(SimpleTestCase):
+    def test_matches_chunking_the_joined_text(self):
+        from core.embedding_utils import chunk_text, iter_chunks
+
+        cases = [
+            [],
+            [""],
+            ["short"],
+            ["a" * 500],
+            ["a" * 499, "b"],
+            ["page one " * 70, "", "page three " * 120, "x"],
+            ["é" * 1203, "ñ" * 3, "end"],
+        ]
+        for segments in cases:
+            for chunk_size in (7, 500):
+                with self.subTest(segments=[len(segment) for segment in segments], chunk_size=chunk_size):
+                    self.assertEqual(
+                        list(iter_chunks(iter(segments), chunk_size)),
+                        chunk_text("\n".join(segments), chunk_size),
+                    )
+
+    def test_long_single_segment_is_chunked_in_linear_time(self):
+        from core.embedding_utils import chunk_text, iter_chunks
+
+        # A .docx arrives as one segment; re-slicing the buffer per chunk made this quadratic
+        text = "".join(chr(ord('a') + i % 26) for i in range(4_000_003))
+        start = time.perf_counter()
+        chunks = list(iter_chunks(iter([text, "tail"])))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(chunks, chunk_text(text + "\ntail"))
+        self.assertLess(elapsed, 0.5)
+
+
+def fake_pages(pages):
+    """Stand-in for pdf_extraction.iter_document_segments over in-memory page texts"""
+    def iter_document_segments(file_path, progress=None):
+        progress = {} if progress is None else progress
+        progress['total_pages'] = len(pages)
+        progress['pages_done'] = 0
+        for text in pages:
+            progress['pages_done'] += 1
+            yield text
+    return iter_document_segments
+
+
+class EmbedAndStoreTests(SimpleTestCase):
+    """Ingestion writes one batch at a time and reports progress instead of printing"""
+
+    def setUp(self):
+        self.collection = mock.MagicMock()
+        self.collection.get.return_value = {'ids': [], 'metadatas': []}
+        self.encoder = CountingEncoder()
+        for patcher in (
+            mock.patch('core.embedding_utils.collection', new=self.collection),
+            mock.patch('core.embedding_utils.lexical_index', new=mock.MagicMock()),
+            mock.patch('core.embedding_utils.embedding_client.encode', side_effect=self.encoder),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def embed(self, pages, batch_size, progress=None):
+        from contextlib import redirect_stdout
+        from io import StringIO
+        from core.embedding_utils import embed_and_store
+
+        out = StringIO()
+        with mock.patch('core.embedding_utils.iter_document_segments', fake_pages(pages)), redirect_stdout(out):
+            result = embed_and_store("report.pdf", "en", batch_size=batch_size, progress_callback=progress)
+        self.assertEqual(out.getvalue(), "")  # nothing printed per chunk
+        return result
+
+    def test_one_write_per_batch(self):
+        # 10 pages of 260 characters: 2609 characters joined, so 6 chunks of 500
+        result = self.embed(["x" * 260] * 10, batch_size=4)
+
+        upserts = self.collection.upsert.call_args_list
+        self.assertEqual([len(call.kwargs['ids']) for call in upserts], [4, 2])
+        self.assertEqual(upserts[0].kwargs['ids'], [f"report.pdf_{i}" for i in range(4)])
+        self.collection.add.assert_not_called()
+        self.assertEqual(len(self.encoder.calls), 2)
+        self.assertTrue(result.startswith("✅ Embedded 6 of 6 chunks from: report.pdf"))
+        self.assertIn("chunks/sec", result)
+
+    def test_progress_is_reported_after_every_batch(self):
+        reports = []
+        self.embed(["y" * 260] * 10, batch_size=2, progress=reports.append)
+
+        self.assertEqual([report['chunks_done'] for report in reports], [2, 4, 6, 6])
+        final = reports[-1]
+        self.assertEqual((final['total_chunks'], final['pages_done'], final['total_pages']), (6, 10, 10))
+        self.assertEqual(final['chunks_encoded'], 6)
+        self.assertGreater(final['chunks_per_sec'], 0)
+        for key in ('extract_s', 'encode_s', 'store_s', 'elapsed_s', 'pages_per_sec'):
+            self.assertIn(key, final)
+
+    def test_document_without_text_writes_nothing(self):
+        result = self.embed(["", "   "], batch_size=4)
+        self.assertEqual(result, "❌ No text found in: report.pdf")
+        self.collection.upsert.assert_not_called()
+
+
+class EncodeDocumentTests(SimpleTestCase):
+    """The embed_docs worker side: batches are handed over one at a time, never collected"""
+
+    def setUp(self):
+        import queue
+        from core import bulk_ingestion
+        self.queue = queue.Queue()
+        patcher = mock.patch.object(bulk_ingestion, '_batch_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_batch_is_sent_before_the_next_is_encoded(self):
+        from core.bulk_ingestion import encode_document
+
+        def batches(*args, stats, **kwargs):
+            for i in range(3):
+                # The previous batch is already with the parent
+                self.assertEqual(self.queue.qsize(), i)
+                stats['chunks_done'] += 1
+                yield [(f"doc_{i}", "text", {}, np.zeros(2))], []
+
+        with mock.patch('core.embedding_utils.iter_encoded_batches', side_effect=batches):
+            encode_document("doc.pdf", "en", {}, {}, 1)
+
+        messages = [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+        self.assertEqual([message[0] for message in messages], ['batch', 'batch', 'batch', 'done'])
+        self.assertEqual(messages[-1][2]['chunks_done'], 3)
+
+    def test_errors_are_reported_to_the_parent(self):
+        from core.bulk_ingestion import encode_document
+
+        with mock.patch('core.embedding_utils.iter_encoded_batches', side_effect=OSError("unreadable PDF")):
+            encode_document("doc.pdf", "en", {}, {}, 1)
+        self.assertEqual(self.queue.get_nowait(), ('error', "doc.pdf", "unreadable PDF"))
+
+
+class ThreadPool:
+    """
+    Stand-in for embed_docs' ProcessPoolExecutor that runs encode_document
+    on threads. The first pool breaks on files named in crash, like a pool
+    whose worker was killed: that future fails and later submits are refused.
+    """
+
+    instances = []
+
+    def __init__(self, max_workers, mp_context, initializer, initargs, crash=()):
+        self.batch_queue = initargs[1]
+        self.crash = crash if not ThreadPool.instances else ()
+        self.broken = False
+        ThreadPool.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, file_name, *args):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+        from core import bulk_ingestion
+
+        if self.broken:
+            raise BrokenProcessPool("A child process terminated abruptly, the process pool is not usable anymore")
+        future = Future()
+        if file_name in self.crash:
+            self.broken = True
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+            return future
+
+        def run():
+            bulk_ingestion._batch_queue = self.batch_queue
+            future.set_result(fn(file_name, *args))
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+
+class EmbedParallelTests(SimpleTestCase):
+    """The embed_docs parent side, with the worker pool replaced by threads"""
+
+    def setUp(self):
+        from io import StringIO
+        from core.management.commands.embed_docs import Command
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        ThreadPool.instances = []
+
+        def batches(file_name, *args, stats, **kwargs):
+            stats.update(has_text=True, pages_done=1, chunks_done=2, changed=2)
+            yield [(f"{file_name}_0", "text", {}, np.zeros(2))], []
+
+        patches = [
+            mock.patch('core.embedding_utils.iter_encoded_batches', side_effect=batches),
+            mock.patch('core.management.commands.embed_docs.existing_chunk_metadata', return_value={}),
+            mock.patch('core.management.commands.embed_docs.store_batch'),
+            mock.patch('core.management.commands.embed_docs.remove_stale_chunks', return_value=0),
+            mock.patch('core.management.commands.embed_docs.collection', new=mock.MagicMock()),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.out = StringIO()
+        self.command = Command(stdout=self.out)
+        self.command.checkpoint = {}
+        self.command.checkpoint_path = os.path.join(directory.name, 'checkpoint.json')
+        self.command.totals = {
+            'embedded': 0, 'skipped': 0, 'failed': 0,
+            'pages': 0, 'chunks': 0, 'encoded': 0,
+            'extract_s': 0.0, 'encode_s': 0.0, 'store_s': 0.0,
+        }
+
+    def embed(self, file_names, crash=()):
+        pending = [(name, None, 'en', {}, {'size': 1}) for name in file_names]
+        pool = lambda **kwargs: ThreadPool(crash=crash, **kwargs)
+        with mock.patch('core.management.commands.embed_docs.ProcessPoolExecutor', side_effect=pool):
+            self.command.embed_parallel(pending, 2, None)
+        self.command.print_summary(1.0)
+
+    def test_all_files_are_stored_and_checkpointed(self):
+        self.embed(['a.pdf', 'b.pdf', 'c.pdf'])
+        self.assertEqual(set(self.command.checkpoint), {'a.pdf', 'b.pdf', 'c.pdf'})
+        self.assertEqual(self.command.totals['chunks'], 6)
+        self.assertEqual(len(ThreadPool.instances), 1)
+
+    def test_dead_worker_fails_its_files_and_the_pool_is_rebuilt(self):
+        self.embed(['a.pdf', 'b.pdf', 'c.pdf', 'd.pdf'], crash={'b.pdf'})
+
+        self.assertEqual(len(ThreadPool.instances), 2)
+        # a finished before the crash; c was refused by the broken pool; d went to the new pool
+        self.assertEqual(set(self.command.checkpoint), {'a.pdf', 'd.pdf'})
+        self.assertEqual(self.command.totals['failed'], 2)
+        with open(self.command.checkpoint_path, encoding='utf-8') as f:
+            self.assertEqual(set(json.load(f)), {'a.pdf', 'd.pdf'})
+        output = self.out.getvalue()
+        self.assertIn("Error embedding b.pdf: worker process died", output)
+        self.assertIn("2 embedded, 0 skipped (checkpoint), 2 failed", output)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def encode_concurrently(self, batcher, texts, encode_fn):
+        results = {}
+
+        def encode(text):
+            results[text] = batcher.encode(text, encode_fn)
+
+        threads = [threading.Thread(target=encode, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_burst_is_encoded_in_one_batch(self):
+        batcher = MicroBatcher(max_batch_size=8, max_wait_ms=200, enabled=True)
+        encode = CountingEncoder()
+        texts = [f"query {'x' * i}" for i in range(8)]
+
+        results = self.encode_concurrently(batcher, texts, encode)
+
+        self.assertEqual(len(encode.calls), 1)
+        self.assertEqual(sorted(encode.calls[0]), sorted(texts))
+        # Every caller gets its own row back
+        for text in texts:
+            np.testing.assert_array_equal(results[text], np.full(4, len(text), dtype=np.float32))
+
+    def test_lone_request_is_flushed_after_max_wait(self):
+        batcher = MicroBatcher(max_batch_size=32, max_wait_ms=20, enabled=True)
+        start = time.monotonic()
+        vector = batcher.encode("alone", CountingEncoder())
+        elapsed = time.monotonic() - start
+
+        np.testing.assert_array_equal(vector, np.full(4, 5, dtype=np.float32))
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(batcher.stats()['batches'], 1)
+
+    def test_full_batch_does_not_wait_for_the_timeout(self):
+        batcher = MicroBatcher(max_batch_size=2, max_wait_ms=5000, enabled=True)
+        start = time.monotonic()
+        self.encode_concurrently(batcher, ["a", "bb"], CountingEncoder())
+        self.assertLess(time.monotonic() - start, 2.0)
+
+    def test_encode_error_reaches_every_caller_in_the_batch(self):
+        batcher = MicroBatcher(max_batch_size=4, max_wait_ms=100, enabled=True)
+        errors = []
+
+        def broken(texts):
+            raise RuntimeError("model crashed")
+
+        def encode(text):
+            try:
+                batcher.encode(text, broken)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=encode, args=(text,)) for text in ("a", "b", "c")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 3)
+
+
+class EmbeddingServerTests(SimpleTestCase):
+    def serve(self, url, encode_fn):
+        server = make_server(url, encode_fn, 'stub-model')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_client_encodes_through_the_server(self):
+        server_encode = CountingEncoder()
+        server = self.serve('http://127.0.0.1:0', server_encode)
+        fallback = CountingEncoder()
+        client = EmbeddingClient(url=f"http://127.0.0.1:{server.server_port}", fallback=fallback)
+
+        np.testing.assert_array_equal(client.encode("query"), np.full(4, 5, dtype=np.float32))
+        matrix = client.encode(["a", "bb", "ccc"])
+        self.assertEqual(matrix.shape, (3, 4))
+        np.testing.assert_array_equal(matrix[:, 0], [1, 2, 3])
+        self.assertEqual((client.remote_calls, client.local_calls), (2, 0))
+        self.assertEqual(fallback.calls, [])
+
+    def test_client_over_unix_socket(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        url = f"unix://{os.path.join(tmp.name, 'embed.sock')}"
+        self.serve(url, CountingEncoder())
+        client = EmbeddingClient(url=url, fallback=CountingEncoder())
+        self.assertEqual(client.encode(["a", "bb"]).shape, (2, 4))
+        self.assertEqual(client.remote_calls, 1)
+
+    def test_unreachable_server_falls_back_then_retries_later(self):
+        fallback = CountingEncoder()
+        client = EmbeddingClient(url=f"http://127.0.0.1:{free_port()}", fallback=fallback,
+                                 timeout=1, retry_seconds=0.2)
+
+        client.encode("first")
+        client.encode("second")
+        # After the first failure the server is not tried again until retry_seconds pass
+        self.assertEqual((client.remote_errors, client.local_calls), (1, 2))
+        self.assertTrue(client.stats()['fallback_active'])
+
+        time.sleep(0.3)
+        client.encode("third")
+        self.assertEqual(client.remote_errors, 2)
+
+    def test_fallback_can_be_disabled(self):
+        client = EmbeddingClient(url=f"http://127.0.0.1:{free_port()}", fallback=CountingEncoder(),
+                                 timeout=1, allow_fallback=False)
+        with self.assertRaises(OSError):
+            client.encode("query")
+
+
+class EmbeddingBackendTests(SimpleTestCase):
+    def setUp(self):
+        # Four well separated clusters of three texts each
+        rng = np.random.default_rng(0)
+        centers = np.eye(16, dtype=np.float32)[:4] * 10
+        self.reference = np.repeat(centers, 3, axis=0) + rng.normal(scale=0.5, size=(12, 16))
+
+    def test_identical_backends_have_no_drift(self):
+        drift = cosine_drift(self.reference, self.reference * 3)  # scale does not matter
+        self.assertAlmostEqual(drift['mean_cosine'], 1.0, places=5)
+        self.assertAlmostEqual(drift['max_drift'], 0.0, places=5)
+        self.assertEqual(neighbour_agreement(self.reference, self.reference), 1.0)
+
+    def test_small_noise_keeps_neighbours_large_noise_does_not(self):
+        rng = np.random.default_rng(1)
+        slightly_off = self.reference + rng.normal(scale=1e-3, size=self.reference.shape)
+        unrelated = rng.normal(size=self.reference.shape)
+
+        self.assertLess(cosine_drift(self.reference, slightly_off)['max_drift'], 1e-3)
+        self.assertEqual(neighbour_agreement(self.reference, slightly_off, k=2), 1.0)
+        self.assertGreater(cosine_drift(self.reference, unrelated)['mean_drift'], 0.5)
+        self.assertLess(neighbour_agreement(self.reference, unrelated, k=2), 0.5)
+
+    def test_single_text_sample_agrees_trivially(self):
+        self.assertEqual(neighbour_agreement(self.reference[:1], self.reference[:1]), 1.0)
+
+    def fake_sentence_transformers(self, version):
+        import types
+        module = types.SimpleNamespace(__version__=version, SentenceTransformer=mock.Mock())
+        patcher = mock.patch.dict('sys.modules', {'sentence_transformers': module})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return module
+
+    def test_onnx_backend_needs_sentence_transformers_3_2(self):
+        module = self.fake_sentence_transformers('2.7.0')
+        with self.assertRaisesMessage(RuntimeError, "sentence-transformers>=3.2 (installed: 2.7.0)"):
+            load_backend('onnx', 'some/model')
+        module.SentenceTransformer.assert_not_called()
+
+    def test_onnx_backend_loads_on_a_recent_version(self):
+        module = self.fake_sentence_transformers('3.3.0.dev0')
+        load_backend('onnx', 'some/model')
+        self.assertEqual(module.SentenceTransformer.call_args.kwargs['backend'], 'onnx')
+
+    def test_unknown_backend_is_rejected(self):
+        import importlib.util
+        if importlib.util.find_spec('sentence_transformers') is None:
+            self.skipTest("sentence-transformers is not installed")
+        with self.assertRaises(ValueError):
+            load_backend('tensorrt', 'any-model')
+
+
+class InMemoryCollection:
+    """The parts of a ChromaDB collection ShardedCollection uses, with squared-L2 distances"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def count(self):
+        return len(self.rows)
+
+    def upsert(self, ids, embeddings, metadatas, documents=None):
+        for i, doc_id in enumerate(ids):
+            self.rows[doc_id] = (np.asarray(embeddings[i], dtype=np.float32), metadatas[i],
+                                 documents[i] if documents else None)
+
+    def get(self, ids=None, where=None, limit=None, include=()):
+        found = [doc_id for doc_id in self.rows if ids is None or doc_id in ids]
+        return {'ids': found[:limit] if limit else found,
+                'metadatas': [self.rows[doc_id][1] for doc_id in found]}
+
+    def update(self, ids, metadatas):
+        # ChromaDB merges metadata on update; None removes a key
+        for doc_id, changes in zip(ids, metadatas):
+            embedding, metadata, document = self.rows[doc_id]
+            merged = {key: value for key, value in {**metadata, **changes}.items() if value is not None}
+            self.rows[doc_id] = (embedding, merged, document)
+
+    def delete(self, ids=None, where=None):
+        for doc_id in ids or []:
+            self.rows.pop(doc_id, None)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=()):
+        result = {'ids': [], 'distances': [], 'documents': [], 'metadatas': []}
+        for query in query_embeddings:
+            scored = sorted(
+                (float(np.sum((embedding - np.asarray(query)) ** 2)), doc_id)
+                for doc_id, (embedding, _, _) in self.rows.items()
+            )[:n_results]
+            result['ids'].append([doc_id for _, doc_id in scored])
+            result['distances'].append([distance for distance, _ in scored])
+            result['documents'].append([self.rows[doc_id][2] for _, doc_id in scored])
+            result['metadatas'].append([self.rows[doc_id][1] for _, doc_id in scored])
+        return result
+
+
+class InMemoryClient:
+    def __init__(self):
+        self.collections = {}
+
+    def get_or_create_collection(self, name):
+        return self.collections.setdefault(name, InMemoryCollection())
+
+
+class ShardedCollectionTests(SimpleTestCase):
+    def setUp(self):
+        self.client = InMemoryClient()
+        self.collection = ShardedCollection(self.client, 'legal_docs')
+        # Distance from the query [0, 0] is 1, 4, 9... by chunk number; languages interleave the shards
+        chunks = [('en_1', 'en', 1), ('fr_2', 'fr', 2), ('en_3', 'en', 3),
+                  ('sw_4', 'sw', 4), ('fr_5', 'fr', 5), ('xx_6', 'ln', 6)]
+        self.collection.upsert(
+            ids=[doc_id for doc_id, _, _ in chunks],
+            embeddings=[[distance, 0.0] for _, _, distance in chunks],
+            metadatas=[{'language': language} for _, language, _ in chunks],
+            documents=[f"text of {doc_id}" for doc_id, _, _ in chunks],
+        )
+
+    def test_chunks_are_routed_by_language(self):
+        self.assertEqual(self.client.collections['legal_docs_en'].count(), 2)
+        self.assertEqual(self.client.collections['legal_docs_other'].count(), 1)
+        self.assertEqual(self.collection.count(), 6)
+
+    def test_fan_out_query_merges_shards_by_distance(self):
+        result = self.collection.query(query_embeddings=[[0.0, 0.0]], n_results=4)
+        self.assertEqual(result['ids'], [['en_1', 'fr_2', 'en_3', 'sw_4']])
+        self.assertEqual(result['distances'], [[1.0, 4.0, 9.0, 16.0]])
+        # Every field stays aligned with its id after the merge
+        self.assertEqual(result['documents'][0], [f"text of {doc_id}" for doc_id in result['ids'][0]])
+        self.assertEqual([m['language'] for m in result['metadatas'][0]], ['en', 'fr', 'en', 'sw'])
+
+    def test_language_filter_searches_one_shard(self):
+        where = {'$and': [{'category': 'policy'}, {'language': 'fr'}]}
+        self.assertEqual(language_from_where(where), 'fr')
+        result = self.collection.query(query_embeddings=[[0.0, 0.0]], n_results=5, where=where)
+        self.assertEqual(result['ids'], [['fr_2', 'fr_5']])
+
+    def test_upsert_moves_a_chunk_that_changed_language(self):
+        self.collection.upsert(ids=['en_1'], embeddings=[[1.0, 0.0]], metadatas=[{'language': 'fr'}],
+                               documents=["now in French"])
+        self.assertNotIn('en_1', self.client.collections['legal_docs_en'].rows)
+        self.assertIn('en_1', self.client.collections['legal_docs_fr'].rows)
+        self.assertEqual(self.collection.count(), 6)
+
+
+class ReembedTests(SimpleTestCase):
+    """Re-embedding a document only encodes chunks whose content hash changed"""
+
+    def setUp(self):
+        self.collection = InMemoryCollection()
+        self.encoder = CountingEncoder()
+        self.invalidated = []
+        self.answer_cache = mock.MagicMock()
+        self.answer_cache.invalidate_chunks.side_effect = self.invalidated.extend
+        for patcher in (
+            mock.patch('core.embedding_utils.collection', new=self.collection),
+            mock.patch('core.embedding_utils.lexical_index', new=mock.MagicMock()),
+            mock.patch('core.embedding_utils.answer_cache', new=self.answer_cache),
+            mock.patch('core.embedding_utils.embedding_client.encode', side_effect=self.encoder),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def embed(self, pages, **document_metadata):
+        from core.embedding_utils import embed_and_store
+
+        # 499 characters plus the joining newline: one page per 500-character chunk
+        with mock.patch('core.embedding_utils.iter_document_segments', fake_pages(pages)):
+            return embed_and_store("report.pdf", "en", batch_size=2, document_metadata=document_metadata)
+
+    def encoded(self):
+        return [text for call in self.encoder.calls for text in call]
+
+    def test_unchanged_document_encodes_nothing(self):
+        pages = [letter * 499 for letter in "abcd"]
+        self.embed(pages)
+        self.encoder.calls.clear()
+        self.invalidated.clear()
+
+        result = self.embed(pages)
+
+        self.assertEqual(self.encoded(), [])
+        self.assertEqual(self.invalidated, [])
+        self.assertTrue(result.startswith("✅ Embedded 0 of 4 chunks from: report.pdf (4 unchanged, 0 removed"))
+
+    def test_only_edited_pages_are_re_encoded(self):
+        self.embed([letter * 499 for letter in "abcd"])
+        self.encoder.calls.clear()
+
+        self.embed(["a" * 499, "B" * 499, "c" * 499, "D" * 499])
+
+        self.assertEqual([text[0] for text in self.encoded()], ["B", "D"])
+        self.assertEqual(self.invalidated[-2:], ["report.pdf_1", "report.pdf_3"])
+        self.assertEqual(self.collection.rows["report.pdf_1"][2][0], "B")
+        self.assertEqual(self.collection.rows["report.pdf_0"][2][0], "a")
+
+    def test_changed_metadata_is_written_without_encoding(self):
+        pages = [letter * 499 for letter in "ab"]
+        self.embed(pages, category='cybersecurity')
+        self.encoder.calls.clear()
+
+        self.embed(pages, category='data_protection')
+
+        self.assertEqual(self.encoded(), [])
+        self.assertEqual({metadata['category'] for _, metadata, _ in self.collection.rows.values()},
+                         {'data_protection'})
+
+    def test_chunks_past_the_new_end_are_deleted(self):
+        self.embed([letter * 499 for letter in "abcd"])
+
+        result = self.embed(["a" * 499, "b" * 499])
+
+        self.assertEqual(sorted(self.collection.rows), ["report.pdf_0", "report.pdf_1"])
+        # "b" is now the last chunk and lost its joining newline, so only "a" is unchanged
+        self.assertIn("1 unchanged, 2 removed", result)
+        self.assertIn("report.pdf_3", self.invalidated)
+
+
+class BM25IndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = BM25Index(path=os.path.join(directory.name, 'lexical.sqlite3'), max_postings=3)
+        self.index.upsert_chunks([
+            ('a', "Article 19 protects freedom of expression online", {'language': 'en'}),
+            ('b', "Freedom of assembly and freedom of association", {'language': 'en'}),
+            ('c', "The data protection act covers personal data", {'language': 'en'}),
+            ('d', "La liberté de réunion est protégée", {'language': 'fr'}),
+        ])
+
+    def test_rare_and_repeated_terms_rank_higher(self):
+        hits = self.index.search("freedom expression")
+        # 'a' matches both terms; 'b' matches freedom twice; 'c' matches neither
+        self.assertEqual([chunk_id for chunk_id, _ in hits], ['a', 'b'])
+        self.assertGreater(hits[0][1], hits[1][1])
+
+    def test_filters_and_limit(self):
+        self.assertEqual(self.index.search("freedom", filters={'language': 'fr'}), [])
+        self.assertEqual(len(self.index.search("freedom data", limit=1)), 1)
+
+    def test_stopwords_are_ignored(self):
+        self.assertEqual(self.index.search("the of and"), [])
+        self.assertEqual(
+            [chunk_id for chunk_id, _ in self.index.search("the data")],
+            [chunk_id for chunk_id, _ in self.index.search("data")],
+        )
+
+    def test_frequent_terms_are_scored_over_their_densest_chunks(self):
+        self.index.upsert_chunks([('e', "freedom of the press", {}), ('f', "press freedom index", {})])
+        # 'freedom' is now in four chunks, over the cap of three: still searchable, three postings read
+        hits = self.index.search("freedom")
+        self.assertEqual(len(hits), 3)
+        self.assertEqual(hits[0][0], 'b')  # the only chunk saying it twice
+        self.assertEqual({chunk_id for chunk_id, _ in self.index.search("freedom press")[:2]}, {'e', 'f'})
+
+    def test_corpus_stats_follow_every_write(self):
+        def recount():
+            conn = self.index._connection()
+            return (conn.execute("SELECT chunks, total_length FROM corpus").fetchone(),
+                    conn.execute("SELECT COUNT(*), SUM(length) FROM chunks").fetchone())
+
+        self.index.upsert_chunks([('a', "Article 19 again", {'source_document': 'x.pdf'}),
+                                  ('e', "new chunk here", {'source_document': 'x.pdf'})])
+        stored, actual = recount()
+        self.assertEqual(stored, actual)
+        self.assertEqual(self.index.count(), 5)
+
+        self.index.delete_chunks(['b', 'missing'])
+        self.assertEqual(self.index.delete_document('x.pdf'), 2)
+        stored, actual = recount()
+        self.assertEqual(stored, actual)
+        self.assertEqual(self.index.count(), 2)
+
+        self.index.clear()
+        self.assertEqual(self.index.count(), 0)
+        self.assertEqual(self.index.search("data"), [])
+
+    def test_index_built_before_the_corpus_table_is_counted_once(self):
+        conn = self.index._connection()
+        with conn:
+            conn.execute("DROP TABLE corpus")
+        reopened = BM25Index(path=self.index.path)
+        self.assertEqual(reopened.count(), 4)
+        self.assertEqual([chunk_id for chunk_id, _ in reopened.search("personal")], ['c'])
+
+    def test_reindex_and_delete(self):
+        self.index.upsert_chunks([('c', "Freedom of information requests", {})])
+        self.assertIn('c', [chunk_id for chunk_id, _ in self.index.search("information")])
+        self.assertEqual(self.index.search("personal"), [])
+        self.index.delete_chunks(['a', 'b', 'c'])
+        self.assertEqual(self.index.count(), 1)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_ids_found_by_both_retrievers_rank_first(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'd', 'a']], k=60)
+        self.assertEqual(fused[:2], ['a', 'c'])
+        self.assertEqual(set(fused), {'a', 'b', 'c', 'd'})
+
+    def test_single_ranking_keeps_its_order(self):
+        self.assertEqual(reciprocal_rank_fusion([['x', 'y', 'z']]), ['x', 'y', 'z'])
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+
+def sentence(tokens):
+    """A sentence of exactly tokens approximate tokens (4 characters each)"""
+    return 'w' * (tokens * 4 - 1) + '.'
+
+
+@mock.patch('core.context_packing.LLM_TOKENIZER', '')
+@mock.patch('core.context_packing.CONTEXT_MIN_TRIM_TOKENS', 24)
+class PackContextTests(SimpleTestCase):
+    def test_chunks_are_packed_best_first_within_budget(self):
+        chunks = ['a' * 400, 'b' * 400, 'c' * 400]  # 100 tokens each
+        packed, stats = pack_context(chunks, budget=250, trim_sentences=False)
+        self.assertEqual(packed, chunks[:2])
+        self.assertEqual(stats['context_tokens'], 200)
+        self.assertEqual(stats['chunks_packed'], 2)
+
+    def test_packing_stops_at_the_first_chunk_that_does_not_fit(self):
+        # The small third chunk would fit but must not displace the better-ranked second one
+        packed, _ = pack_context(['a' * 400, 'b' * 800, 'c' * 40], budget=250, trim_sentences=False)
+        self.assertEqual(packed, ['a' * 400])
+
+    def test_duplicates_are_skipped(self):
+        packed, stats = pack_context(['Article 19  applies.', ' article 19 applies. ', '', 'Other.'], budget=100)
+        self.assertEqual(packed, ['Article 19  applies.', 'Other.'])
+        self.assertEqual(stats['duplicate_chunks_skipped'], 2)
+
+    def test_overflowing_chunk_is_trimmed_at_a_sentence_boundary(self):
+        overflowing = f"{sentence(30)} {sentence(30)} {sentence(30)}"
+        packed, stats = pack_context(['a' * 400, overflowing], budget=170, trim_sentences=True)
+        self.assertEqual(packed, ['a' * 400, f"{sentence(30)} {sentence(30)}"])
+        self.assertEqual(stats['chunks_trimmed'], 1)
+        self.assertLessEqual(stats['context_tokens'], 170)
+
+    def test_trimmed_pieces_below_the_minimum_are_dropped(self):
+        packed, stats = pack_context(['a' * 400, f"{sentence(10)} {sentence(100)}"], budget=150, trim_sentences=True)
+        self.assertEqual(packed, ['a' * 400])
+        self.assertEqual(stats['chunks_trimmed'], 0)
+
+    def test_prompt_numbers_the_packed_chunks(self):
+        prompt, stats = build_prompt("What is Article 19?", ['First.', 'Second.'], budget=100)
+        self.assertIn("[1] First.\n\n[2] Second.", prompt)
+        self.assertIn("Question: What is Article 19?", prompt)
+        self.assertEqual(stats['tokenizer'], 'approx_4_chars')
+
+
+def query_log(text='What is Article 19?'):
+    from core.models import QueryLog
+
+    return QueryLog(query_text=text, language='en', response_text='An answer.',
+                    response_time_ms=120, context_chunks_found=3, metadata={})
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class QueryLogWriterTests(SimpleTestCase):
+    def setUp(self):
+        from core.models import QueryLog
+
+        self.bulk_create = mock.patch.object(QueryLog.objects, 'bulk_create').start()
+        self.record_daily_metrics = mock.patch('core.monitoring.record_daily_metrics').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def writer(self, **options):
+        writer = QueryLogWriter(enabled=True, **options)
+        # Registered after the patches, so it runs (and flushes) before they stop
+        self.addCleanup(writer.close)
+        return writer
+
+    def written_rows(self):
+        return [row for call in self.bulk_create.call_args_list for row in call.args[0]]
+
+    def test_full_batch_is_written_without_waiting_for_the_interval(self):
+        writer = self.writer(batch_size=3, flush_interval_ms=60000)
+        rows = [writer.submit(query_log(f"q{i}")) for i in range(3)]
+        self.assertTrue(all(row.query_uuid for row in rows))
+
+        wait_for(lambda: writer.written == 3)
+        self.bulk_create.assert_called_once_with(rows)
+        self.record_daily_metrics.assert_called_once_with(rows)
+        self.assertFalse(writer.is_pending(rows[0].query_uuid))
+
+    def test_partial_batch_is_written_after_the_interval(self):
+        writer = self.writer(batch_size=100, flush_interval_ms=50)
+        row = writer.submit(query_log())
+        self.assertTrue(writer.is_pending(row.query_uuid))
+
+        wait_for(lambda: writer.written == 1)
+        self.assertEqual(self.written_rows(), [row])
+        self.assertEqual(writer.stats()['queue_depth'], 0)
+
+    def test_failed_write_is_retried_once_then_dropped(self):
+        self.bulk_create.side_effect = RuntimeError("database unavailable")
+        writer = self.writer(batch_size=100, flush_interval_ms=20)
+        rows = [writer.submit(query_log(f"q{i}")) for i in range(2)]
+
+        wait_for(lambda: writer.dropped == 2)
+        self.assertEqual(self.bulk_create.call_count, 2)
+        self.assertEqual([call.args[0] for call in self.bulk_create.call_args_list], [rows, rows])
+        self.assertEqual(writer.failed_flushes, 2)
+        self.assertIn("database unavailable", writer.last_error)
+        self.assertFalse(writer.is_pending(rows[0].query_uuid))
+        self.record_daily_metrics.assert_not_called()
+
+    def test_close_writes_everything_queued(self):
+        writer = self.writer(batch_size=100, flush_interval_ms=60000)
+        rows = [writer.submit(query_log(f"q{i}")) for i in range(5)]
+        writer.close()
+        self.assertEqual(self.written_rows(), rows)
+        # Rows submitted after close are written inline
+        late = writer.submit(query_log("late"))
+        self.assertEqual(self.written_rows()[-1], late)
+
+    def test_rows_keep_the_time_they_were_queued(self):
+        writer = self.writer(batch_size=100, flush_interval_ms=100)
+        row = writer.submit(query_log())
+        queued_at = row.timestamp
+        self.assertIsNotNone(queued_at)
+        wait_for(lambda: writer.written == 1)
+        self.assertEqual(self.written_rows()[0].timestamp, queued_at)
+
+
+class FindQueryLogTests(SimpleTestCase):
+    def setUp(self):
+        from core.models import QueryLog
+
+        self.QueryLog = QueryLog
+        self.get = mock.patch.object(QueryLog.objects, 'get').start()
+        mock.patch.object(query_log_writer, 'enabled', True).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_waits_for_a_row_queued_by_another_worker(self):
+        row = query_log()
+        self.get.side_effect = [self.QueryLog.DoesNotExist(), self.QueryLog.DoesNotExist(), row]
+        self.assertIs(find_query_log(str(row.query_uuid), wait_ms=5000), row)
+        self.assertEqual(self.get.call_count, 3)
+
+    def test_gives_up_after_the_wait(self):
+        self.get.side_effect = self.QueryLog.DoesNotExist()
+        start = time.monotonic()
+        with self.assertRaises(self.QueryLog.DoesNotExist):
+            find_query_log('2b0f8f5e-3d0c-4b8e-9d0e-4f6f1c2a9b11', wait_ms=250)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_invalid_and_integer_ids(self):
+        with self.assertRaises(self.QueryLog.DoesNotExist):
+            find_query_log('not-a-uuid')
+        self.get.assert_not_called()
+        find_query_log('42')
+        self.get.assert_called_once_with(id=42)
+
+
+class CountingCollection:
+    """Collection whose filtered get() waits for `release` and counts its calls"""
+
+    def __init__(self, total=100, matched=25):
+        self.total = total
+        self.matched = matched
+        self.gets = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def count(self):
+        return self.total
+
+    def get(self, where=None, include=()):
+        self.gets += 1
+        self.release.wait(5)
+        return {'ids': [f"chunk_{i}" for i in range(self.matched)]}
+
+
+class SelectivityTrackerTests(SimpleTestCase):
+    def counted(self, tracker, collection, filters):
+        wait_for(lambda: tracker.selectivity(collection, filters) is not None)
+        return tracker.selectivity(collection, filters)
+
+    def test_first_request_does_not_wait_for_the_count(self):
+        tracker = SelectivityTracker(ttl=60)
+        collection = CountingCollection()
+        collection.release.clear()
+
+        start = time.monotonic()
+        self.assertIsNone(tracker.selectivity(collection, {'language': 'fr'}))
+        self.assertIsNone(tracker.selectivity(collection, {'language': 'fr'}))
+        self.assertLess(time.monotonic() - start, 1)
+
+        collection.release.set()
+        self.assertEqual(self.counted(tracker, collection, {'language': 'fr'}), (25, 100, 0.25))
+        # Both requests shared one count
+        self.assertEqual(collection.gets, 1)
+
+    def test_stale_count_is_served_while_it_is_redone(self):
+        tracker = SelectivityTracker(ttl=0.05)
+        collection = CountingCollection()
+        self.counted(tracker, collection, {'category': 'policy'})
+
+        time.sleep(0.1)
+        collection.matched = 50
+        self.assertEqual(tracker.selectivity(collection, {'category': 'policy'}), (25, 100, 0.25))
+        wait_for(lambda: tracker.selectivity(collection, {'category': 'policy'})[0] == 50)
+
+    def test_cache_keeps_the_most_recently_used_combinations(self):
+        tracker = SelectivityTracker(ttl=60, max_entries=2)
+        collection = CountingCollection()
+        for scope in ('Kenya', 'Uganda'):
+            self.counted(tracker, collection, {'geographic_scope': scope})
+        tracker.selectivity(collection, {'geographic_scope': 'Kenya'})  # now the most recent
+        self.counted(tracker, collection, {'geographic_scope': 'Ghana'})
+
+        gets = collection.gets
+        self.assertIsNotNone(tracker.selectivity(collection, {'geographic_scope': 'Kenya'}))
+        self.assertIsNone(tracker.selectivity(collection, {'geographic_scope': 'Uganda'}))
+        self.assertEqual(len(tracker._cache), 2)
+        wait_for(lambda: collection.gets == gets + 1)
+
+    def test_pending_counts_are_capped(self):
+        tracker = SelectivityTracker(ttl=60, max_pending=2)
+        collection = CountingCollection()
+        collection.release.clear()
+        for scope in ('a', 'b', 'c', 'd'):
+            tracker.selectivity(collection, {'geographic_scope': scope})
+        collection.release.set()
+        wait_for(lambda: not tracker._pending)
+        # c and d were not queued; they are counted once a later request finds room
+        self.assertEqual(collection.gets, 2)
+        self.assertEqual(len(tracker._cache), 2)
+
+    def test_failed_count_is_retried_by_a_later_request(self):
+        tracker = SelectivityTracker(ttl=60)
+        collection = CountingCollection()
+        with mock.patch.object(collection, 'get', side_effect=RuntimeError("chroma down")):
+            tracker.selectivity(collection, {'language': 'sw'})
+            wait_for(lambda: not tracker._pending)
+        self.assertEqual(self.counted(tracker, collection, {'language': 'sw'}), (25, 100, 0.25))
+
+
+class WarmUpTests(SimpleTestCase):
+    def test_importing_the_application_does_not_warm_up(self):
+        import importlib
+        import config.asgi
+        import config.wsgi
+
+        with mock.patch('core.warmup.warm_up') as warm_up:
+            importlib.reload(config.wsgi)
+            importlib.reload(config.asgi)
+        warm_up.assert_not_called()
+
+    def test_gunicorn_warms_each_worker_up_after_it_loads_the_app(self):
+        import runpy
+        from django.conf import settings
+
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': tempfile.gettempdir()}):
+            hooks = runpy.run_path(os.path.join(settings.BASE_DIR, 'config', 'gunicorn.conf.py'))
+        with mock.patch('core.warmup.WARMUP_ON_START', True), \
+                mock.patch('core.warmup.warm_up', return_value={'total_ms': 1}) as warm_up:
+            hooks['post_worker_init'](mock.Mock())
+        warm_up.assert_called_once_with()
+
+    def test_failed_warm_up_does_not_stop_the_worker(self):
+        from core.warmup import warm_up_on_start
+
+        with mock.patch('core.warmup.WARMUP_ON_START', True), \
+                mock.patch('core.warmup.warm_up', side_effect=RuntimeError("chroma locked")):
+            self.assertIsNone(warm_up_on_start())
+
+    def run_warm_up(self, remote=False, chunks=3):
+        from core import warmup
+
+        collection = mock.MagicMock()
+        collection.count.return_value = chunks
+        self.addCleanup(setattr, warmup, 'last_warmup', warmup.last_warmup)
+        with mock.patch('core.embedding_utils.embedding_client') as embedding_client, \
+                mock.patch('core.embedding_utils.get_embedding_model') as get_model, \
+                mock.patch('core.chroma_client.get_collection', return_value=collection):
+            embedding_client.remote = remote
+            embedding_client.encode.return_value = np.ones(4, dtype=np.float32)
+            timings = warmup.warm_up()
+        return timings, get_model, embedding_client, collection
+
+    def test_warm_up_loads_the_model_encodes_once_and_queries_the_index(self):
+        from core import warmup
+
+        timings, get_model, embedding_client, collection = self.run_warm_up()
+
+        get_model.assert_called_once_with()
+        embedding_client.encode.assert_called_once_with("warm-up")
+        collection.query.assert_called_once_with(query_embeddings=[[1.0] * 4], n_results=1)
+        self.assertEqual(set(timings), {'model_load_ms', 'first_encode_ms', 'chroma_open_ms',
+                                        'chroma_query_ms', 'total_ms'})
+        self.assertIs(warmup.last_warmup, timings)
+
+    def test_warm_up_with_an_embedding_server_does_not_load_a_local_model(self):
+        _, get_model, embedding_client, _ = self.run_warm_up(remote=True)
+        get_model.assert_not_called()
+        embedding_client.encode.assert_called_once_with("warm-up")
+
+    def test_empty_collection_is_not_queried(self):
+        *_, collection = self.run_warm_up(chunks=0)
+        collection.query.assert_not_called()
+
+    def test_importing_the_urlconf_loads_neither_torch_nor_chromadb(self):
+        from core.warmup import measure_cold_import
+
+        cold = measure_cold_import()
+        self.assertFalse(cold['torch_loaded'])
+        self.assertFalse(cold['chromadb_loaded'])
+
+    def test_off_by_default_with_an_embedding_server(self):
+        import importlib
+        from core import warmup
+
+        self.addCleanup(importlib.reload, warmup)
+        with mock.patch.dict(os.environ, {'EMBEDDING_SERVER_URL': 'http://127.0.0.1:8601'}):
+            os.environ.pop('WARMUP_ON_START', None)
+            self.assertFalse(importlib.reload(warmup).WARMUP_ON_START)
+            os.environ['WARMUP_ON_START'] = '1'
+            self.assertTrue(importlib.reload(warmup).WARMUP_ON_START)
+        with mock.patch.dict(os.environ):
+            os.environ.pop('EMBEDDING_SERVER_URL', None)
+            os.environ.pop('WARMUP_ON_START', None)
+            self.assertTrue(importlib.reload(warmup).WARMUP_ON_START)
+
+
+class IngestionMetricsExportTests(SimpleTestCase):
+    def test_warning_only_without_a_shared_directory(self):
+        from core import metrics
+
+        with mock.patch.object(metrics, 'PROMETHEUS_MULTIPROC_DIR', ''):
+            self.assertIn("PROMETHEUS_MULTIPROC_DIR", metrics.ingestion_export_warning())
+        with mock.patch.object(metrics, 'PROMETHEUS_MULTIPROC_DIR', '/tmp/metrics'):
+            self.assertIsNone(metrics.ingestion_export_warning())
+
+    def test_command_counters_reach_a_web_worker_through_the_shared_directory(self):
+        import subprocess
+        import sys
+        from django.conf import settings
+        from core import metrics
+
+        if not metrics.enabled():
+            self.skipTest("prometheus_client is not installed")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory.name}
+
+        def run(code):
+            return subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env,
+                                  capture_output=True, text=True, check=True).stdout
+
+        # An embed_docs run, then a web worker serving /metrics
+        run("from core import metrics\n"
+            "metrics.record_ingestion({'pages_done': 3, 'chunks_done': 7, 'changed': 5,"
+            " 'extract_s': 1.0, 'encode_s': 2.0, 'store_s': 0.5})\n"
+            "metrics.record_ingested_document('completed')")
+        body = run("from core import metrics\nprint(metrics.exposition()[0].decode())")
+        self.assertIn('rag_ingested_chunks_total{result="encoded"} 5.0', body)
+        self.assertIn('rag_ingested_documents_total{status="completed"} 1.0', body)
+
+
+def queue_jobs(*names):
+    """One queued IngestionJob per file name, oldest first"""
+    from datetime import timedelta
+    from django.utils import timezone
+    from core.models import IngestionJob, UploadedDocument
+
+    start = timezone.now() - timedelta(minutes=len(names))
+    jobs = []
+    for offset, name in enumerate(names):
+        document = UploadedDocument.objects.create(file=f'documents/{name}', language='en',
+                                                   category='data_protection')
+        job = IngestionJob.objects.create(document=document)
+        IngestionJob.objects.filter(id=job.id).update(created_at=start + timedelta(minutes=offset))
+        jobs.append(job)
+    return jobs
+
+
+class IngestionQueueTests(TestCase):
+    def test_claims_the_oldest_queued_job(self):
+        from core.ingestion import claim_next_job
+
+        older, newer = queue_jobs('a.pdf', 'b.pdf')
+
+        job = claim_next_job('host:1:0')
+        self.assertEqual(job.id, older.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('running', 'host:1:0'))
+        self.assertIsNotNone(job.started_at)
+
+        self.assertEqual(claim_next_job('host:1:1').id, newer.id)
+        self.assertIsNone(claim_next_job('host:1:0'))
+
+    def test_running_jobs_of_a_crashed_worker_are_requeued(self):
+        from core.ingestion import claim_next_job, requeue_running_jobs
+        from core.models import IngestionJob
+
+        job, = queue_jobs('a.pdf')
+        claim_next_job('host:1:0')
+        IngestionJob.objects.filter(id=job.id).update(chunks_done=40)
+
+        self.assertEqual(requeue_running_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.started_at, job.chunks_done), ('queued', '', None, 0))
+        self.assertEqual(claim_next_job('host:2:0').id, job.id)
+
+    def test_completed_job_records_progress_and_marks_the_document_processed(self):
+        from core.ingestion import claim_next_job, run_job
+
+        def embed(file_name, language, progress_callback, document_metadata):
+            self.assertEqual((file_name, language), ('a.pdf', 'en'))
+            self.assertEqual(document_metadata['category'], 'data_protection')
+            progress_callback({'chunks_done': 12, 'total_chunks': 12, 'encode_s': 0.25,
+                               'pages_done': 3, 'total_pages': 3})
+            return "✅ Stored 12 chunks from a.pdf"
+
+        queue_jobs('a.pdf')
+        with mock.patch('core.embedding_utils.embed_and_store', side_effect=embed):
+            job = run_job(claim_next_job('host:1:0'))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.chunks_done, job.total_chunks), ('completed', 12, 12))
+        self.assertEqual(job.get_progress_percent(), 100)
+        self.assertEqual(job.stage_timings['encode_ms'], 250)
+        self.assertIn('total_ms', job.stage_timings)
+        self.assertIsNotNone(job.finished_at)
+        job.document.refresh_from_db()
+        self.assertTrue(job.document.is_processed)
+        self.assertEqual(job.document.processing_notes, "✅ Stored 12 chunks from a.pdf")
+
+    def test_failed_job_keeps_the_document_unprocessed(self):
+        from core.ingestion import claim_next_job, run_job
+
+        queue_jobs('a.pdf')
+        with mock.patch('core.embedding_utils.embed_and_store', side_effect=OSError("disk full")):
+            job = run_job(claim_next_job('host:1:0'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.error.startswith("disk full"))
+        job.document.refresh_from_db()
+        self.assertFalse(job.document.is_processed)
+        self.assertEqual(job.document.processing_notes, f"Embedding failed (job #{job.id}): disk full")
+
+    def test_status_endpoint_reports_the_job(self):
+        from django.urls import reverse
+
+        job, = queue_jobs('a.pdf')
+
+        response = self.client.get(reverse('ingestion_job_status', args=[job.id]))
+        self.assertEqual(response.json()['job']['status'], 'queued')
+        self.assertEqual(self.client.get(reverse('ingestion_job_status', args=[job.id + 1])).status_code, 404)
+
+
+class IngestionClaimConcurrencyTests(TransactionTestCase):
+    def test_a_job_locked_by_one_worker_is_skipped_by_another(self):
+        from django.db import connection, transaction
+        from core.ingestion import claim_next_job
+        from core.models import IngestionJob
+
+        if not connection.features.has_select_for_update_skip_locked:
+            self.skipTest("the database has no SELECT ... FOR UPDATE SKIP LOCKED")
+        locked, free = queue_jobs('a.pdf', 'b.pdf')
+        claimed = []
+
+        def other_worker():
+            from django.db import connection
+            try:
+                claimed.append(claim_next_job('host:2:0'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            IngestionJob.objects.select_for_update().get(id=locked.id)
+            worker = threading.Thread(target=other_worker)
+            worker.start()
+            worker.join(timeout=10)
+            self.assertFalse(worker.is_alive(), "claim blocked on the locked row")
+
+        self.assertEqual(claimed[0].id, free.id)
+        locked.refresh_from_db()
+        self.assertEqual(locked.status, 'queued')
+
+
+@skipUnless(connection.vendor == 'postgresql', "queries_by_language is incremented with jsonb_set")
+class DailyMetricsTests(TestCase):
+    """Running totals in SystemPerformanceMetrics against a rebuild from QueryLog"""
+
+    def log(self, language='en', response_time_ms=100, chunks=4, relevance=None, failed=False, **fields):
+        from datetime import datetime, timezone as dt_timezone
+        from core.models import QueryLog
+
+        return QueryLog.objects.create(
+            query_text="q", response_text="a", language=language,
+            timestamp=datetime(2026, 3, 2, 12, tzinfo=dt_timezone.utc),
+            response_time_ms=response_time_ms, context_chunks_found=chunks,
+            avg_relevance_score=relevance, metadata={'failed': True} if failed else {}, **fields
+        )
+
+    def day(self):
+        from datetime import date
+        from core.models import SystemPerformanceMetrics
+        return SystemPerformanceMetrics.objects.get(date=date(2026, 3, 2))
+
+    def test_batches_add_to_the_days_totals(self):
+        from core.monitoring import record_daily_metrics
+
+        record_daily_metrics([self.log(response_time_ms=100, relevance=0.5),
+                              self.log('fr', response_time_ms=300, chunks=2, failed=True)])
+        record_daily_metrics([self.log(response_time_ms=200, chunks=0, relevance=0.9)])
+
+        day = self.day()
+        self.assertEqual((day.total_queries, day.successful_queries, day.failed_queries), (3, 2, 1))
+        self.assertEqual(day.queries_by_language, {'en': 2, 'fr': 1})
+        self.assertEqual(day.response_time_sum_ms, 600)
+        self.assertAlmostEqual(day.avg_response_time_ms, 200.0)
+        self.assertAlmostEqual(day.avg_context_chunks, 2.0)
+        # Queries without a relevance score don't dilute the average
+        self.assertEqual(day.relevance_score_count, 2)
+        self.assertAlmostEqual(day.avg_relevance_score, 0.7)
+
+    def test_changed_rating_replaces_the_old_one(self):
+        from core.monitoring import PerformanceMonitor, record_daily_metrics
+
+        first, second = self.log(), self.log()
+        record_daily_metrics([first, second])
+        for query_log, rating in ((first, 4), (second, 2)):
+            query_log.user_rating = rating
+            PerformanceMonitor.record_feedback(query_log, None, None)
+        second.user_rating = 5
+        PerformanceMonitor.record_feedback(second, 2, None)
+
+        day = self.day()
+        self.assertEqual((day.user_rating_sum, day.user_rating_count), (9, 2))
+        self.assertAlmostEqual(day.avg_user_rating, 4.5)
+        self.assertIsNone(day.avg_response_relevance)
+
+    def test_rebuild_matches_the_running_totals(self):
+        from core.models import SystemPerformanceMetrics
+        from core.monitoring import PerformanceMonitor, record_daily_metrics
+
+        logs = [self.log(response_time_ms=120, relevance=0.4), self.log('sw', response_time_ms=80),
+                self.log(failed=True, relevance=0.8, user_rating=3)]
+        record_daily_metrics(logs)
+        PerformanceMonitor.record_feedback(logs[2], None, None)
+        running = self.day()
+
+        SystemPerformanceMetrics.objects.filter(pk=running.pk).update(
+            total_queries=0, response_time_sum_ms=0, avg_response_time_ms=None, queries_by_language={}
+        )
+        rebuilt = PerformanceMonitor.rebuild_daily_metrics(running.date)
+
+        for field in ('total_queries', 'successful_queries', 'failed_queries', 'queries_by_language',
+                      'response_time_sum_ms', 'context_chunks_sum', 'relevance_score_count',
+                      'user_rating_sum', 'user_rating_count'):
+            self.assertEqual(getattr(rebuilt, field), getattr(running, field), field)
+        for field in ('avg_response_time_ms', 'avg_context_chunks', 'avg_relevance_score', 'avg_user_rating'):
+            self.assertAlmostEqual(getattr(rebuilt, field), getattr(running, field), msg=field)
+
+    def test_rebuilding_a_day_without_queries_is_a_no_op(self):
+        from datetime import date
+        from core.models import SystemPerformanceMetrics
+        from core.monitoring import PerformanceMonitor
+
+        self.assertIsNone(PerformanceMonitor.rebuild_daily_metrics(date(2026, 3, 3)))
+        self.assertFalse(SystemPerformanceMetrics.objects.exists())
+
+
+class PercentileFromCountsTests(SimpleTestCase):
+    BUCKETS = (10, 100, 1000)
+
+    def test_estimates(self):
+        from core.histogram import percentile_from_counts
+
+        cases = [
+            # counts per bucket (<=10, <=100, <=1000, overflow), q, expected
+            ([0, 4, 0, 0], 0.5, 55.0),    # halfway through the 10-100 bucket
+            ([2, 2, 0, 0], 0.5, 10.0),    # the rank ends exactly on a bucket edge
+            ([1, 0, 0, 0], 0.99, 9.9),    # the first bucket starts at 0
+            ([0, 0, 1, 3], 0.9, 1000.0),  # overflow reports its lower edge
+            ([0, 0, 0, 0], 0.5, 0.0),
+        ]
+        for counts, q, expected in cases:
+            with self.subTest(counts=counts, q=q):
+                self.assertAlmostEqual(percentile_from_counts(self.BUCKETS, counts, sum(counts), q), expected)
+
+    def test_bucket_edges_belong_to_the_lower_bucket(self):
+        from core.histogram import LATENCY_MS_BUCKETS
+        from core.latency_histograms import bucket_index
+
+        self.assertEqual(LATENCY_MS_BUCKETS[bucket_index(100)], 100)
+        self.assertEqual(LATENCY_MS_BUCKETS[bucket_index(101)], 200)
+        self.assertEqual(bucket_index(10 ** 6), len(LATENCY_MS_BUCKETS))
+
+
+class LatencyHistogramRollupTests(TestCase):
+    def query(self, when, **stage_ms):
+        from core.models import QueryLog
+
+        fields = {'response_time_ms': 150, **stage_ms}
+        return QueryLog.objects.create(query_text="q", response_text="a", language='en', timestamp=when,
+                                       context_chunks_found=3, **fields)
+
+    def counts(self, stage, day=None):
+        from django.utils import timezone
+        from core.models import LatencyHistogramBucket
+
+        rows = LatencyHistogramBucket.objects.filter(stage=stage, date=day or timezone.localdate())
+        return dict(rows.values_list('bucket', 'count'))
+
+    def test_batches_increment_the_same_buckets(self):
+        from django.utils import timezone
+        from core.latency_histograms import bucket_index, record_latency_histograms
+
+        now = timezone.now()
+        record_latency_histograms([self.query(now), self.query(now, llm_time_ms=900)])
+        record_latency_histograms([self.query(now, response_time_ms=40, llm_time_ms=800)])
+
+        self.assertEqual(self.counts('response'), {bucket_index(150): 2, bucket_index(40): 1})
+        self.assertEqual(self.counts('llm'), {bucket_index(900): 2})
+        # Stages a query didn't go through are not counted
+        self.assertEqual(self.counts('first_token'), {})
+
+    def test_rebuild_replaces_the_day_from_query_logs(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from core.latency_histograms import bucket_index, rebuild_latency_histograms, record_latency_histograms
+
+        now = timezone.now()
+        kept = self.query(now)
+        record_latency_histograms([kept, kept, kept])
+        record_latency_histograms([self.query(now - timedelta(days=1))])
+
+        rebuild_latency_histograms(timezone.localdate(now))
+
+        self.assertEqual(self.counts('response'), {bucket_index(150): 1})
+        # Other days are left alone
+        yesterday = timezone.localdate(now) - timedelta(days=1)
+        self.assertEqual(self.counts('response', yesterday), {bucket_index(150): 1})
+
+    def test_percentiles_over_a_window_of_days(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from core.latency_histograms import percentile_trend, record_latency_histograms, stage_percentiles
+
+        now = timezone.now()
+        today = [self.query(now, response_time_ms=ms) for ms in (30, 30, 30, 3000)]
+        last_week = [self.query(now - timedelta(days=5), response_time_ms=ms) for ms in (300, 300)]
+        record_latency_histograms(today + last_week)
+
+        one_day = stage_percentiles(days=1)['response']
+        self.assertEqual(one_day['count'], 4)
+        self.assertLessEqual(one_day['p50'], 50)
+        self.assertGreater(one_day['p99'], 2000)
+        self.assertEqual(stage_percentiles(days=7)['response']['count'], 6)
+        self.assertEqual(stage_percentiles(days=1)['search'], {'count': 0, 'p50': None, 'p90': None,
+                                                               'p95': None, 'p99': None})
+
+        trend = percentile_trend('response', days=7)
+        self.assertEqual(len(trend), 7)
+        self.assertEqual([day['count'] for day in trend], [0, 2, 0, 0, 0, 0, 4])
+        self.assertEqual(trend[-1]['date'], timezone.localdate(now).strftime('%Y-%m-%d'))
+
+
+class RequestTraceTests(SimpleTestCase):
+    """PerformanceMonitor spans and the QueryLog stage columns derived from them"""
+
+    def setUp(self):
+        from core.monitoring import PerformanceMonitor
+        self.monitor = PerformanceMonitor().start_monitoring()
+
+    def fields(self):
+        return self.monitor._query_log_fields("q", 'en', "a", [], [])
+
+    def test_spans_nest_under_the_innermost_open_span(self):
+        with self.monitor.span('retrieval'):
+            with self.monitor.span('embedding'):
+                pass
+            with self.monitor.span('search', shard='en'):
+                pass
+        with self.assertRaises(ValueError):
+            with self.monitor.span('llm'):
+                raise ValueError("model down")
+        with self.monitor.span('packing'):
+            pass
+
+        trace = self.fields()['metadata']['trace']
+        self.assertEqual([child['name'] for child in trace['children']], ['retrieval', 'llm', 'packing'])
+        retrieval = trace['children'][0]
+        self.assertEqual([child['name'] for child in retrieval['children']], ['embedding', 'search'])
+        self.assertEqual(retrieval['children'][1]['attrs'], {'shard': 'en'})
+        self.assertLessEqual(retrieval['start_ms'], retrieval['children'][0]['start_ms'])
+
+    def test_stage_columns_are_span_durations(self):
+        start = self.monitor.trace.start
+        self.monitor.trace.add_child('embedding', start + 0.010, start + 0.030)
+        self.monitor.trace.add_child('search', start + 0.030, start + 0.045)
+        # A retried stage counts every attempt
+        self.monitor.trace.add_child('search', start + 0.050, start + 0.055)
+
+        fields = self.fields()
+        # Durations are truncated to whole milliseconds
+        self.assertAlmostEqual(fields['embedding_time_ms'], 20, delta=1)
+        self.assertAlmostEqual(fields['search_time_ms'], 20, delta=1)
+        self.assertIsNone(fields['llm_time_ms'])
+        self.assertIsNone(fields['llm_queue_wait_ms'])
+
+    def test_llm_time_excludes_the_wait_for_a_slot(self):
+        start = self.monitor.trace.start
+        llm = self.monitor.trace.add_child('llm', start + 0.1, start + 0.9)
+        llm.add_phases([('queue_wait', start + 0.35), ('generation', start + 0.9)])
+
+        fields = self.fields()
+        self.assertAlmostEqual(fields['llm_queue_wait_ms'], 250, delta=1)
+        self.assertAlmostEqual(fields['llm_time_ms'], 550, delta=1)
+
+    def test_llm_client_phase_marks_become_child_spans(self):
+        from core.gpt_client import mark_phase
+
+        stats = {}
+        with self.monitor.span('llm', phases=stats):
+            mark_phase(stats, 'queue_wait')
+            mark_phase(stats, 'generation')
+
+        llm, = self.monitor.trace.find('llm')
+        self.assertEqual([child.name for child in llm.children], ['queue_wait', 'generation'])
+        queue_wait, generation = llm.children
+        self.assertEqual((queue_wait.start, generation.start), (llm.start, queue_wait.end))
+        self.assertLessEqual(generation.end, llm.end)
+
+    def test_spans_outside_a_monitored_request_are_not_recorded(self):
+        from core.monitoring import PerformanceMonitor
+
+        monitor = PerformanceMonitor()
+        with monitor.span('embedding') as span:
+            pass
+        self.assertIsNotNone(span.end)
+        self.assertIsNone(monitor.stage_ms('embedding'))
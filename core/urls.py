@@ -6,12 +6,15 @@ from core.views_simple import (
     dashboard_main_view, chat_view, documents_view, settings_view
 )
 from core.views import (
-    ask_view, upload_and_embed_view, monitoring_dashboard, rate_response, 
-    system_stats, list_documents, delete_document, re_embed_document, document_stats, update_document
+    ask_view, ask_stream_view, ask_async_view, upload_and_embed_view, monitoring_dashboard, rate_response, 
+    system_stats, list_documents, delete_document, re_embed_document, document_stats, update_document,
+    ingestion_job_status
 )
 
 urlpatterns = [
     path('ask/', ask_view, name='ask'),
+    path('ask/stream/', ask_stream_view, name='ask_stream'),
+    path('ask/async/', ask_async_view, name='ask_async'),
     path('embed/', upload_and_embed_view, name='embed'),
     
     # Main dashboard route
@@ -32,6 +35,7 @@ urlpatterns = [
     path('api/documents/<int:doc_id>/update/', update_document, name='update_document'),
     path('api/documents/<int:doc_id>/re-embed/', re_embed_document, name='re_embed_document'),
     path('api/documents/stats/', document_stats, name='document_stats'),
+    path('api/ingestion/jobs/<int:job_id>/', ingestion_job_status, name='ingestion_job_status'),
     
     # New Real Data API Endpoints
     path('api/monitoring/stats/', monitoring_stats, name='monitoring_stats_real'),
@@ -2,21 +2,227 @@ from django.shortcuts import render
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from core.serializers import PromptSerializer
-from core.gpt_client import ask_mistral
+from core.gpt_client import (
+    ask_mistral, aask_mistral, stream_mistral, describe_llm_error, garbled_fallback,
+    is_garbled_response, DEFAULT_TIMEOUT, LLMOverloadedError
+)
 from rest_framework import status
-from .serializers import UploadedDocumentSerializer
+from .serializers import UploadedDocumentSerializer, IngestionJobSerializer
 from rest_framework.decorators import parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser
-from core.embedding_utils import embed_and_store, EMBEDDING_MODEL, collection
+from core.embedding_utils import collection, encode_query, refresh_document_metadata
 from core.monitoring import PerformanceMonitor, PerformanceAnalyzer
-from core.models import QueryLog, SystemPerformanceMetrics, UserAction
+from core.query_log_writer import find_query_log
+from core.latency_histograms import stage_percentiles
+from core.models import QueryLog, SystemPerformanceMetrics, UserAction, IngestionJob
+from core.ingestion import enqueue_ingestion
+from core.answer_cache import answer_cache, chunk_fingerprints
+from core.coalescing import ask_flights, ask_flight_key
+from core.search_filters import build_where, filters_from_request, filter_selectivity, document_chunk_metadata
+from core.lexical_index import lexical_index
+from core.hybrid_search import RETRIEVAL_MODE, RETRIEVAL_TOP_K, HYBRID_CANDIDATES, reciprocal_rank_fusion, squared_l2
+from core.context_packing import build_prompt
+from core import metrics
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 import time
 import os
-from .embedding_utils import EMBEDDING_MODEL, collection
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+def retrieve_context(user_prompt, monitor, filters=None, mode=None):
+    """
+    Embed the query and fetch the most relevant chunks, restricted to
+    chunks whose metadata matches filters (language, category,
+    document_type, geographic_scope) when any are given.
+
+    mode is 'vector' (ChromaDB), 'lexical' (BM25 index) or 'hybrid'
+    (both, merged with reciprocal rank fusion); RETRIEVAL_MODE by default.
+    """
+    mode = mode or RETRIEVAL_MODE
+    # More candidates than fit the prompt; build_llm_prompt packs the best within the token budget
+    top_k = RETRIEVAL_TOP_K
+
+    # Step 1: Embed user query (cached for repeated prompts)
+    with monitor.span('embedding'):
+        query_embedding = encode_query(user_prompt)
+
+    # Step 2: Search ChromaDB and/or the BM25 index, filtering inside each search
+    where = build_where(filters)
+    rows = {}
+    vector_ids = []
+    lexical_ids = []
+    search_ms = None
+    lexical_ms = None
+
+    with monitor.span('search', mode=mode):
+        if mode in ('vector', 'hybrid'):
+            with monitor.span('vector_search') as vector_span:
+                results = collection.query(
+                    query_embeddings=[query_embedding.tolist()],
+                    n_results=top_k if mode == 'vector' else HYBRID_CANDIDATES,
+                    where=where,
+                    include=["documents", "metadatas", "distances"]  # Added distances for relevance scoring
+                )
+            search_ms = vector_span.duration_ms
+            vector_ids = results.get('ids', [[]])[0]
+            for i, chunk_id in enumerate(vector_ids):
+                rows[chunk_id] = (
+                    results['documents'][0][i], results['metadatas'][0][i], results['distances'][0][i]
+                )
+
+        if mode in ('lexical', 'hybrid'):
+            with monitor.span('lexical_search') as lexical_span:
+                hits = lexical_index.search(
+                    user_prompt, limit=top_k if mode == 'lexical' else HYBRID_CANDIDATES, filters=filters
+                )
+            lexical_ms = lexical_span.duration_ms
+            lexical_ids = [chunk_id for chunk_id, _ in hits]
+
+        if mode == 'vector':
+            ids = vector_ids[:top_k]
+        elif mode == 'lexical':
+            ids = lexical_ids[:top_k]
+        else:
+            ids = reciprocal_rank_fusion([vector_ids, lexical_ids])[:top_k]
+
+        # Lexical-only hits still need their text, metadata and a vector distance
+        missing = [chunk_id for chunk_id in ids if chunk_id not in rows]
+        if missing:
+            with monitor.span('fetch_chunks', chunks=len(missing)):
+                fetched = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            if fetched['ids']:
+                distances = squared_l2(query_embedding, fetched['embeddings'])
+                for i, chunk_id in enumerate(fetched['ids']):
+                    rows[chunk_id] = (fetched['documents'][i], fetched['metadatas'][i], distances[i])
+            # Chunks still in the lexical index but gone from ChromaDB are skipped
+            ids = [chunk_id for chunk_id in ids if chunk_id in rows]
+
+    # Extract relevant chunks
+    return {
+        'query_embedding': query_embedding,
+        'chunks': [rows[chunk_id][0] for chunk_id in ids],
+        'metadatas': [rows[chunk_id][1] for chunk_id in ids],
+        'distances': [rows[chunk_id][2] for chunk_id in ids],
+        'ids': ids,
+        'filters': filters or {},
+        'retrieval_mode': mode,
+        'search_ms': search_ms,
+        'lexical_ms': lexical_ms,
+        'lexical_hits': len(lexical_ids),
+        'selectivity': filter_selectivity.selectivity(collection, filters) if where else None,
+    }
+
+def search_log_metadata(context):
+    """Filters, their selectivity and the vector and BM25 search latencies, for QueryLog.metadata"""
+    selectivity = context['selectivity']
+    return {
+        'search_filters': context['filters'],
+        'retrieval_mode': context['retrieval_mode'],
+        'search_latency_ms': round(context['search_ms'], 1) if context['search_ms'] is not None else None,
+        'lexical_latency_ms': round(context['lexical_ms'], 1) if context['lexical_ms'] is not None else None,
+        'lexical_hits': context['lexical_hits'],
+        'filter_matched_chunks': selectivity[0] if selectivity else None,
+        'filter_total_chunks': selectivity[1] if selectivity else None,
+        'filter_selectivity': round(selectivity[2], 4) if selectivity else None,
+    }
+
+def build_llm_prompt(user_prompt, relevant_chunks, monitor):
+    """Prompt packing as many top-ranked chunks as fit CONTEXT_TOKEN_BUDGET; returns (prompt, packing stats)"""
+    with monitor.span('prompt'):
+        prompt, packing = build_prompt(user_prompt, relevant_chunks)
+    monitor.record_prompt_tokens(packing['prompt_tokens'])
+    return prompt, packing
+
+def relevance_from_distances(distances):
+    """Calculate relevance scores for response"""
+    relevance_scores = []
+    for distance in distances or []:
+        if distance <= 2:  # Likely cosine distance
+            relevance = max(0, 1 - (distance / 2))
+        else:  # Likely euclidean distance
+            relevance = 1 / (1 + distance)
+        relevance_scores.append(relevance)
+    return relevance_scores
+
+def run_ask_pipeline(user_prompt, language, monitor, filters=None, mode=None):
+    """Retrieve context and produce an answer (from the answer cache or the LLM)"""
+    # Steps 1-2: Embed user query and search ChromaDB for relevant chunks
+    context = retrieve_context(user_prompt, monitor, filters, mode)
+
+    # Step 3: Pack the top-ranked chunks into the prompt up to the token budget
+    full_prompt, packing = build_llm_prompt(user_prompt, context['chunks'], monitor)
+
+    # Step 4: Reuse a cached answer for a near-identical query over the same chunks,
+    # otherwise send to LLM (e.g., Mistral)
+    fingerprints = chunk_fingerprints(context['ids'], context['metadatas'])
+    with monitor.span('answer_cache'):
+        cached_answer = answer_cache.lookup(context['query_embedding'], language, fingerprints)
+    if cached_answer:
+        answer = cached_answer.answer
+    else:
+        llm_stats = {}
+        with monitor.span('llm', phases=llm_stats):
+            answer = ask_mistral(full_prompt, language, stats=llm_stats)
+        # Don't cache timeouts, connection errors or garbled-output fallbacks
+        if not llm_stats.get('fallback'):
+            answer_cache.store(user_prompt, context['query_embedding'], language, fingerprints, answer)
+
+    return {'context': context, 'answer': answer, 'cached_answer': cached_answer, 'packing': packing}
+
+async def arun_ask_pipeline(user_prompt, language, monitor, filters=None, mode=None):
+    """Async counterpart of run_ask_pipeline"""
+    loop = asyncio.get_running_loop()
+    context = await loop.run_in_executor(retrieval_executor, retrieve_context, user_prompt, monitor, filters, mode)
+    full_prompt, packing = build_llm_prompt(user_prompt, context['chunks'], monitor)
+
+    fingerprints = chunk_fingerprints(context['ids'], context['metadatas'])
+    with monitor.span('answer_cache'):
+        cached_answer = answer_cache.lookup(context['query_embedding'], language, fingerprints)
+    if cached_answer:
+        answer = cached_answer.answer
+    else:
+        llm_stats = {}
+        with monitor.span('llm', phases=llm_stats):
+            answer = await aask_mistral(full_prompt, language, stats=llm_stats)
+        if not llm_stats.get('fallback'):
+            answer_cache.store(user_prompt, context['query_embedding'], language, fingerprints, answer)
+
+    return {'context': context, 'answer': answer, 'cached_answer': cached_answer, 'packing': packing}
+
+def pipeline_log_metadata(language, result, coalesced, followers):
+    cached_answer = result['cached_answer']
+    return {
+        'system_prompt_language': language,
+        'context_chunks_used': result['packing']['chunks_packed'],
+        **result['packing'],
+        'cache_hit': cached_answer is not None,
+        'cache_similarity': cached_answer.similarity if cached_answer else None,
+        # Followers share the leader's pipeline run, so their stage timings are left empty
+        'coalesced': coalesced,
+        'coalesced_followers': followers if not coalesced else None,
+        **search_log_metadata(result['context'])
+    }
+
+def pipeline_response_data(user_prompt, language, result, query_log_entry, coalesced):
+    context = result['context']
+    return {
+        "response": result['answer'],
+        "context_used": context['chunks'],
+        "metadatas": context['metadatas'],
+        "relevance_scores": relevance_from_distances(context['distances']),
+        "query": user_prompt,
+        "language": language,
+        "query_id": str(query_log_entry.query_uuid) if query_log_entry else None,  # Add query ID for feedback
+        "cache_hit": result['cached_answer'] is not None,
+        "coalesced": coalesced,
+        "filters": context['filters'],
+        "retrieval_mode": context['retrieval_mode']
+    }
 
 @api_view(["POST"])
 def ask_view(request):
@@ -27,84 +233,45 @@ def ask_view(request):
     if serializer.is_valid():
         user_prompt = serializer.validated_data['prompt']
         language = serializer.validated_data['language']
+        filters = filters_from_request(serializer.validated_data)
+        mode = serializer.validated_data.get('retrieval_mode')
 
         try:
-            # Step 1: Embed user query
-            embed_start = time.time()
-            query_embedding = EMBEDDING_MODEL.encode(user_prompt)
-            monitor.record_embedding_time()
-
-            # Step 2: Search ChromaDB for relevant chunks
-            search_start = time.time()
-            results = collection.query(
-                query_embeddings=[query_embedding.tolist()],
-                n_results=3,  # Reduced from 5 to 3 for TinyLlama
-                include=["documents", "metadatas", "distances"]  # Added distances for relevance scoring
+            # Identical concurrent questions share one pipeline run
+            result, coalesced, followers = ask_flights.do(
+                ask_flight_key(user_prompt, language, filters, mode),
+                lambda: run_ask_pipeline(user_prompt, language, monitor, filters, mode)
             )
-            monitor.record_search_time()
-
-            # Extract relevant chunks
-            relevant_chunks = results.get('documents', [[]])[0]
-            metadata_chunks = results.get('metadatas', [[]])[0]
-            distances = results.get('distances', [[]])[0]
-
-            # Step 3: Simplified system prompt for TinyLlama
-            system_prompt = {
-                'en': "You are an AI assistant. Answer the question about digital rights in Africa using the provided context. Be clear and concise.",
-                'fr': "Vous êtes un assistant IA. Répondez à la question sur les droits numériques en Afrique en utilisant le contexte fourni.",
-                'sw': "Wewe ni msaidizi wa AI. Jibu swali kuhusu haki za kidijitali Afrika kwa kutumia muktadha uliopiewa.",
-                'am': "አንተ የAI ረዳት ነህ። የተሰጠውን አውድ በመጠቀም ስለ አፍሪካ ዲጂታል መብቶች ጥያቄውን መልስ።"
-            }.get(language, 'Answer about digital rights in Africa using the context.')
-
-            # Step 4: Construct ultra-simplified prompt for TinyLlama
-            if relevant_chunks:
-                # Use only the first chunk and severely truncate it
-                best_chunk = relevant_chunks[0]
-                # Take only the first 150 characters to avoid overloading TinyLlama
-                truncated_chunk = best_chunk[:150].strip()
-                
-                # Ultra-simple prompt structure
-                full_prompt = f"Context: {truncated_chunk}\n\nQuestion: {user_prompt}\n\nBrief answer:"
-            else:
-                full_prompt = f"Question: {user_prompt}\n\nBrief answer about digital rights in Africa:"
-
-            # Step 5: Send to LLM (e.g., Mistral)
-            llm_start = time.time()
-            answer = ask_mistral(full_prompt, language)
-            monitor.record_llm_time()
-
-            # Calculate relevance scores for response
-            relevance_scores = []
-            if distances:
-                for distance in distances:
-                    if distance <= 2:  # Likely cosine distance
-                        relevance = max(0, 1 - (distance / 2))
-                    else:  # Likely euclidean distance
-                        relevance = 1 / (1 + distance)
-                    relevance_scores.append(relevance)
-
-            # Log the interaction for monitoring
+            context = result['context']
+
+            # Log the interaction for monitoring (one row per request, even when coalesced)
             query_log_entry = monitor.log_query(
                 query_text=user_prompt,
                 language=language,
-                response_text=answer,
-                context_chunks=relevant_chunks,
-                relevance_scores=relevance_scores,
-                metadata={
-                    'system_prompt_language': language,
-                    'context_chunks_used': len(relevant_chunks)
-                }
+                response_text=result['answer'],
+                context_chunks=context['chunks'],
+                relevance_scores=relevance_from_distances(context['distances']),
+                metadata=pipeline_log_metadata(language, result, coalesced, followers)
             )
 
+            return Response(pipeline_response_data(user_prompt, language, result, query_log_entry, coalesced))
+
+        except LLMOverloadedError as e:
+            # Fail fast instead of queueing behind a saturated model server
+            monitor.log_query(
+                query_text=user_prompt,
+                language=language,
+                response_text=f"Error: {str(e)}",
+                context_chunks=[],
+                relevance_scores=[],
+                metadata={'error': str(e), 'failed': True, 'overloaded': True}
+            )
+            
             return Response({
-                "response": answer,
-                "context_used": relevant_chunks,
-                "metadatas": metadata_chunks,
-                "relevance_scores": relevance_scores,
+                "error": "The AI model is busy right now. Please try again in a moment.",
                 "query": user_prompt,
-                "language": language,
-                "query_id": query_log_entry.id if query_log_entry else None  # Add query ID for feedback
-            })
+                "language": language
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         except Exception as e:
             # Log failed query
@@ -125,9 +292,216 @@ def ask_view(request):
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-   
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
+@api_view(["POST"])
+def ask_stream_view(request):
+    """
+    Streaming variant of ask_view: forwards LLM tokens to the browser as
+    server-sent events while they are generated.
 
+    Events: 'context' (retrieved chunks), 'token' (text delta), 'error',
+    and a final 'done' carrying the full answer and query_id.
+    """
+    monitor = PerformanceMonitor().start_monitoring()
+
+    serializer = PromptSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    user_prompt = serializer.validated_data['prompt']
+    language = serializer.validated_data['language']
+    filters = filters_from_request(serializer.validated_data)
+    mode = serializer.validated_data.get('retrieval_mode')
+
+    try:
+        context = retrieve_context(user_prompt, monitor, filters, mode)
+    except Exception as e:
+        monitor.log_query(
+            query_text=user_prompt,
+            language=language,
+            response_text=f"Error: {str(e)}",
+            context_chunks=[],
+            relevance_scores=[],
+            metadata={'error': str(e), 'failed': True, 'streamed': True}
+        )
+        return Response({
+            "error": f"An error occurred while processing your request: {str(e)}",
+            "query": user_prompt,
+            "language": language
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    relevant_chunks = context['chunks']
+    relevance_scores = relevance_from_distances(context['distances'])
+    full_prompt, packing = build_llm_prompt(user_prompt, relevant_chunks, monitor)
+    fingerprints = chunk_fingerprints(context['ids'], context['metadatas'])
+    with monitor.span('answer_cache'):
+        cached_answer = answer_cache.lookup(context['query_embedding'], language, fingerprints)
+
+    def log_stream(answer, error=None, aborted=False):
+        return monitor.log_query(
+            query_text=user_prompt,
+            language=language,
+            response_text=answer,
+            context_chunks=relevant_chunks,
+            relevance_scores=relevance_scores,
+            metadata={
+                'system_prompt_language': language,
+                'context_chunks_used': packing['chunks_packed'],
+                **packing,
+                'cache_hit': cached_answer is not None,
+                'cache_similarity': cached_answer.similarity if cached_answer else None,
+                'streamed': True,
+                **search_log_metadata(context),
+                **({'error': error, 'failed': True} if error else {}),
+                **({'aborted': True} if aborted else {})
+            }
+        )
+
+    def event_stream():
+        parts = []
+        logged = False
+        try:
+            yield _sse_event('context', {
+                "context_used": relevant_chunks,
+                "metadatas": context['metadatas'],
+                "relevance_scores": relevance_scores,
+                "filters": context['filters'],
+                "retrieval_mode": context['retrieval_mode'],
+            })
+
+            error = None
+            if cached_answer:
+                answer = cached_answer.answer
+                monitor.record_first_token_time()
+                yield _sse_event('token', {"text": answer})
+            else:
+                llm_stats = {}
+                # Includes the time spent handing tokens to the client, which paces the stream
+                with monitor.span('llm', phases=llm_stats, streamed=True):
+                    try:
+                        for delta in stream_mistral(full_prompt, language, stats=llm_stats):
+                            monitor.record_first_token_time()
+                            parts.append(delta)
+                            yield _sse_event('token', {"text": delta})
+                    except LLMOverloadedError as e:
+                        error = str(e)
+                        yield _sse_event('error', {"error": "The AI model is busy right now. Please try again in a moment.", "overloaded": True})
+                    except Exception as e:
+                        error = describe_llm_error(e, full_prompt, DEFAULT_TIMEOUT)
+                        yield _sse_event('error', {"error": error})
+
+                answer = "".join(parts)
+                if error:
+                    answer = answer or error
+                elif is_garbled_response(answer):
+                    # Tokens were already shown; the client swaps in the replacement
+                    answer = garbled_fallback(full_prompt)
+                elif not answer.startswith('⚠️'):
+                    answer_cache.store(user_prompt, context['query_embedding'], language, fingerprints, answer)
+
+            query_log_entry = log_stream(answer, error)
+            logged = True
+
+            yield _sse_event('done', {
+                "response": answer,
+                "query": user_prompt,
+                "language": language,
+                "query_id": str(query_log_entry.query_uuid) if query_log_entry else None,
+                "cache_hit": cached_answer is not None
+            })
+        finally:
+            if not logged:
+                # The client went away mid-stream (Django closes the generator): log what was sent
+                log_stream("".join(parts), aborted=True)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+
+# Embedding and ChromaDB search are blocking, CPU-bound calls; the async ask
+# path runs them here so the event loop stays free for in-flight LLM requests
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('RETRIEVAL_EXECUTOR_WORKERS', 4)),
+    thread_name_prefix='retrieval'
+)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def ask_async_view(request):
+    """
+    Async variant of ask_view for the ASGI entry point (config.asgi).
+    The LLM call is awaited on a pooled httpx client instead of blocking a
+    worker thread, so one process can hold many in-flight generations.
+    """
+    monitor = PerformanceMonitor().start_monitoring()
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"error": "Request body must be JSON"}, status=400)
+
+    serializer = PromptSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    user_prompt = serializer.validated_data['prompt']
+    language = serializer.validated_data['language']
+    filters = filters_from_request(serializer.validated_data)
+    mode = serializer.validated_data.get('retrieval_mode')
+
+    try:
+        result, coalesced, followers = await ask_flights.ado(
+            ask_flight_key(user_prompt, language, filters, mode),
+            lambda: arun_ask_pipeline(user_prompt, language, monitor, filters, mode)
+        )
+        context = result['context']
+
+        query_log_entry = await monitor.alog_query(
+            query_text=user_prompt,
+            language=language,
+            response_text=result['answer'],
+            context_chunks=context['chunks'],
+            relevance_scores=relevance_from_distances(context['distances']),
+            metadata={**pipeline_log_metadata(language, result, coalesced, followers), 'async': True}
+        )
+
+        return JsonResponse(pipeline_response_data(user_prompt, language, result, query_log_entry, coalesced))
+
+    except LLMOverloadedError as e:
+        await monitor.alog_query(
+            query_text=user_prompt,
+            language=language,
+            response_text=f"Error: {str(e)}",
+            context_chunks=[],
+            relevance_scores=[],
+            metadata={'error': str(e), 'failed': True, 'overloaded': True, 'async': True}
+        )
+
+        return JsonResponse({
+            "error": "The AI model is busy right now. Please try again in a moment.",
+            "query": user_prompt,
+            "language": language
+        }, status=503)
+
+    except Exception as e:
+        await monitor.alog_query(
+            query_text=user_prompt,
+            language=language,
+            response_text=f"Error: {str(e)}",
+            context_chunks=[],
+            relevance_scores=[],
+            metadata={'error': str(e), 'failed': True, 'async': True}
+        )
+
+        return JsonResponse({
+            "error": f"An error occurred while processing your request: {str(e)}",
+            "query": user_prompt,
+            "language": language
+        }, status=500)
 
 # Create your views here.
 # @api_view(['POST'])
@@ -147,18 +521,15 @@ def upload_and_embed_view(request):
         # Save file info to DB
         doc_instance = serializer.save()
         
-        # Extract just the filename from the full path (e.g., 'documents/file.pdf' -> 'file.pdf')
-        import os
-        file_name = os.path.basename(doc_instance.file.name)
-        language = doc_instance.language
-        
-        # Trigger embedding
-        result = embed_and_store(file_name, language)
+        # Queue embedding for the ingestion worker instead of running it in the request
+        job = enqueue_ingestion(doc_instance, job_type='embed')
 
         return Response({
-            "message": result,
+            "message": f"Document uploaded, embedding queued as job #{job.id}",
+            "job_id": job.id,
+            "job_status_url": reverse('ingestion_job_status', args=[job.id]),
             "document": UploadedDocumentSerializer(doc_instance).data
-        }, status=status.HTTP_201_CREATED)
+        }, status=status.HTTP_202_ACCEPTED)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -224,13 +595,16 @@ def delete_document(request, doc_id):
         
         # Delete embeddings from ChromaDB
         try:
-            # Get all chunks for this document
+            # Get all chunks for this document (stored under the bare file name)
             results = collection.get(
-                where={"source_document": {"$eq": file_name}}
+                where={"source_document": {"$eq": os.path.basename(file_name)}}
             )
             
             if results['ids']:
                 collection.delete(ids=results['ids'])
+                answer_cache.invalidate_chunks(results['ids'])
+                lexical_index.delete_chunks(results['ids'])
+                metrics.set_chroma_chunks(collection.count())
                 print(f"Deleted {len(results['ids'])} chunks from ChromaDB for {file_name}")
         except Exception as e:
             print(f"Error deleting from ChromaDB: {e}")
@@ -257,29 +631,38 @@ def delete_document(request, doc_id):
 
 @api_view(['POST'])
 def re_embed_document(request, doc_id):
-    """Re-embed a document (useful if embedding failed)"""
+    """Re-embed a document; only chunks whose content changed are re-encoded"""
     try:
         from .models import UploadedDocument
-        import os
         
         document = UploadedDocument.objects.get(id=doc_id)
-        # Extract just the filename from the full path (e.g., 'documents/file.pdf' -> 'file.pdf')
-        file_name = os.path.basename(document.file.name)
-        language = document.language
         
-        # Re-trigger embedding
-        result = embed_and_store(file_name, language)
+        # Queue re-embedding for the ingestion worker
+        job = enqueue_ingestion(document, job_type='re_embed')
+        document.processing_notes = f"Re-embedding queued as job #{job.id}"
+        document.save(update_fields=['processing_notes'])
         
         return Response({
-            'message': f'Document re-embedded successfully: {result}',
-            'document_id': doc_id
-        })
+            'message': f'Document re-embedding queued as job #{job.id}',
+            'document_id': doc_id,
+            'job_id': job.id,
+            'job_status_url': reverse('ingestion_job_status', args=[job.id])
+        }, status=status.HTTP_202_ACCEPTED)
         
     except UploadedDocument.DoesNotExist:
         return Response({'error': 'Document not found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@api_view(['GET'])
+def ingestion_job_status(request, job_id):
+    """Report progress, per-stage timings and errors for an ingestion job"""
+    try:
+        job = IngestionJob.objects.select_related('document').get(id=job_id)
+        return Response({'job': IngestionJobSerializer(job).data})
+    except IngestionJob.DoesNotExist:
+        return Response({'error': 'Job not found'}, status=404)
+
 @api_view(['PUT'])
 def update_document(request, doc_id):
     """Update document metadata"""
@@ -300,6 +683,10 @@ def update_document(request, doc_id):
                 setattr(document, field, request.data[field])
         
         document.save()
+
+        # Keep the copies in chunk metadata in step, so search filters see the change
+        if any(field in request.data for field in document_chunk_metadata(document)):
+            refresh_document_metadata(os.path.basename(document.file.name), document_chunk_metadata(document))
         
         # Return updated document data
         serializer = UploadedDocumentSerializer(document)
@@ -464,7 +851,9 @@ def rate_response(request):
             return Response({"error": "query_id is required"}, status=400)
         
         try:
-            query_log = QueryLog.objects.get(id=query_id)
+            query_log = find_query_log(query_id)
+            previous_rating = query_log.user_rating
+            previous_relevance = query_log.response_relevance
             
             # Handle different feedback types
             if feedback_type == 'rating':
@@ -481,6 +870,7 @@ def rate_response(request):
                 query_log.response_relevance = response_relevance
                 
             query_log.save()
+            PerformanceMonitor.record_feedback(query_log, previous_rating, previous_relevance)
             
             # Also log the action for analytics
             UserAction.objects.create(
@@ -538,7 +928,12 @@ def system_stats(request):
             "total_queries": QueryLog.objects.count(),
             "languages": QueryLog.objects.values('language').annotate(
                 count=Count('id')
-            ).order_by('-count')
+            ).order_by('-count'),
+            # Per-stage p50/p90/p95/p99 (ms) from the daily latency histograms
+            "latency_percentiles": {
+                "today": stage_percentiles(days=1),
+                "last_week": stage_percentiles(days=7),
+            }
         }
         
         return Response({"stats": stats})
@@ -5,6 +5,8 @@ from core.serializers import PromptSerializer
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 from core.models import QueryLog, SystemPerformanceMetrics
+from core.monitoring import PerformanceMonitor
+from core.query_log_writer import find_query_log
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_http_methods
@@ -157,9 +159,11 @@ def rate_response(request):
         if not query_id or rating is None:
             return JsonResponse({'error': 'Missing query_id or rating'}, status=400)
         
-        query = QueryLog.objects.get(id=query_id)
+        query = find_query_log(query_id)
+        previous_rating = query.user_rating
         query.user_rating = rating
         query.save()
+        PerformanceMonitor.record_feedback(query, previous_rating, query.response_relevance)
         
         return JsonResponse({'status': 'success', 'message': 'Rating saved'})
         
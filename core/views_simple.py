@@ -1,9 +1,20 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
 from datetime import datetime, timedelta
 from django.db.models import Avg, Count
 from core.models import QueryLog, SystemPerformanceMetrics
+from core.embedding_cache import query_embedding_cache
+from core.answer_cache import answer_cache
+from core.gpt_client import llm_client
+from core.coalescing import ask_flights
+from core.embedding_batcher import query_batcher
+from core.embedding_server import embedding_client
+from core import warmup
+from core.lexical_index import lexical_index
+from core.query_log_writer import query_log_writer
+from core.latency_histograms import stage_percentiles, percentile_trend
+from core import metrics
 import json
 
 def dashboard_main_view(request):
@@ -48,7 +59,12 @@ def monitoring_stats(request):
             'avg_relevance': recent_stats['avg_relevance'] or 0,
             'count': recent_stats['count']
         },
-        'languages': list(languages)
+        'languages': list(languages),
+        'latency_percentiles': stage_percentiles(days=1),
+        'embedding_cache': query_embedding_cache.stats(),
+        'answer_cache': answer_cache.stats(),
+        'embedding_batcher': query_batcher.stats(),
+        'query_log_writer': query_log_writer.stats()
     }
     
     return JsonResponse({'stats': stats})
@@ -175,8 +191,15 @@ def performance_trends(request):
     else:
         relevance_distribution = [0, 0, 0]
     
+    # Daily response time percentiles from the latency histograms, in seconds like the averages
+    response_time_percentiles = [
+        {'date': day['date'], **{name: (day[name] or 0) / 1000 for name in ('p50', 'p90', 'p95', 'p99')}}
+        for day in percentile_trend('response', days=7, start=last_week.date())
+    ]
+    
     return JsonResponse({
         'response_time_trend': response_time_trend,
+        'response_time_percentiles': response_time_percentiles,
         'query_volume_trend': query_volume_trend,
         'relevance_distribution': relevance_distribution
     })
@@ -188,5 +211,22 @@ def system_health(request):
         'status': 'healthy',
         'model_status': 'online',
         'database_status': 'connected',
+        'embedding_cache': query_embedding_cache.stats(),
+        'answer_cache': answer_cache.stats(),
+        'llm_queue': llm_client.stats(),
+        'llm_backends': llm_client.router.stats(),
+        'ask_coalescing': ask_flights.stats(),
+        'embedding_batcher': query_batcher.stats(),
+        'embedding_server': embedding_client.stats(),
+        'warmup': warmup.last_warmup,
+        'lexical_index': lexical_index.stats(),
+        'query_log_writer': query_log_writer.stats(),
         'last_check': datetime.now().isoformat()
     })
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; reads in-process counters only, no database queries"""
+    if not metrics.enabled():
+        return HttpResponse("prometheus_client is not installed\n", status=503, content_type='text/plain')
+    body, content_type = metrics.exposition()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,91 @@
+# core/warmup.py
+import os
+import subprocess
+import sys
+import time
+
+# Warm gunicorn workers up before they take traffic (post_worker_init in
+# config/gunicorn.conf.py). Off by default with an embedding server: the model
+# lives there, and a worker warming up while it is down would load its own copy.
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', '0' if os.getenv('EMBEDDING_SERVER_URL') else '1') == '1'
+
+# Timings of the last warm_up() in this process, for the health endpoint
+last_warmup = None
+
+def warm_up():
+    """
+    Load everything the first query needs so the first user request isn't
+    the slow one: the embedding model (or a round trip to the embedding
+    server), one forward pass, and the Chroma collection with its index.
+    Returns the time each step took, in milliseconds.
+    """
+    global last_warmup
+    from core import metrics
+    from core.chroma_client import get_collection
+    from core.embedding_utils import embedding_client, get_embedding_model
+
+    timings = {}
+    start = time.perf_counter()
+
+    step = time.perf_counter()
+    if not embedding_client.remote:
+        get_embedding_model()
+    timings['model_load_ms'] = int((time.perf_counter() - step) * 1000)
+
+    # The first forward pass allocates buffers and is much slower than later ones
+    step = time.perf_counter()
+    embedding = embedding_client.encode("warm-up")
+    timings['first_encode_ms'] = int((time.perf_counter() - step) * 1000)
+
+    step = time.perf_counter()
+    collection = get_collection()
+    timings['chroma_open_ms'] = int((time.perf_counter() - step) * 1000)
+
+    # A query loads the collection's vector index into memory
+    step = time.perf_counter()
+    chunk_count = collection.count()
+    metrics.set_chroma_chunks(chunk_count)
+    if chunk_count > 0:
+        collection.query(query_embeddings=[embedding.tolist()], n_results=1)
+    timings['chroma_query_ms'] = int((time.perf_counter() - step) * 1000)
+
+    timings['total_ms'] = int((time.perf_counter() - start) * 1000)
+    last_warmup = timings
+    return timings
+
+def warm_up_on_start():
+    """Called from gunicorn's post_worker_init hook; never lets a warm-up failure stop the server"""
+    if not WARMUP_ON_START:
+        return None
+    try:
+        timings = warm_up()
+        print(f"Warm-up finished in {timings['total_ms']}ms: {timings}")
+        return timings
+    except Exception as e:
+        print(f"Warm-up failed, first request will load lazily: {e}")
+        return None
+
+def measure_cold_import():
+    """
+    Time django.setup() plus importing the URLconf (and so every view
+    module) in a fresh interpreter, the work every manage.py command does
+    before it starts. Reports whether torch or chromadb got imported.
+    """
+    script = (
+        "import os, sys, time\n"
+        "start = time.perf_counter()\n"
+        "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')\n"
+        "import django\n"
+        "django.setup()\n"
+        "import config.urls\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(elapsed, 'torch' in sys.modules, 'chromadb' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True
+    ).stdout.strip().splitlines()[-1].split()
+    return {
+        'import_ms': int(float(output[0]) * 1000),
+        'torch_loaded': output[1] == 'True',
+        'chromadb_loaded': output[2] == 'True',
+    }
@@ -224,7 +224,7 @@ function dashboard() {
             this.charts.responseTime = new Chart(responseTimeCtx, {
                 type: 'line',
                 data: {
-                    labels: this.generateTimeLabels(),
+                    labels: this.responseTimeLabels(),
                     datasets: [{
                         label: 'Response Time (ms)',
                         data: this.generateResponseTimeData(),
@@ -233,14 +233,16 @@ function dashboard() {
                         borderWidth: 2,
                         fill: true,
                         tension: 0.4
-                    }]
+                    },
+                    ...this.responseTimePercentileDatasets()]
                 },
                 options: {
                     responsive: true,
                     maintainAspectRatio: false,
                     plugins: {
                         legend: {
-                            display: false
+                            // Only useful once the percentile lines are there
+                            display: this.hasResponseTimePercentiles()
                         }
                     },
                     scales: {
@@ -320,7 +322,13 @@ function dashboard() {
         updateCharts() {
             // Update chart data with new information
             if (this.charts.responseTime) {
+                this.charts.responseTime.data.datasets = [
+                    this.charts.responseTime.data.datasets[0],
+                    ...this.responseTimePercentileDatasets()
+                ];
+                this.charts.responseTime.data.labels = this.responseTimeLabels();
                 this.charts.responseTime.data.datasets[0].data = this.generateResponseTimeData();
+                this.charts.responseTime.options.plugins.legend.display = this.hasResponseTimePercentiles();
                 this.charts.responseTime.update();
             }
 
@@ -335,6 +343,16 @@ function dashboard() {
             }
         },
 
+        responseTimeLabels() {
+            // The trend endpoint reports one point per day
+            if (this.performanceTrends && this.performanceTrends.response_time_trend) {
+                return this.performanceTrends.response_time_trend.map(item =>
+                    new Date(item.date).toLocaleDateString('en-US', { month: 'short', day: 'numeric' })
+                );
+            }
+            return this.generateTimeLabels();
+        },
+
         generateTimeLabels() {
             const labels = [];
             for (let i = 23; i >= 0; i--) {
@@ -356,6 +374,31 @@ function dashboard() {
             );
         },
 
+        hasResponseTimePercentiles() {
+            return !!(this.performanceTrends && this.performanceTrends.response_time_percentiles);
+        },
+
+        responseTimePercentileDatasets() {
+            // Daily p50/p95/p99 from the server's latency histograms (seconds -> ms)
+            if (!this.hasResponseTimePercentiles()) return [];
+            const percentiles = this.performanceTrends.response_time_percentiles;
+            const lines = [
+                { key: 'p50', color: 'rgb(34, 197, 94)' },
+                { key: 'p95', color: 'rgb(251, 191, 36)' },
+                { key: 'p99', color: 'rgb(239, 68, 68)' }
+            ];
+            return lines.map(line => ({
+                label: line.key + ' (ms)',
+                data: percentiles.map(item => item[line.key] * 1000),
+                borderColor: line.color,
+                backgroundColor: 'transparent',
+                borderWidth: 2,
+                borderDash: [4, 4],
+                fill: false,
+                tension: 0.4
+            }));
+        },
+
         generateRelevanceDistribution() {
             // If we have real trend data, use it
             if (this.performanceTrends && this.performanceTrends.relevance_distribution) {
@@ -538,7 +581,7 @@ function fileUpload() {
                         this.uploadProgress = ((i + 1) / this.selectedFiles.length) * 100;
                         
                         if (i === this.selectedFiles.length - 1) {
-                            this.uploadStatus = `Successfully uploaded and embedded ${this.selectedFiles.length} document(s)`;
+                            this.uploadStatus = `Successfully uploaded ${this.selectedFiles.length} document(s); embedding has been queued`;
                             this.uploadSuccess = true;
                             this.selectedFiles = [];
                             await this.loadDocuments();
@@ -724,6 +767,55 @@ style.textContent = `
 `;
 document.head.appendChild(style);
 
+// POST a question to the streaming ask endpoint and dispatch its server-sent events
+async function streamAsk(prompt, language, handlers) {
+    const response = await fetch(`${API_BASE}/api/ask/stream/`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            prompt: prompt,
+            language: language
+        })
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error(`Streaming request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) continue;
+
+            const payload = JSON.parse(data);
+            if (eventName === 'context' && handlers.onContext) handlers.onContext(payload);
+            else if (eventName === 'token' && handlers.onToken) handlers.onToken(payload.text);
+            else if (eventName === 'error' && handlers.onError) handlers.onError(payload.error);
+            else if (eventName === 'done' && handlers.onDone) handlers.onDone(payload);
+        }
+    }
+}
+
 // Chat Interface Component
 function chatInterface() {
     return {
@@ -757,43 +849,59 @@ function chatInterface() {
             });
 
             try {
-                const response = await fetch(`${API_BASE}/api/ask/`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
+                const aiMessage = {
+                    type: 'ai',
+                    content: '',
+                    timestamp: new Date(),
+                    contextCount: 0,
+                    status: 'sending',
+                    rating: null,
+                    queryId: null,
+                    regenerationCount: 0,
+                    suggestions: []
+                };
+                let messageAdded = false;
+                const showMessage = () => {
+                    if (!messageAdded) {
+                        this.isTyping = false;
+                        this.chatMessages.push(aiMessage);
+                        messageAdded = true;
+                    }
+                    // Update through the reactive proxy so Alpine re-renders
+                    return this.chatMessages[this.chatMessages.length - 1];
+                };
+
+                // Stream tokens into the message as the model generates them
+                await streamAsk(prompt, 'en', {
+                    onContext: (data) => {
+                        aiMessage.contextCount = data.context_used ? data.context_used.length : 0;
                     },
-                    body: JSON.stringify({
-                        prompt: prompt,
-                        language: 'en'
-                    })
+                    onToken: (text) => {
+                        showMessage().content += text;
+                    },
+                    onError: (error) => {
+                        const message = showMessage();
+                        message.content = message.content
+                            ? `${message.content}\n\n⚠️ ${error}`
+                            : error;
+                        message.status = 'error';
+                    },
+                    onDone: (data) => {
+                        const message = showMessage();
+                        if (message.status !== 'error') {
+                            message.content = data.response;
+                            message.status = 'sent';
+                            message.suggestions = this.generateFollowUpSuggestions(data.response, prompt);
+                        }
+                        message.queryId = data.query_id; // Store query ID for feedback tracking
+                    }
                 });
 
-                this.isTyping = false;
-
-                if (response.ok) {
-                    const data = await response.json();
-                    const aiMessage = {
-                        type: 'ai',
-                        content: data.response,
-                        timestamp: new Date(),
-                        contextCount: data.context_used ? data.context_used.length : 0,
-                        status: 'sent',
-                        rating: null,
-                        queryId: data.query_id, // Store query ID for feedback tracking
-                        regenerationCount: 0,
-                        suggestions: this.generateFollowUpSuggestions(data.response, prompt)
-                    };
-                    this.chatMessages.push(aiMessage);
-                } else {
-                    const errorMessage = {
-                        type: 'ai',
-                        content: 'Sorry, I encountered an error while processing your question. Please try again.',
-                        timestamp: new Date(),
-                        contextCount: 0,
-                        status: 'error',
-                        suggestions: []
-                    };
-                    this.chatMessages.push(errorMessage);
+                // The connection closed before the 'done' event
+                if (aiMessage.status === 'sending' || !messageAdded) {
+                    const message = showMessage();
+                    message.content = message.content || 'The response was interrupted. Please try again.';
+                    message.status = 'error';
                 }
             } catch (error) {
                 console.error('Error sending message:', error);
@@ -1208,7 +1316,7 @@ function documentManager() {
                 }
 
                 this.uploadSuccess = true;
-                this.uploadStatus = `Successfully uploaded ${this.selectedFiles.length} document(s) and created embeddings.`;
+                this.uploadStatus = `Successfully uploaded ${this.selectedFiles.length} document(s). Embeddings are being created in the background.`;
                 this.selectedFiles = [];
                 this.showLanguageSelector = false;
                 this.showMetadataForm = false;